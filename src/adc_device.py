@@ -0,0 +1,113 @@
+import machine
+import array
+
+class ADC_Sampler:
+    '''
+    Samples a set of ADC channels round-robin from a timer, one channel per tick
+
+    Each channel keeps an exponentially filtered value and the min/max raw reading seen
+    since it was last read, all in preallocated arrays so the timer callback never allocates.
+    '''
+    FILTER_FRACTION_BITS = 4 #filtered values are kept as read_u16() * 16
+
+    def __init__(self, adcs, period_ms: int = 5, filter_shift: int = 3):
+        '''
+        Args:
+            adcs: machine.ADC for each channel, channels are numbered in this order
+            period_ms: time between samples, each channel is sampled every len(adcs) * period_ms
+            filter_shift: EMA weight of a new sample is 1 / 2^filter_shift
+        '''
+        self.adcs = tuple(adcs)
+        self.period_ms = period_ms
+        self.filter_shift = filter_shift
+
+        channels = len(self.adcs)
+        self.filtered = array.array('i', [0] * channels)
+        self.minimum = array.array('H', [0xFFFF] * channels)
+        self.maximum = array.array('H', [0] * channels)
+        self.sample_count = array.array('I', [0] * channels)
+
+        self.channel = 0
+        self.running = False
+        self.timer = machine.Timer()
+        self.callback = self.sample #bind once, a bound method lookup allocates
+
+    def start(self):
+        '''
+        Prime every channel with one reading and start sampling in the background
+        '''
+        for channel in range(len(self.adcs)):
+            self.sample_channel(channel)
+
+        self.timer.init(period=self.period_ms, mode=machine.Timer.PERIODIC, callback=self.callback)
+        self.running = True
+
+    def stop(self):
+        '''
+        Stop background sampling, e.g. so the timer doesn't end every lightsleep within period_ms.
+        sample() can still be called by hand meanwhile
+        '''
+        if self.running:
+            self.timer.deinit()
+            self.running = False
+
+    def resume(self):
+        '''
+        Restart background sampling after stop(), the filters carry on where they were
+        '''
+        if not self.running:
+            self.timer.init(period=self.period_ms, mode=machine.Timer.PERIODIC, callback=self.callback)
+            self.running = True
+
+    def sample(self, timer=None):
+        '''
+        Timer callback, samples the next channel in turn
+        '''
+        self.sample_channel(self.channel)
+
+        self.channel += 1
+        if self.channel >= len(self.adcs):
+            self.channel = 0
+
+    def sample_channel(self, channel: int):
+        '''
+        Take one reading of channel and fold it into its filter and min/max
+        '''
+        raw = self.adcs[channel].read_u16()
+        value = raw << self.FILTER_FRACTION_BITS
+
+        if self.sample_count[channel] == 0:
+            self.filtered[channel] = value
+        else:
+            self.filtered[channel] += (value - self.filtered[channel]) >> self.filter_shift
+        self.sample_count[channel] += 1
+
+        if raw < self.minimum[channel]:
+            self.minimum[channel] = raw
+        if raw > self.maximum[channel]:
+            self.maximum[channel] = raw
+
+    def value(self, channel: int):
+        '''
+        Filtered reading of channel on the read_u16() scale
+        '''
+        return self.filtered[channel] / (1 << self.FILTER_FRACTION_BITS)
+
+    def read(self, channel: int):
+        '''
+        Filtered reading plus the min/max raw readings since the last read() of channel, then restart min/max
+
+        Returns:
+            (filtered, minimum, maximum) on the read_u16() scale
+        '''
+        state = machine.disable_irq() #keep the timer from updating min/max halfway through
+        minimum = self.minimum[channel]
+        maximum = self.maximum[channel]
+        self.minimum[channel] = 0xFFFF
+        self.maximum[channel] = 0
+        machine.enable_irq(state)
+
+        if minimum > maximum: #nothing sampled since the last read
+            minimum = maximum = self.filtered[channel] >> self.FILTER_FRACTION_BITS
+
+        return self.value(channel), minimum, maximum
@@ -0,0 +1,236 @@
+'''
+Task-based runtime for the balloon, an alternative to calling Balloon.tick() every 10 ms
+
+Each job gets its own cooperative task and they hand work to each other through events:
+
+    gps_reader  --fix_event-->  scheduler  <--frame_ready--  frame_builder  <--build_request--+
+    sensors (altimeter, keeps Balloon.altimeter.measurement fresh)                            |
+    PPS IRQ  --pps_flag-->  scheduler  --tx_start-->  transmitter  --tx_done (tone timer)-----+
+
+Nothing spins: tasks sleep until their event fires or their next poll is due, so the only
+latency at the transmit start is the PPS flag waking the scheduler. New sensors get their
+own task next to sensor_task().
+
+With power_save the CPU is clocked down (Balloon.power) while a frame waits for its slot and
+while the tone timer plays it, and back up to build frames and start them; it never lightsleeps,
+the tasks need the timers. GPS duty cycling is refused: frames go out back to back, so there is
+no gap to put the GPS in standby, and the scheduler needs a GGA every second.
+'''
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+
+import machine
+import time
+
+import uart_device
+
+class AsyncRuntime:
+    def __init__(self, balloon, gps_poll_ms: int = 50, sensor_period_ms: int = 10000):
+        '''
+        Args:
+            balloon: a Balloon that passed its self-test
+            gps_poll_ms: how often the UART buffer is drained, must fit an epoch in the RX buffer
+            sensor_period_ms: how often the altimeter is read in the background
+        '''
+        self.b = balloon
+        self.gps_poll_ms = gps_poll_ms
+        self.sensor_period_ms = sensor_period_ms
+
+        self.pps_flag = asyncio.ThreadSafeFlag() #set from the PPS interrupt
+        self.tx_done = asyncio.ThreadSafeFlag() #set from the tone timer after the last tone
+        self.fix_event = asyncio.Event() #new GGA parsed
+        self.build_request = asyncio.Event() #builder should prepare the next frame
+        self.frame_ready = asyncio.Event() #self.b.message holds the next frame
+        self.tx_start = asyncio.Event() #transmitter should start now
+
+        self.clock_ready = False
+        self.frame_text = ""
+
+        # Worst delay from a PPS edge to the tone timer starting, in us
+        self.pps_latency_us = 0
+
+    def pps_interrupt(self, pin):
+        '''
+        Hard IRQ on the PPS pin: Balloon stamps the edge and schedules its work, then wake the scheduler
+        '''
+        self.b.pps_interrupt(pin)
+        self.pps_flag.set()
+
+    def set_state(self, state: str):
+        '''
+        Keep Balloon.state meaningful so the PPS LED patterns and status prints still work
+        '''
+        if state != self.b.state:
+            self.b.state = state
+            print("{} - {}".format(state, self.b.pps_count))
+
+    async def gps_task(self):
+        '''
+        Drain the GPS UART and announce every new GGA
+        '''
+        gga_count = 0
+
+        while True:
+            self.b.gps.poll()
+            self.b.poll_transmitter() #core 1 transmitter, if used, is polled for the end of a message
+
+            if self.b.gps.fix_count["GGA"] != gga_count:
+                gga_count = self.b.gps.fix_count["GGA"]
+                self.fix_event.set()
+
+            await asyncio.sleep_ms(self.gps_poll_ms)
+
+    async def sensor_task(self):
+        '''
+        Read the altimeter in the background, sleeping through its conversions
+        '''
+        altimeter = self.b.altimeter
+
+        while True:
+            altimeter.start_measurement(self.b.altimeter_osr)
+
+            while not altimeter.poll_measurement():
+                await asyncio.sleep_ms(altimeter.conversion_remaining_us() // 1000 + 1)
+
+            await asyncio.sleep_ms(self.sensor_period_ms)
+
+    async def wait_for_fix(self):
+        '''
+        Same start condition as the tick state machine: GPS time is running and satellites are in view
+        '''
+        self.set_state("wait_for_time")
+        gga = self.b.gps.gga
+
+        while True:
+            await self.fix_event.wait()
+            self.fix_event.clear()
+
+            print("{}       ".format(gga[uart_device.GGA_T_UTC] / 100), end='\r')
+            if gga[uart_device.GGA_T_UTC] // 100 > 10 and gga[uart_device.GGA_SATELLITES] > 0:
+                print()
+                return
+
+    async def builder_task(self):
+        '''
+        Build a frame whenever asked, for the minute the request arrives in (like collect_telemetry)
+        '''
+        rmc = self.b.gps.rmc
+
+        while True:
+            await self.build_request.wait()
+            self.build_request.clear()
+            self.b.power.run_fast()
+            self.set_state("collect_telemetry")
+
+            if not self.clock_ready:
+                self.b.configure_clockgen()
+                self.clock_ready = True
+
+            while True:
+                t_now = rmc[uart_device.RMC_T_UTC] // 100
+                min_now = (t_now // 100) % 10
+
+                self.frame_text = self.b.build_frame(min_now, self.b.message)
+                self.b.log_frame(rmc[uart_device.RMC_DATE], t_now, self.frame_text)
+
+                if not self.b.is_geofenced():
+                    break
+
+                self.set_state("geofenced")
+                await asyncio.sleep_ms(1000)
+
+            if not self.b.prepare_transmission():
+                #set the clock generator up afresh and back off, or every retry logs a frame to flash
+                self.clock_ready = False
+                self.set_state("wait_for_time")
+                await asyncio.sleep_ms(self.b.TX_RETRY_MS)
+                self.build_request.set()
+                continue
+            
+            self.set_state("wait_for_transmit")
+            self.frame_ready.set()
+            self.b.power.run_slow() #only waiting for the slot now
+
+    async def scheduler_task(self):
+        '''
+        Wait for second 59 of an odd minute with a frame ready, then start on the next PPS edge
+        '''
+        gga = self.b.gps.gga
+
+        while True:
+            await self.fix_event.wait()
+            self.fix_event.clear()
+
+            if not self.frame_ready.is_set():
+                continue
+
+            if gga[uart_device.GGA_SATELLITES] == 0:
+                continue #lost lock, hold the frame until the GPS is back
+
+            t_gps = gga[uart_device.GGA_T_UTC] // 100
+            if (t_gps // 100) % 2 == 1 and t_gps % 100 == 59:
+                self.set_state("await_pps")
+                self.b.power.run_fast() #clock up before the edge, not after it
+
+                self.pps_flag.clear() #only an edge after this point counts
+                await self.pps_flag.wait()
+
+                self.frame_ready.clear()
+                self.tx_start.set()
+
+    async def transmitter_task(self):
+        '''
+        Play each frame on the tone timer and ask for the next one when it is done
+        '''
+        while True:
+            await self.tx_start.wait()
+            self.tx_start.clear()
+
+            self.tx_done.clear()
+            self.b.transmit_message()
+
+            latency = time.ticks_diff(time.ticks_us(), self.b.pps_clock.edge_ticks_us)
+            if latency > self.pps_latency_us:
+                self.pps_latency_us = latency
+            self.set_state("transmit")
+            print("Transmitting {} ({} us after PPS, worst {} us)".format(self.frame_text, latency, self.pps_latency_us))
+
+            if self.b.core1_tx is None: #core 1 owns the I2C bus while it plays, no clock change under it
+                self.b.power.run_slow()
+
+            await self.tx_done.wait()
+            self.b.tone_index = 0
+            self.b.instrument.collect() #safe point, nothing is timed until the next slot
+            print(self.b.power.stats())
+            self.build_request.set()
+
+    async def main(self):
+        self.b.background_sensors = True
+
+        if self.b.gps_duty_cycle:
+            print("GPS duty cycling is not supported by the async runtime, keeping the GPS awake")
+            self.b.gps_power.enabled = False
+        self.b.tx_done_flag = self.tx_done
+        self.b.gps_pps.irq(trigger=machine.Pin.IRQ_RISING, handler=self.pps_interrupt, hard=True)
+
+        asyncio.create_task(self.gps_task())
+        asyncio.create_task(self.sensor_task())
+
+        await self.wait_for_fix()
+
+        asyncio.create_task(self.builder_task())
+        asyncio.create_task(self.scheduler_task())
+        asyncio.create_task(self.transmitter_task())
+
+        self.build_request.set()
+
+        while True:
+            await asyncio.sleep_ms(60000)
+
+def run(balloon, **kwargs):
+    '''
+    Run the balloon on the task-based runtime forever
+    '''
+    asyncio.run(AsyncRuntime(balloon, **kwargs).main())
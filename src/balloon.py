@@ -2,21 +2,35 @@ import machine
 import sys
 import time
 import json
+import array
+import micropython
 
 import uart_device
 import spi_device
 import i2c_device
+import adc_device
+import pps_clock
+import power
+import gps_power
 import wspr
+import symbol_timer
+import core1_tx
+import telemetry
+import instrument
+import flight_log
+import history
 
-def adc_avg(adc, counts):
-    adc_sum = 0
-    
-    for i in range(counts):
-        adc_sum += adc.read_u16()
-        
-    return adc_sum / counts
+# ADC_Sampler channel order
+ADC_V_IN = 0
+ADC_V_SOLAR = 1
+ADC_L_FRONT = 2
+ADC_L_BACK = 3
 
 class Balloon:
+    # Back-off before retrying a frame prepare_transmission() refused, so a fault that persists
+    # doesn't log a frame to flash every tick
+    TX_RETRY_MS = 60000
+
     def __init__(self, config_file, geofence_file):
         with open(config_file, "r") as f:
             config = json.load(f)
@@ -35,6 +49,46 @@ class Balloon:
             self.log_to_file = config['log_to_file']
             self.w6nxp_telem_prefix = config['w6nxp_telem_prefix']
             
+            # Optional GPS receiver setup, older config files leave the LIV3 at its defaults
+            self.gps_configure = config.get('gps_configure', False)
+            self.gps_baudrate = config.get('gps_baudrate', 9600)
+            self.gps_fix_rate_hz = config.get('gps_fix_rate_hz', 1.0)
+            
+            # Optional GPS duty cycling: standby between fixes, PPS clock held over on the RP2040 crystal
+            self.gps_duty_cycle = config.get('gps_duty_cycle', False)
+            self.gps_fix_interval_s = config.get('gps_fix_interval_s', 600)
+            self.gps_holdover_s = config.get('gps_holdover_s', 900)
+            
+            # MS5607 oversampling, 0 (256, 0.6 ms) through 4 (4096, 9 ms)
+            self.altimeter_osr = config.get('altimeter_osr', 4)
+            
+            # One ADC channel is sampled per period, round-robin over the 4 rails
+            self.adc_sample_period_ms = config.get('adc_sample_period_ms', 5)
+            
+            # "tick" runs the polling state machine, "async" the task-based runtime (async_runtime.py)
+            self.runtime = config.get('runtime', "tick")
+            
+            # Clock down and lightsleep between PPS edges while waiting to transmit
+            self.power_save = config.get('power_save', False)
+            self.low_clk_mhz = config.get('low_clk_mhz', 24)
+            self.vbus_pin = config.get('vbus_pin', 24)
+            
+            # Timing/heap instrumentation, off for flight unless asked for
+            self.instrument_enabled = config.get('instrument', False)
+            self.instrument_log = config.get('instrument_log', False)
+            
+            # Play transmissions from the RP2040's second core instead of the symbol timer IRQ
+            self.tx_core1 = config.get('tx_core1', False)
+            
+            # Binary flight log in a ring of segment files (flight_log.py), used when log_to_file is set.
+            # Batched records are lost at a power loss, so they are written one at a time by default
+            self.flight_log_slots = config.get('flight_log_slots', 2048)
+            self.flight_log_batch = config.get('flight_log_batch', 1)
+            
+            # Delta-compressed long-term history with hourly summaries (history.py)
+            self.history_enabled = config.get('history', False)
+            self.history_max_kb = config.get('history_max_kb', 256)
+            
             # mod 10 of the time in minutes, determines when telemetry is sent in accordance with https://traquito.github.io/channelmap/
             if config['telemetry_minute'] > 0:
                 self.telemetry_minute = config['telemetry_minute'] #- 1
@@ -97,13 +151,20 @@ class Balloon:
 
         # GPS Init
         gps_uart = machine.UART(GPS_CHANNEL, baudrate=9600,
-                        tx=machine.Pin(GPS_TX), rx=machine.Pin(GPS_RX), timeout=100)
+                        tx=machine.Pin(GPS_TX), rx=machine.Pin(GPS_RX), timeout=100,
+                        rxbuf=1024) #room for a full NMEA epoch between ticks
         gps_wake = machine.Pin(GPS_WAKE, machine.Pin.OUT)
         gps_reset = machine.Pin(GPS_RESET, machine.Pin.OUT)
         self.gps_pps = machine.Pin(GPS_PPS, machine.Pin.IN)
         self.gps = uart_device.LIV3(gps_uart, wake=gps_wake, reset=gps_reset,
                                pps=self.gps_pps)
         
+        # Only GGA and RMC are used, everything else the LIV3 sends is wasted UART time
+        if self.gps_configure:
+            self.gps.configure(sentences=("GGA", "RMC"),
+                               baudrate=self.gps_baudrate,
+                               fix_rate_hz=self.gps_fix_rate_hz)
+        
         # Altimeter Init
         if self.version == "1.0":
             altimeter_spi = machine.SoftSPI(baudrate=100000,
@@ -150,6 +211,12 @@ class Balloon:
         self.l_front_adc = machine.ADC(V_LSENS_TOP_ADC_IN)
         self.l_back_adc = machine.ADC(V_LSENS_BOT_ADC_IN)
         
+        # Rails are sampled in the background so telemetry reads are instant and dips show up in min/max
+        self.adc_sampler = adc_device.ADC_Sampler((self.v_in_adc, self.v_solar_adc,
+                                                   self.l_front_adc, self.l_back_adc),
+                                                  period_ms=self.adc_sample_period_ms)
+        self.adc_sampler.start()
+        
         # LED
         self.led = machine.Pin(LED, machine.Pin.OUT)
         
@@ -157,37 +224,89 @@ class Balloon:
         self.pps_count = 0
         self.last_pps = 0
         
+        # UTC from counting PPS edges once latched, so scheduling needs no NMEA
+        self.pps_clock = pps_clock.PPSClock()
+        self.pps_work_ref = self.pps_work #bind once, the PPS hard IRQ can't allocate
+        self.tx_edge = -1 #pps_clock.edge_count to start transmitting on, -1 = not armed
+        self.tx_started = False
+        self.tx_retry_ticks = None #time.ticks_ms() before which wait_for_time holds, None = no hold
+        
+        # Standby between fixes, the PPS clock carries the schedule meanwhile
+        self.gps_power = gps_power.GPSPowerManager(self.gps, self.pps_clock, enabled=self.gps_duty_cycle)
+        if self.gps_duty_cycle:
+            self.pps_clock.enable_holdover(self.gps_holdover_s * 1000, self.pps_second)
+        
+        # Number of GGA sentences already acted on, see LIV3.fix_count
+        self.last_gga_count = 0
+        
         # WSPR message
         self.tone_index = 0
-        self.message = []
+        
+        # Tone path: the symbol timer's hard IRQ stamps each symbol start and schedules the bus work
+        self.symbol_ticks = array.array('i', [0] * 163) #ticks_us of each symbol start, [162] is the end
+        self.tone_pending = False #bus work scheduled but not run yet
+        self.tone_overruns = 0 #symbol starts that found the previous bus work still pending
+        self.tone_symbol = 0 #newest symbol boundary the IRQ has seen
+        self.tone_irq = self.tone_interrupt #bind once, a bound method lookup allocates
+        self.tone_work = self.transmit_next_tone
+        self.message = bytearray(162) #symbol buffer, filled in place by the encoder
+        self.frame_cache = wspr.FrameCache(8)
+        
+        # Next cycle's frame, built while the current one is transmitting
+        self.next_message = bytearray(162)
+        self.next_text = ""
+        self.next_slot = None #minute (mod 10) that collect_telemetry will see for the next frame
+        self.next_ready = False
         
         self.offset_index = 0
         self.output = CLKGEN_OUTPUT
         
+        # PLL register images for the 4 tones, filled in by configure_clockgen()
+        self.tone_images = None
+        
+        # Set when another runtime keeps GPS/altimeter readings fresh, so update_telemetry must not block
+        self.background_sensors = False
+        
+        # Optional flag with a set() method, signalled when the last tone of a message has played
+        self.tx_done_flag = None
+        
         # WSPR constants
-        self.tone_period = 683 #ms
+        self.tone_period = 683 #ms, nominal, the symbol timer keeps the exact 8192/12000 s
         self.tone_spacing = 1.465 #Hz
         self.message_length = 162 #tones
         
-        # Transmit timer
-        self.timer = machine.Timer(period=self.tone_period, mode = machine.Timer.PERIODIC,
-                   callback=None)
-        self.timer.deinit()
+        # Transmit timer, symbol boundaries locked to the PPS edge the message starts on
+        self.symbol_timer = symbol_timer.SymbolTimer(self.tone_irq, self.message_length)
+        
+        # Or the whole transmit engine on core 1, fed frames through a double buffer (see core1_tx.py)
+        self.core1_tx = None
+        self.core1_done = 0 #core1_tx.done_count when the current message started
+        if self.tx_core1:
+            self.core1_tx = core1_tx.Core1Transmitter(self.clockgen, self.output, self.message_length)
         
         # Set state
         self.state = "init"
         
-        # Init telemetry dict
-        self.telemetry = {"lat_deg": 0.0,
-                          "lon_deg": 0.0,
-                          "alt_m": 0.0,
-                          "satellites": 0,
-                          "temp_c": 0.0,
-                          "p_mbar": 0.0,
-                          "v_in": 0.0,
-                          "v_solar": 0.0,
-                          "l_front": 0.0,
-                          "l_back": 0.0}
+        # Timing histograms per state and hot function, see instrument.py ('i' + ENTER dumps them)
+        self.instrument = instrument.Instrument(enabled=self.instrument_enabled)
+        self.instrument_log_ticks = time.ticks_ms() #last rewrite of instrument.txt
+        self.tone_isr_slot = self.instrument.slot("tone_isr")
+        self.tone_jitter_slot = self.instrument.slot("tone_jitter")
+        self.instrument.wrap(self, "update_telemetry")
+        self.instrument.wrap(self, "build_frame")
+        self.instrument.wrap(wspr, "generate_wspr_symbols")
+        
+        # Fixed-layout telemetry record, updated in place every cycle
+        self.telemetry = telemetry.Telemetry()
+        
+        # Each frame and its telemetry, as fixed-size records appended to a ring of segment files
+        self.flight_log = flight_log.FlightLog("flight", slots=self.flight_log_slots,
+                                               batch_records=self.flight_log_batch)
+        
+        # Every frame's telemetry again, compressed to keep weeks of it (the flight log wraps after days)
+        self.history = None
+        if self.history_enabled:
+            self.history = history.History("history.bin", max_bytes=self.history_max_kb * 1024)
         
         # Don't init watchdog to start
         self.watchdog = None
@@ -200,11 +319,83 @@ class Balloon:
         self.clk_mhz = 48
         print(f"Setting system clock to {self.clk_mhz} MHz")
         machine.freq(int(self.clk_mhz * 1e6))
+        
+        self.power = power.PowerScheduler(high_mhz=self.clk_mhz, low_mhz=self.low_clk_mhz,
+                                          vbus_pin=self.vbus_pin, enabled=self.power_save)
+        self.power.clock_change_callbacks.append(self.reinit_gps_uart) #UART divider follows the system clock
 
-        # Start GPS interrupt only after everything else succeeds
-        self.gps_pps.irq(trigger=machine.Pin.IRQ_RISING, handler=self.pps_interrupt)
+        if self.core1_tx is not None:
+            self.core1_tx.start_thread()
+        
+        # Start GPS interrupt only after everything else succeeds. Hard, so edge_ticks_us is the edge itself
+        self.gps_pps.irq(trigger=machine.Pin.IRQ_RISING, handler=self.pps_interrupt, hard=True)
 
+    def reinit_gps_uart(self):
+        self.gps.set_baudrate(self.gps.baudrate)
+    
+    def idle(self):
+        '''
+        Wait between ticks. While only a PPS edge is awaited the CPU clocks down and lightsleeps
+        up to just before each edge; the clock is back up one edge before the transmission starts.
+        The ADC sampler's timer is stopped meanwhile and one rail is sampled per edge instead.
+        While the symbol timer plays a message, or the loop waits for the PPS clock to latch, it
+        only polls, so it stays at the low clock and sleeps normally (the tone IRQs and UART need
+        the timers and interrupts).
+        '''
+        if (self.state == "await_pps" and self.pps_clock.is_latched() and not self.pps_clock.in_holdover
+                and self.pps_clock.edge_count + 1 < self.tx_edge and self.core1_tx is None):
+            if self.power.enabled:
+                self.adc_sampler.stop() #its timer would wake the core every adc_sample_period_ms
+            self.power.run_slow()
+            self.power.sleep_for(1000 - self.pps_clock.subsecond_us() // 1000, deep=True)
+            if not self.adc_sampler.running:
+                self.adc_sampler.sample() #one rail per PPS edge meanwhile, round-robin
+            return
+        
+        self.adc_sampler.resume()
+        if self.state == "wait_for_transmit" or (self.state == "transmit" and self.core1_tx is None):
+            #core 1 owns the I2C bus while it plays, no clock change under it
+            self.power.run_slow()
+            self.power.sleep_for(10)
+        else:
+            self.power.run_fast()
+            self.power.sleep_for(10)
+    
     def pps_interrupt(self, *args):
+        '''
+        Hard IRQ on the PPS pin, allocation free: stamp the edge and leave the rest to pps_work()
+        '''
+        micropython.schedule(self.pps_work_ref, self.pps_clock.pps_edge())
+    
+    def pps_work(self, new_second: bool):
+        '''
+        Scheduled after each PPS edge, runs late behind GC or bus work without moving the edge time
+        '''
+        self.pps_clock.rearm_holdover()
+        if new_second:
+            self.pps_second()
+    
+    def pps_second(self):
+        '''
+        Work for each new second, from a real PPS edge or the PPS clock's holdover timer
+        '''
+        # Start the message on exactly the edge the scheduler picked
+        if self.pps_clock.edge_count == self.tx_edge:
+            self.tx_edge = -1
+            self.transmit_message()
+            self.tx_started = True
+        elif 0 <= self.tx_edge < self.pps_clock.edge_count:
+            # Start edge already gone (armed late or an edge skipped), wait for the same slot of the
+            # next 10 minute cycle so the frame built for that slot is still the right one
+            self.tx_edge += ((self.pps_clock.edge_count - self.tx_edge) // 600 + 1) * 600
+        
+        # Keep the symbol boundaries on GPS time, held over edges carry no news
+        if not self.pps_clock.in_holdover:
+            if self.core1_tx is not None:
+                self.core1_tx.pps_edge(self.pps_clock.edge_count, self.pps_clock.edge_ticks_us)
+            elif self.symbol_timer.running:
+                self.symbol_timer.pps_edge(self.pps_clock.edge_count, self.pps_clock.edge_ticks_us)
+        
         # Set LED patterns to inidicate GPS state
         if self.state in ["init", "wait_for_time"]: # 0 satellites
             led_pattern = [1,1,0,0]
@@ -271,48 +462,172 @@ class Balloon:
         '''
         Set transmit freq and get frontend ready
         '''
+        self.clockgen.resync()
         self.clockgen.configure_output_driver(self.output)
         self.clockgen.enable_output(self.output, False)
+        
+        # Precompute the PLL registers for each of the 4 WSPR tones
+        if isinstance(self.offsets, int):
+            offset = self.offsets
+        else:
+            offset = self.offsets[self.offset_index]
+        
+        self.tone_images = self.clockgen.wspr_tone_images(self.band, offset,
+                                                          correction=self.tx_correction,
+                                                          tone_spacing=self.tone_spacing)
 
+    def prepare_transmission(self):
+        '''
+        Check the frame in self.message and set up what the tone path needs, once before the
+        start edge, so nothing has to be checked or computed per symbol
+        
+        Returns:
+            True if the frame can be transmitted
+        '''
+        if (len(self.message) != self.message_length or self.band is None or self.offsets is None
+                or self.output is None or self.tone_images is None):
+            print("Transmitter not configured for this frame")
+            return False
+        
+        for symbol in self.message:
+            if symbol > 3:
+                print("Frame holds an invalid WSPR symbol {}".format(symbol))
+                return False
+        
+        # Output divider is fixed for the whole message, set it while the output is still off
+        self.clockgen.configure_wspr_output(self.output, self.band)
+        
+        # Core 1 plays from its own copy, the enable bits come from the shadow map as it is now
+        if self.core1_tx is not None and not self.core1_tx.load(self.message, self.tone_images):
+            print("Core 1 is about to start the previous frame")
+            return False
+        
+        self.tone_index = 0
+        self.tone_pending = False
+        self.tone_overruns = 0
+        self.tone_symbol = 0
+        return True
+    
     def transmit_message(self):
         '''
-        start timer and begin transmitting
+        start timer and begin transmitting, prepare_transmission() must have passed
         '''
-        self.timer.init(period = self.tone_period,
-                        mode = machine.Timer.PERIODIC,
-                        callback = self.transmit_next_tone)
-
-    def transmit_next_tone(self, *args):
+        # Symbol 0 starts on the latest PPS edge, the symbol timer (or core 1) brings the rest
+        if self.core1_tx is not None:
+            self.core1_done = self.core1_tx.done_count
+            self.core1_tx.start(self.pps_clock.edge_ticks_us, self.pps_clock.edge_count)
+        else:
+            self.symbol_timer.start(self.pps_clock.edge_ticks_us, self.pps_clock.edge_count)
+    
+    def poll_transmitter(self):
+        '''
+        Notice core 1 finishing a message and do what transmit_next_tone() does at the end of one,
+        from core 0. Nothing to do for the symbol timer, which finishes messages itself.
+        '''
+        if self.core1_tx is None or self.tone_index == 163:
+            return
+        
+        if self.core1_tx.done_count != self.core1_done and not self.core1_tx.playing:
+            self.core1_tx.finish()
+            self.tone_index = 163
+            
+            if self.tx_done_flag is not None:
+                self.tx_done_flag.set()
+    
+    def tone_interrupt(self, symbol: int):
+        '''
+        Symbol timer callback (a hard IRQ from symbol 1 on), allocation free: timestamp the
+        boundary and leave the I2C traffic to transmit_next_tone() through micropython.schedule()
+        '''
+        self.symbol_ticks[symbol] = time.ticks_us()
+        self.tone_symbol = symbol
+        
+        # Work still pending picks the newest symbol up when it finishes, see transmit_next_tone()
+        if self.tone_pending:
+            self.tone_overruns += 1
+            return
+        
+        self.tone_pending = True
+        micropython.schedule(self.tone_work, symbol)
+    
+    def symbol_jitter_us(self):
+        '''
+        Worst distance of a symbol start from the boundary the symbol timer was aiming for
+        (exact symbol length, PPS corrected), for the transmission just finished
+        '''
+        worst = 0
+        
+        if self.core1_tx is not None:
+            ticks, targets = self.core1_tx.symbol_ticks, self.core1_tx.targets
+        else:
+            ticks, targets = self.symbol_ticks, self.symbol_timer.targets
+        
+        for i in range(163):
+            error = time.ticks_diff(ticks[i], targets[i])
+            self.instrument.record(self.tone_jitter_slot, error)
+            worst = max(worst, abs(error))
+            
+        return worst
+    
+    def transmit_next_tone(self, symbol: int):
         '''    
-        Transmit the next tone in the message buffer
-        This should be called from a clock interrupt, not directly
+        Play the tone for symbol index symbol (162 ends the message)
+        Runs from micropython.schedule() after tone_interrupt(), never inside the IRQ itself.
+        Boundaries that came in while it ran are caught up to the newest, so a dropped
+        callback costs at most a late tone and never the end of the message.
         '''
-        #make sure we got one in the chamber
-        assert len(self.message) == self.message_length
-        assert self.band != None
-        assert self.offsets != None
-        assert self.output != None
+        t_start = self.instrument.start()
+        
+        while True:
+            self.play_symbol(symbol)
+            
+            state = machine.disable_irq() #no boundary between the check and clearing tone_pending
+            if self.tone_symbol == symbol or self.tone_index == 163:
+                self.tone_pending = False
+                machine.enable_irq(state)
+                break
+            symbol = self.tone_symbol
+            machine.enable_irq(state)
+        
+        self.instrument.stop(self.tone_isr_slot, t_start)
+    
+    def play_symbol(self, symbol: int):
+        if self.tone_index == 163:
+            return #message already finished
         
-        if self.tone_index >= 162:
+        if symbol >= 162:
             self.clockgen.enable_output(self.output, False)
-            self.timer.deinit() #message is finished, stop timer
+            self.symbol_timer.stop() #message is finished
             self.tone_index = 163
+            
+            if self.tx_done_flag is not None:
+                self.tx_done_flag.set()
         else:
+            # Only the PLL bytes that differ from the previous tone go out on the bus
+            self.clockgen.write_pll_image(0, self.tone_images[self.message[symbol]])
+            
             if self.tone_index == 0:
                 self.clockgen.enable_output(self.output, True)
             
-            if isinstance(self.offsets, int):
-                tone_offset = self.offsets + (self.message[self.tone_index] * self.tone_spacing)
-            else:
-                tone_offset = self.offsets[self.offset_index] + (self.message[self.tone_index] * self.tone_spacing)
+            self.tone_index = symbol + 1
             
-            self.tone_index += 1
-            self.clockgen.transmit_wspr_tone(self.output, self.band,
-                                             tone_offset, correction=self.tx_correction)
     def update_telemetry(self):
-        gprmc_dict = self.gps.get_GPRMC_data()
-        gps_dict = self.gps.get_GPGGA_data()
-        alt_dict = self.altimeter.get_pressure_and_temperature()
+        if self.background_sensors:
+            # GPS and altimeter are kept current by their own tasks, take what is there
+            matched = self.gps.await_epoch(timeout_ms=0)
+        elif not self.gps.awake:
+            # GPS in standby, the last fix is the best there is
+            matched = self.gps.await_epoch(timeout_ms=0)
+            self.altimeter.start_measurement(self.altimeter_osr)
+        else:
+            # Altimeter conversions run in the background while waiting on the GPS
+            self.altimeter.start_measurement(self.altimeter_osr)
+            
+            # GGA and RMC from the same epoch, so position and ground speed can't tear
+            matched = self.gps.await_epoch(idle=self.altimeter.poll_measurement)
+            
+        if not matched and self.gps.awake:
+            print("GGA/RMC epochs did not match, using latest of each")
         
         # Update ADC voltage rail readings
         if self.version in ["1.0", "1.1"]:
@@ -325,29 +640,157 @@ class Balloon:
             # v2.2 uses 10k and 47k voltage divider (1.0/0.175438596 = 5.7)
             adc_scale = 5.7
 
-        v_in = adc_avg(self.v_in_adc, 10) * (3.3/65536) * adc_scale
-        v_solar = adc_avg(self.v_solar_adc, 10) * (3.3/65536) * adc_scale
+        v_in, v_in_min, v_in_max = self.adc_sampler.read(ADC_V_IN)
+        v_solar, v_solar_min, v_solar_max = self.adc_sampler.read(ADC_V_SOLAR)
+        v_scale = (3.3/65536) * adc_scale
 
         # Use correction factor from config file for light sensors
-        l_front = adc_avg(self.l_front_adc, 10) * (3.3/65536) * float(self.lsense_top_correction)
-        l_back = adc_avg(self.l_back_adc, 10) * (3.3/65536) * float(self.lsense_bot_correction)
-        
-        self.telemetry['lat_deg'] = gps_dict['lat_deg']
-        self.telemetry['lon_deg'] = gps_dict['lon_deg']
-        self.telemetry['gps_valid'] = (int(gps_dict['lat_deg']) != 0 or int(gps_dict['lon_deg']) != 0)
-        self.telemetry['t_utc'] = gps_dict['t_utc']
-        self.telemetry['alt_m'] = gps_dict['alt_m']
-        self.telemetry['satellites'] = gps_dict['satellites']
-        self.telemetry['groundspeed_kn'] = gprmc_dict['groundspeed_kn']
-        
-        self.telemetry['temp_c'] = alt_dict['t_c']
-        self.telemetry['p_mbar'] = alt_dict['p_mbar']
-        
-        self.telemetry['v_solar'] = v_solar
-        self.telemetry['v_in'] = v_in
+        l_front = self.adc_sampler.value(ADC_L_FRONT) * (3.3/65536) * float(self.lsense_top_correction)
+        l_back = self.adc_sampler.value(ADC_L_BACK) * (3.3/65536) * float(self.lsense_bot_correction)
+        
+        if not (self.background_sensors and self.altimeter.measured):
+            self.altimeter.await_measurement()
+        
+        # Straight from the drivers' state into the record, no intermediate dicts
+        self.telemetry.update_gps(self.gps, matched)
+        self.telemetry.update_altimeter(self.altimeter)
+        
+        self.telemetry['v_solar'] = v_solar * v_scale
+        self.telemetry['v_in'] = v_in * v_scale
+        
+        # Extremes since the last update, brownouts during transmission show up in v_in_min
+        self.telemetry['v_in_min'] = v_in_min * v_scale
+        self.telemetry['v_in_max'] = v_in_max * v_scale
+        self.telemetry['v_solar_min'] = v_solar_min * v_scale
+        self.telemetry['v_solar_max'] = v_solar_max * v_scale
         self.telemetry['l_front'] = l_front
         self.telemetry['l_back'] = l_back
     
+    def build_frame(self, min_now: int, symbols):
+        '''
+        Pick the message for the transmit slot that starts after minute min_now (mod 10),
+        refreshing telemetry where that message needs it, and encode it into symbols
+        
+        Returns:
+            message text, or an empty string if the telemetry mode is not recognized
+        '''
+        wspr_text = ""
+        
+        # For U4B telem: check for both the exact telem minute and 1 minute before in the nominal case
+        is_telem_minute = (min_now == self.telemetry_minute) or (min_now == self.telemetry_minute - 1)
+        
+        # Do normal WSPR message
+        if (self.telemetry_mode == "WSPR") or (self.telemetry_mode == "U4B" and is_telem_minute == False):
+            # Update telemetry only once every 4 minutes to avoid tears in location
+            self.update_telemetry()
+            print(self.telemetry)
+
+            # If specified in config, telemeter balloon altitude using the normal WSPR power field
+            if self.telem_alt_as_pwr == True:
+                power_lut = [0,3,7,10,13,17,
+                             20,23,27,30,33,37,
+                             40,43,47,50,53,57,60]
+                # Scale to 18000m with 1km altitude resolution
+                pwr_idx = int(round(self.telemetry['alt_m'] * len(power_lut) / 18000, 0))
+                if pwr_idx > len(power_lut) - 1:
+                    pwr_idx = len(power_lut) -1
+
+                wspr_pwr = power_lut[pwr_idx]
+            else:
+                wspr_pwr = 10 # 10 dBm TX power out of clkgen
+
+            grid_square = wspr.LL2GS(self.telemetry['lat_deg'], self.telemetry['lon_deg'])[:4]
+            self.frame_cache.get(self.callsign, grid_square, wspr_pwr, symbols)
+            wspr_text = "{} {} {}".format(self.callsign, grid_square, wspr_pwr)
+            print(wspr_text)
+
+        # Transmit U4B telemetry when it is our minute
+        elif self.telemetry_mode == "U4B" and is_telem_minute == True:
+            subsquare = wspr.LL2GS(self.telemetry['lat_deg'], self.telemetry['lon_deg'])[-2:]
+
+            # Gefine GPS = healthy if it sees at least 8 satellites
+            if self.telemetry['satellites'] >= 8:
+                gps_health = 1
+            else:
+                gps_health = 0
+
+            if self.telemeter_lsense == True:
+                # Encode which brightness sensor is reading higher as the normal U4B GPS status flag
+                # This will give us a very coarse reading on which direction the tracker is facing
+                if self.telemetry['l_front'] >= self.telemetry['l_back']:
+                    gps_valid = 1
+                else:
+                    gps_valid = 0
+            else:
+                gps_valid = int(self.telemetry['gps_valid'])
+
+            callsign = wspr.encode_subsquare_and_altitude_telemetry(self.telemetry_call, subsquare, int(self.telemetry['alt_m']))
+
+            # Add -1V offset to v_in, reportable range = 4 - 5.95 V (3 - 4.95 V + 1 V)
+            gs_and_power = wspr.encode_engineering_telemetry(self.telemetry['temp_c'],
+                                                             self.telemetry['v_in'] - 1, #get this into the range U4B expects
+                                                             int(self.telemetry['groundspeed_kn']),
+                                                             gps_valid,
+                                                             gps_health)
+            
+            self.frame_cache.get(callsign, gs_and_power[0], gs_and_power[1], symbols)
+            wspr_text = "{} {} {}".format(callsign, gs_and_power[0], gs_and_power[1])
+            print(wspr_text)
+        
+        # Custom W6NXP Telemetry Scheme
+        elif self.telemetry_mode == "W6NXP":
+            print(min_now)
+            # Transmit subsquare and number of satellites
+            if min_now in [1,2]:
+                print("Telemetering subsquare + sat count")
+                wspr_pwr = wspr.encode_w6nxp_sat_count(self.telemetry['satellites'])
+                full_grid = wspr.LL2GS(self.telemetry['lat_deg'], self.telemetry['lon_deg'])
+                grid_square = full_grid[:4]
+                telem_call = str(full_grid[-2:]).upper()
+                callsign = self.w6nxp_telem_prefix + telem_call
+            # Transmit barometric pressure, altitude, and speed
+            elif min_now in [3,4]:
+                print("Telemetering speed + altitude")
+                telem_call, grid_square, wspr_pwr = wspr.encode_w6nxp_alt_telem(self.telemetry['p_mbar'],
+                                                                                self.telemetry['alt_m'],
+                                                                                self.telemetry['groundspeed_kn'])
+                callsign = self.w6nxp_telem_prefix + telem_call
+            # Transmit ADC telemetry + temperature
+            elif min_now in [5,6]:
+                print("Telemetering ADCs + temperature")
+                telem_call, grid_square, wspr_pwr = wspr.encode_w6nxp_adc_telem(self.telemetry['v_solar'],
+                                                                                self.telemetry['v_in'],
+                                                                                self.telemetry['l_front'],
+                                                                                self.telemetry['l_back'],
+                                                                                self.telemetry['temp_c'])
+                callsign = self.w6nxp_telem_prefix + telem_call
+            # Normal WSPR for the first and last minute of a 10 minute period
+            else:
+                # Grab new telemetry for the next cycle
+                self.update_telemetry()
+                print(self.telemetry)
+
+                callsign = self.callsign
+                grid_square = wspr.LL2GS(self.telemetry['lat_deg'], self.telemetry['lon_deg'])[:4]
+                wspr_pwr = 10 # 10 dBm TX power out of clkgen
+
+            self.frame_cache.get(callsign, grid_square, wspr_pwr, symbols)
+            wspr_text = "{} {} {}".format(callsign, grid_square, wspr_pwr)
+            print(wspr_text)
+
+        return wspr_text
+
+    def log_frame(self, d_now, t_now, wspr_text: str):
+        '''
+        Append the message about to be sent and the telemetry it was built from (telemetry.FIELDS
+        order) to the flight log, if enabled
+        '''
+        if self.log_to_file == True:
+            self.flight_log.append(d_now, t_now, self.telemetry, wspr_text)
+        
+        if self.history is not None:
+            self.history.append(d_now, t_now, self.telemetry)
+    
     def is_geofenced(self):
         for fence in self.geofence.keys():
             fence_coords = self.geofence[fence]
@@ -360,6 +803,11 @@ class Balloon:
     
     def tick(self):
         start_state = self.state
+        t_tick = self.instrument.start()
+        
+        # Keep the latest GGA/RMC/GSA fixes current without blocking
+        self.gps.poll()
+        self.gps_power.update(needed=self.state in ["init", "wait_for_time"])
         
         if self.state == "init":
             self.pps_count = 0
@@ -367,167 +815,141 @@ class Balloon:
             self.state = "wait_for_time"
 
         elif self.state == "wait_for_time":
-            gps_dict = self.gps.get_GPGGA_data()
+            gps_dict = self.gps.latest("GGA")
             
-            #print(gps_dict)
-            print("{}       ".format(gps_dict['t_utc']), end='\r')
+            if gps_dict is None:
+                pass
+            elif self.gps.fix_count["GGA"] != self.last_gga_count:
+                self.last_gga_count = self.gps.fix_count["GGA"]
+                #print(gps_dict)
+                print("{}       ".format(gps_dict['t_utc']), end='\r')
             
-            if gps_dict['t_utc'] > (self.pps_count + 10) and gps_dict['satellites'] > 0:
+            if self.tx_retry_ticks is not None and time.ticks_diff(self.tx_retry_ticks, time.ticks_ms()) > 0:
+                pass #backing off after a frame could not be prepared
+            elif gps_dict is not None and gps_dict['t_utc'] > (self.pps_count + 10) and gps_dict['satellites'] > 0:
                 print()
+                self.tx_retry_ticks = None
                 #self.state = "wait_for_fix"
                 self.configure_clockgen()
                 self.state = "collect_telemetry"
 
         elif self.state == "collect_telemetry":
-            gprmc_dict = self.gps.get_GPRMC_data()
-            
-            d_now = gprmc_dict['date_utc']
-            t_now = gprmc_dict['t_utc']
-            wspr_text = ""
-            
-            # For U4B telem: check for both the exact telem minute and 1 minute before in the nominal case
+            if self.gps.awake:
+                gprmc_dict = self.gps.get_GPRMC_data()
+                
+                d_now = gprmc_dict['date_utc']
+                t_now = gprmc_dict['t_utc']
+            else:
+                # No RMC while in standby, the held over PPS clock has the time (date from the last fix)
+                d_now = self.gps.rmc[uart_device.RMC_DATE]
+                t_now = self.pps_clock.t_utc()
+                
+                # The clock went past midnight since that fix (standby is far shorter than a day)
+                if t_now < self.gps.rmc[uart_device.RMC_T_UTC] / 100:
+                    d_now = history.next_date(d_now)
             min_now = int((int(t_now) // 100) % 10)
-            is_telem_minute = (min_now == self.telemetry_minute) or (min_now == self.telemetry_minute - 1)
             
             # Grab telem if at beginning so we know we have good data
             if self.telemetry['v_solar'] == 0 and self.telemetry['v_in'] == 0:
                 self.update_telemetry()
                 print(self.telemetry)
 
-            # Do normal WSPR message
-            if (self.telemetry_mode == "WSPR") or (self.telemetry_mode == "U4B" and is_telem_minute == False):
-                # Update telemetry only once every 4 minutes to avoid tears in location
-                self.update_telemetry()
-                print(self.telemetry)
-
-                # If specified in config, telemeter balloon altitude using the normal WSPR power field
-                if self.telem_alt_as_pwr == True:
-                    power_lut = [0,3,7,10,13,17,
-                                 20,23,27,30,33,37,
-                                 40,43,47,50,53,57,60]
-                    # Scale to 18000m with 1km altitude resolution
-                    pwr_idx = int(round(self.telemetry['alt_m'] * len(power_lut) / 18000, 0))
-                    if pwr_idx > len(power_lut) - 1:
-                        pwr_idx = len(power_lut) -1
-
-                    wspr_pwr = power_lut[pwr_idx]
-                else:
-                    wspr_pwr = 10 # 10 dBm TX power out of clkgen
-
-                grid_square = wspr.LL2GS(self.telemetry['lat_deg'], self.telemetry['lon_deg'])[:4]
-                self.message = wspr.generate_wspr_message(self.callsign, grid_square, wspr_pwr)
-                wspr_text = "{} {} {}".format(self.callsign, grid_square, wspr_pwr)
-                print(wspr_text)
-
-            # Transmit U4B telemetry when it is our minute
-            elif self.telemetry_mode == "U4B" and is_telem_minute == True:
-                subsquare = wspr.LL2GS(self.telemetry['lat_deg'], self.telemetry['lon_deg'])[-2:]
-
-                # Gefine GPS = healthy if it sees at least 8 satellites
-                if self.telemetry['satellites'] >= 8:
-                    gps_health = 1
-                else:
-                    gps_health = 0
-
-                if self.telemeter_lsense == True:
-                    # Encode which brightness sensor is reading higher as the normal U4B GPS status flag
-                    # This will give us a very coarse reading on which direction the tracker is facing
-                    if self.telemetry['l_front'] >= self.telemetry['l_back']:
-                        gps_valid = 1
-                    else:
-                        gps_valid = 0
-                else:
-                    gps_valid = int(self.telemetry['gps_valid'])
-
-                callsign = wspr.encode_subsquare_and_altitude_telemetry(self.telemetry_call, subsquare, int(self.telemetry['alt_m']))
-
-                # Add -1V offset to v_in, reportable range = 4 - 5.95 V (3 - 4.95 V + 1 V)
-                gs_and_power = wspr.encode_engineering_telemetry(self.telemetry['temp_c'],
-                                                                 self.telemetry['v_in'] - 1, #get this into the range U4B expects
-                                                                 int(self.telemetry['groundspeed_kn']),
-                                                                 gps_valid,
-                                                                 gps_health)
-                
-                self.message = wspr.generate_wspr_message(callsign, gs_and_power[0], gs_and_power[1])
-                wspr_text = "{} {} {}".format(callsign, gs_and_power[0], gs_and_power[1])
-                print(wspr_text)
-            
-            # Custom W6NXP Telemetry Scheme
-            elif self.telemetry_mode == "W6NXP":
-                print(min_now)
-                # Transmit subsquare and number of satellites
-                if min_now in [1,2]:
-                    print("Telemetering subsquare + sat count")
-                    wspr_pwr = wspr.encode_w6nxp_sat_count(self.telemetry['satellites'])
-                    full_grid = wspr.LL2GS(self.telemetry['lat_deg'], self.telemetry['lon_deg'])
-                    grid_square = full_grid[:4]
-                    telem_call = str(full_grid[-2:]).upper()
-                    callsign = self.w6nxp_telem_prefix + telem_call
-                # Transmit barometric pressure, altitude, and speed
-                elif min_now in [3,4]:
-                    print("Telemetering speed + altitude")
-                    telem_call, grid_square, wspr_pwr = wspr.encode_w6nxp_alt_telem(self.telemetry['p_mbar'],
-                                                                                    self.telemetry['alt_m'],
-                                                                                    self.telemetry['groundspeed_kn'])
-                    callsign = self.w6nxp_telem_prefix + telem_call
-                # Transmit ADC telemetry + temperature
-                elif min_now in [5,6]:
-                    print("Telemetering ADCs + temperature")
-                    telem_call, grid_square, wspr_pwr = wspr.encode_w6nxp_adc_telem(self.telemetry['v_solar'],
-                                                                                    self.telemetry['v_in'],
-                                                                                    self.telemetry['l_front'],
-                                                                                    self.telemetry['l_back'],
-                                                                                    self.telemetry['temp_c'])
-                    callsign = self.w6nxp_telem_prefix + telem_call
-                # Normal WSPR for the first and last minute of a 10 minute period
-                else:
-                    # Grab new telemetry for the next cycle
-                    self.update_telemetry()
-                    print(self.telemetry)
-
-                    callsign = self.callsign
-                    grid_square = wspr.LL2GS(self.telemetry['lat_deg'], self.telemetry['lon_deg'])[:4]
-                    wspr_pwr = 10 # 10 dBm TX power out of clkgen
-
-                self.message = wspr.generate_wspr_message(callsign, grid_square, wspr_pwr)
-                wspr_text = "{} {} {}".format(callsign, grid_square, wspr_pwr)
-                print(wspr_text)
+            # Use the frame built during the last transmission if it was made for this slot
+            if self.next_ready and self.next_slot == min_now:
+                self.message, self.next_message = self.next_message, self.message
+                wspr_text = self.next_text
+                print("Using precomputed frame: {}".format(wspr_text))
+            else:
+                wspr_text = self.build_frame(min_now, self.message)
+            
+            self.next_ready = False
+            self.next_slot = None
 
-            if self.log_to_file == True:
-                with open("log.csv", "a") as f:
-                    f.write("{},{},{}\n".format(d_now, t_now, wspr_text))
+            self.log_frame(d_now, t_now, wspr_text)
             
             if self.is_geofenced():
                 self.state = "geofenced"
-            else:
+            elif self.prepare_transmission():
                 self.state = "wait_for_transmit"
+            else:
+                # Set the clock generator up afresh before the next try, after a back-off
+                self.tx_retry_ticks = time.ticks_add(time.ticks_ms(), self.TX_RETRY_MS)
+                self.state = "wait_for_time"
 
         elif self.state == "wait_for_transmit":
-            gps_dict = self.gps.get_GPGGA_data()
-            
             #if we lose lock, go back
             if self.telemetry['satellites'] == 0:
                 self.state = "wait_for_time"
+            elif not self.pps_clock.is_latched():
+                # Latch UTC once two GGAs on consecutive edges agree, from then on PPS edges keep the time
+                if self.gps.fix_count["GGA"] != self.last_gga_count:
+                    self.last_gga_count = self.gps.fix_count["GGA"]
+                    if self.pps_clock.latch(self.gps.gga_epoch, self.gps.fix_ticks["GGA"]):
+                        print("PPS clock latched at {}".format(self.pps_clock.t_utc()))
             else:
-                t_gps = int(gps_dict['t_utc'])
-                if ((t_gps // 100) % 2 == 1) and (t_gps % 100 == 59):
-                    self.state = "await_pps"
+                # Transmissions start on even minutes, armed for the PPS edge that begins the next one.
+                # Transmission runs ~111 s, so the following collect_telemetry lands one minute after that
+                tx_second, tx_edge = self.pps_clock.next_edge_on(120)
+                self.next_slot = (tx_second // 60 + 1) % 10
+                self.tx_started = False
+                self.tx_edge = tx_edge
+                self.state = "await_pps"
         
         elif self.state == "geofenced":
             self.state = "collect_telemetry"
         
         elif self.state == "await_pps":
-            if self.pps_count != self.last_pps:
-                self.transmit_message()
+            # pps_interrupt starts the transmission itself, nothing to parse here
+            if self.tx_started:
                 self.state = "transmit"
+            elif not self.pps_clock.is_latched():
+                # PPS stopped, don't start on a stale edge count
+                self.tx_edge = -1
+                self.state = "wait_for_transmit"
         
         elif self.state == "transmit":
+            # CPU is idle while the timer plays tones, so build the next frame now
+            if not self.next_ready and self.next_slot is not None:
+                self.next_text = self.build_frame(self.next_slot, self.next_message)
+                self.next_ready = True
+            
+            # Next frame is built, the GPS can sleep until the fix for the frame after the next cycle boundary.
+            # Frames are built one slot ahead, so that fix is due one slot (120 s) before the boundary
+            if self.next_ready and self.gps.awake:
+                self.gps_power.release(self.pps_clock.next_second_on(self.gps_fix_interval_s,
+                                                                     self.gps_fix_interval_s - 120))
+            
+            self.poll_transmitter()
             if self.tone_index == 163:
                 self.tone_index = 0
+                self.tx_started = False
                 self.state = "collect_telemetry"
+                
+                # Cross-check the PPS clock against the GPS once per cycle, off the hot path
+                if not self.pps_clock.verify(self.gps.gga_epoch, self.gps.fix_ticks["GGA"]):
+                    print("PPS clock disagreed with GPS time, re-latching")
+                
+                print("Symbol timing: worst {} us off the PPS-locked schedule, {} overruns".format(self.symbol_jitter_us(),
+                                                                                         self.tone_overruns))
+                print(self.power.stats())
+                if self.gps_duty_cycle:
+                    print(self.gps_power.stats())
+                
+                # Nothing is timed until the next slot, so take the GC pause here instead of mid-transmission
+                self.instrument.collect()
+                
+                # The table is cumulative, so one fixed-size file rewritten at most hourly keeps all of it
+                if (self.instrument_log and self.log_to_file == True
+                        and time.ticks_diff(time.ticks_ms(), self.instrument_log_ticks) >= 3600000):
+                    self.instrument_log_ticks = time.ticks_ms()
+                    with open("instrument.txt", "w") as f:
+                        self.instrument.write_log(f)
         
         self.last_pps = self.pps_count
         
+        self.instrument.stop(self.instrument.slot(start_state), t_tick)
+        self.instrument.sample_heap()
+        
         if self.state != start_state:
             print("{} - {}".format(self.state, self.pps_count))
             
@@ -0,0 +1,225 @@
+import _thread
+import array
+import time
+
+import symbol_timer
+
+class Core1Transmitter:
+    '''
+    WSPR transmit engine running on the RP2040's second core
+
+    Core 0 loads frames with load() and says when to start with start() (from the work each
+    PPS edge schedules); core 1 owns frame playback, symbol timing and every Si5351 write while a
+    message plays, so nothing core 0 does (GPS parsing, flash writes, GC) can delay a tone.
+
+    Frames go through a double buffer: load() fills the back buffer under the lock while core 1
+    may be playing the front one, and starting a message swaps them. The playback loop does not
+    allocate, so core 1 never has to wait for core 0's garbage collector.
+
+    From start() until finish() core 1 owns the Si5351's I2C bus and the driver's shadow map is
+    stale, so the driver is marked with bus_owner and refuses every core 0 access meanwhile.
+    '''
+    BUS_OWNER = "core 1 transmitter"
+    PLL_A_BASE = 26 #first PLL A register, where the tone images go
+
+    def __init__(self, clockgen, output: int, symbols: int = 162):
+        '''
+        Args:
+            clockgen: i2c_device.Si5351, core 1 writes to its bus directly while playing
+            output: clock output the transmission is on
+            symbols: symbols per message
+        '''
+        self.clockgen = clockgen
+        self.i2c = clockgen.i2c
+        self.address = clockgen.address
+        self.output = output
+        self.symbols = symbols
+
+        self.lock = _thread.allocate_lock()
+        self.frames = [bytearray(symbols), bytearray(symbols)]
+        self.images = [None, None] #4 PLL register images per frame
+        self.back = 0 #buffer load() fills next
+        self.loaded = False #back buffer holds a frame that has not started yet
+
+        #output enable/disable register values, worked out by load() from the shadow map
+        self.ctrl_on = bytearray(1)
+        self.ctrl_off = bytearray(1)
+        self.oe_on = bytearray(1)
+        self.oe_off = bytearray(1)
+
+        #start request and PPS edges, written by core 0 (single words, no lock needed)
+        self.start_requested = False
+        self.start_us = 0
+        self.start_edge = 0
+        self.pps_count = 0
+        self.pps_ticks_us = 0
+
+        #playback state, written by core 1
+        self.playing = False
+        self.done_count = 0
+        self.late_edges = 0 #PPS stamps ignored as late, over all messages
+        self.last_image = None
+        self.symbol_ticks = array.array('i', [0] * (symbols + 1))
+        self.targets = array.array('i', [0] * (symbols + 1))
+
+        self.thread_running = False
+
+    def start_thread(self):
+        if not self.thread_running:
+            self.thread_running = True
+            _thread.start_new_thread(self.run, ())
+
+    def load(self, symbols, tone_images):
+        '''
+        Copy a frame into the back buffer for the next start(), from core 0. A frame loaded
+        earlier that never started (e.g. GPS lock lost before its edge) is replaced.
+
+        Returns:
+            False if start() was already called for the frame in the back buffer
+        '''
+        self.lock.acquire()
+        try:
+            self.loaded = False #start() refuses from here on, before start_requested is checked
+            if self.start_requested:
+                self.loaded = True #already started, core 1 takes it on its next loop
+                return False
+
+            frame = self.frames[self.back]
+            for i in range(self.symbols):
+                frame[i] = symbols[i]
+            self.images[self.back] = tone_images
+
+            shadow = self.clockgen.shadow
+            ctrl = shadow[16 + self.output]
+            self.ctrl_on[0] = ctrl & ~0x80
+            self.ctrl_off[0] = ctrl | 0x80
+            self.oe_on[0] = shadow[3] & ~(1 << self.output)
+            self.oe_off[0] = shadow[3] | (1 << self.output)
+
+            self.loaded = True
+            return True
+        finally:
+            self.lock.release()
+
+    def start(self, edge_ticks_us: int, edge_count: int):
+        '''
+        Start the loaded frame on the PPS edge at edge_ticks_us (edge number edge_count),
+        safe to call from an interrupt
+        '''
+        if not self.loaded or self.playing:
+            return False
+
+        self.clockgen.bus_owner = self.BUS_OWNER #core 0 keeps off the Si5351 until finish()
+        self.start_us = edge_ticks_us
+        self.start_edge = edge_count
+        self.start_requested = True #last, core 1 reads the fields above once it sees this
+        return True
+
+    def pps_edge(self, edge_count: int, edge_ticks_us: int):
+        '''
+        Pass a real PPS edge to core 1 for resynchronizing the symbol clock, from core 0
+        '''
+        self.pps_count = 0 #marks the pair as being written
+        self.pps_ticks_us = edge_ticks_us
+        self.pps_count = edge_count
+
+    def finish(self):
+        '''
+        Bring the Si5351 shadow map up to date with what core 1 wrote and hand the driver back to
+        core 0, from core 0 once playing is over
+        '''
+        if self.playing or self.start_requested:
+            raise RuntimeError("Core 1 is still transmitting")
+
+        shadow = self.clockgen.shadow
+        shadow[16 + self.output] = self.ctrl_off[0]
+        shadow[3] = self.oe_off[0]
+        if self.last_image is not None:
+            for i in range(8):
+                shadow[self.PLL_A_BASE + i] = self.last_image[i]
+
+        self.clockgen.bus_owner = None
+
+    def run(self):
+        '''
+        Core 1 main loop
+        '''
+        while True:
+            if not self.start_requested:
+                time.sleep_ms(1)
+                continue
+
+            self.lock.acquire()
+            front = self.back
+            self.back ^= 1
+            self.loaded = False
+            self.start_requested = False
+            self.playing = True
+            self.lock.release()
+
+            self.play(self.frames[front], self.images[front])
+
+            self.playing = False
+            self.done_count += 1
+
+    def wait_until(self, target: int):
+        remaining = time.ticks_diff(target, time.ticks_us())
+        if remaining > 3000:
+            time.sleep_ms(remaining // 1000 - 2)
+
+        while time.ticks_diff(target, time.ticks_us()) > 0:
+            pass
+
+    def play(self, frame, images):
+        '''
+        Play one frame, allocation free. Symbol boundaries follow the same exact accumulator as
+        symbol_timer.SymbolTimer and resynchronize on every PPS edge core 0 passes over.
+        '''
+        i2c = self.i2c
+        address = self.address
+        ctrl_register = 16 + self.output
+        start_us = self.start_us
+        start_edge = self.start_edge
+        synced_edge = start_edge #edge start_us was last set from
+        seen_edge = start_edge
+        acc_us = 0
+        acc_thirds = 0
+        drift_us_per_s = symbol_timer.SymbolTimer.DRIFT_US_PER_S
+        edge_jitter_us = symbol_timer.SymbolTimer.EDGE_JITTER_US
+
+        for index in range(self.symbols + 1):
+            target = time.ticks_add(start_us, acc_us)
+            self.targets[index] = target
+            self.wait_until(target)
+            self.symbol_ticks[index] = time.ticks_us()
+
+            if index < self.symbols:
+                image = images[frame[index]]
+                i2c.writeto_mem(address, self.PLL_A_BASE, image)
+                self.last_image = image
+
+                if index == 0:
+                    i2c.writeto_mem(address, ctrl_register, self.ctrl_on)
+                    i2c.writeto_mem(address, 3, self.oe_on)
+            else:
+                i2c.writeto_mem(address, ctrl_register, self.ctrl_off)
+                i2c.writeto_mem(address, 3, self.oe_off)
+
+            acc_us += symbol_timer.SymbolTimer.SYMBOL_US
+            acc_thirds += symbol_timer.SymbolTimer.SYMBOL_THIRDS
+            if acc_thirds >= 3:
+                acc_thirds -= 3
+                acc_us += 1
+
+            #newest PPS edge, skipped if core 0 was halfway through writing it, and ignored if
+            #stamped later than drift allows (see symbol_timer.SymbolTimer.pps_edge())
+            edge = self.pps_count
+            ticks = self.pps_ticks_us
+            if edge > seen_edge and edge == self.pps_count:
+                seen_edge = edge
+                late = time.ticks_diff(ticks, time.ticks_add(start_us, 1000000 * (edge - start_edge)))
+                if late > drift_us_per_s * (edge - synced_edge) + edge_jitter_us:
+                    self.late_edges += 1
+                else:
+                    start_us = time.ticks_add(ticks, -1000000 * (edge - start_edge))
+                    synced_edge = edge
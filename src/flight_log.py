@@ -0,0 +1,254 @@
+import binascii
+import os
+import struct
+
+import telemetry
+
+MAGIC = b"FLOG"
+VERSION = 2
+
+# Segment header: magic, version, record size, records per segment, number of telemetry fields
+HEADER_FORMAT = "<4sHHIH"
+HEADER_SIZE = 16
+
+# Record: sequence number, UTC date (DDMMYY) and time (HHMMSS.ss), then the telemetry values
+# in telemetry.FIELDS order as float32, the frame text and a CRC32 over the rest
+RECORD_PREFIX = "<IIf"
+PREFIX_SIZE = 12
+TEXT_SIZE = 24
+N_FIELDS = len(telemetry.FIELDS)
+RECORD_SIZE = PREFIX_SIZE + 4 * N_FIELDS + TEXT_SIZE + 4
+
+def segment_path(directory: str, index: int):
+    return "{}/{:03d}.bin".format(directory, index)
+
+def segment_indexes(directory: str):
+    '''
+    Index of every segment file in directory, in no particular order
+    '''
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+
+    return [int(name[:-4]) for name in names if name.endswith(".bin") and name[:-4].isdigit()]
+
+class FlightLog:
+    '''
+    Flight log of fixed-size binary records in a ring of small append-only segment files
+
+    Records go to directory/000.bin, 001.bin, ... in turn, segment_records to a file. Files are
+    only ever appended to: on LittleFS an append rewrites the file's last block and its directory
+    entry, where overwriting in the middle of a file would rewrite every block after it too.
+    Once every segment has been used the oldest file is deleted to start the next, so the log
+    keeps at least the latest slots records and never fills the filesystem.
+
+    Records are written batch_records at a time. The default of 1 writes each record straight
+    away; a larger batch saves writes but loses whatever is still in RAM when the power goes,
+    which on a solar tracker is every night.
+
+    Every record carries an increasing sequence number and a CRC32. A record torn by a power
+    loss fails its CRC and is skipped, and open() picks up after the newest valid record,
+    starting a new segment if the last one ends in a partial record.
+    '''
+    def __init__(self, directory: str = "flight", slots: int = 2048, batch_records: int = 1,
+                 segment_records: int = 64):
+        '''
+        Args:
+            directory: where the segment files go, created by open()
+            slots: records kept at least, the oldest segment is deleted beyond that
+            batch_records: records kept in RAM between writes
+            segment_records: records per segment file
+        '''
+        self.directory = directory
+        self.segment_records = max(1, min(segment_records, slots))
+        self.segments = (slots + self.segment_records - 1) // self.segment_records + 1 #+1 being refilled
+        self.batch_records = max(1, min(batch_records, self.segment_records))
+
+        self.batch = bytearray(self.batch_records * RECORD_SIZE)
+        self.pending = 0 #records in the batch not written yet
+        self.segment = 0 #segment being appended to
+        self.segment_used = 0 #records in that segment, written or pending
+        self.seq = 1 #sequence number of the next record
+
+        self.opened = False
+        self.writes = 0 #batches written since boot
+
+    def header(self):
+        header = bytearray(HEADER_SIZE)
+        struct.pack_into(HEADER_FORMAT, header, 0, MAGIC, VERSION, RECORD_SIZE, self.segment_records, N_FIELDS)
+        return header
+
+    def open(self):
+        '''
+        Find where the log left off, moving aside segments this layout would not have written
+        '''
+        try:
+            os.mkdir(self.directory)
+        except OSError:
+            pass #already there
+
+        header = self.header()
+        newest_segment, newest_seq = -1, 0
+
+        for index in segment_indexes(self.directory):
+            path = segment_path(self.directory, index)
+            with open(path, "rb") as f:
+                matches = f.read(HEADER_SIZE) == header
+                if matches and index < self.segments:
+                    for record in iter_records(f, RECORD_SIZE):
+                        seq = record_seq(record)
+                        if seq > newest_seq:
+                            newest_segment, newest_seq = index, seq
+
+            if not matches or index >= self.segments:
+                # Keep an old or foreign log for recovery instead of writing over it
+                print("Flight log segment {} has a different layout, moved to {}.old".format(path, path))
+                os.rename(path, path + ".old")
+
+        self.pending = 0
+        self.seq = newest_seq + 1
+        self.opened = True
+
+        if newest_segment < 0:
+            self.start_segment(0)
+            return
+
+        self.segment = newest_segment
+        size = os.stat(segment_path(self.directory, newest_segment))[6]
+        self.segment_used = (size - HEADER_SIZE) // RECORD_SIZE
+
+        # A partial record at the end would put every record appended after it out of step
+        if (size - HEADER_SIZE) % RECORD_SIZE != 0 or self.segment_used >= self.segment_records:
+            self.start_segment((newest_segment + 1) % self.segments)
+
+    def start_segment(self, index: int):
+        '''
+        Delete segment index (the oldest once the ring has wrapped) and start it afresh
+        '''
+        path = segment_path(self.directory, index)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+        with open(path, "wb") as f:
+            f.write(self.header())
+
+        self.segment = index
+        self.segment_used = 0
+
+    def append(self, date: int, t_utc: float, record: telemetry.Telemetry, text: str):
+        '''
+        Add one record to the batch, writing the batch out once it is full
+        '''
+        if not self.opened:
+            self.open()
+
+        if self.segment_used >= self.segment_records:
+            self.flush()
+            self.start_segment((self.segment + 1) % self.segments)
+
+        offset = self.pending * RECORD_SIZE
+        batch = self.batch
+
+        struct.pack_into(RECORD_PREFIX, batch, offset, self.seq, date, t_utc)
+        start = offset + PREFIX_SIZE
+        batch[start:start + 4 * N_FIELDS] = bytes(record.values)
+
+        start += 4 * N_FIELDS
+        encoded = text.encode()[:TEXT_SIZE]
+        batch[start:start + len(encoded)] = encoded
+        for i in range(start + len(encoded), start + TEXT_SIZE):
+            batch[i] = 0
+
+        end = offset + RECORD_SIZE - 4
+        struct.pack_into("<I", batch, end, binascii.crc32(memoryview(batch)[offset:end]) & 0xFFFFFFFF)
+
+        self.seq += 1
+        self.pending += 1
+        self.segment_used += 1
+        if self.pending >= self.batch_records:
+            self.flush()
+
+    def flush(self):
+        '''
+        Append the pending records to the current segment
+        '''
+        if self.pending == 0:
+            return
+
+        with open(segment_path(self.directory, self.segment), "ab") as f:
+            f.write(memoryview(self.batch)[:self.pending * RECORD_SIZE])
+
+        self.pending = 0
+        self.writes += 1
+
+def iter_records(f, record_size: int = RECORD_SIZE):
+    '''
+    Raw bytes of each whole record of an open segment file after its header, in file order
+    '''
+    while True:
+        record = f.read(record_size)
+        if len(record) < record_size:
+            return
+        yield record
+
+def record_seq(record):
+    '''
+    Sequence number of a raw record, 0 if it fails its CRC
+    '''
+    end = len(record) - 4
+    if binascii.crc32(record[:end]) & 0xFFFFFFFF != struct.unpack_from("<I", record, end)[0]:
+        return 0
+    return struct.unpack_from("<I", record, 0)[0]
+
+def decode_record(record, fields=telemetry.FIELDS):
+    '''
+    Decode one raw record to a dict, None if it is corrupt
+
+    fields names the telemetry values stored, telemetry.FIELDS unless the log was written by
+    firmware with fewer fields (see read_log())
+    '''
+    if record_seq(record) == 0:
+        return None
+
+    seq, date, t_utc = struct.unpack_from(RECORD_PREFIX, record, 0)
+    values = struct.unpack_from("<{}f".format(len(fields)), record, PREFIX_SIZE)
+    text_start = PREFIX_SIZE + 4 * len(fields)
+    text = bytes(record[text_start:text_start + TEXT_SIZE]).rstrip(b"\x00").decode()
+
+    # The time the frame was logged at, the telemetry's own t_utc is that of its GPS fix
+    decoded = {"seq": seq, "date_utc": date, "frame_t_utc": t_utc}
+    for name, value in zip(fields, values):
+        decoded[name] = int(value) if name in telemetry.INT_FIELDS else value
+    decoded["frame"] = text
+    return decoded
+
+def read_segment(path: str):
+    '''
+    All valid records of one segment file, in file order
+    '''
+    with open(path, "rb") as f:
+        magic, version, record_size, segment_records, n_fields = struct.unpack_from(HEADER_FORMAT, f.read(HEADER_SIZE), 0)
+        if magic != MAGIC or version != VERSION or record_size != PREFIX_SIZE + 4 * n_fields + TEXT_SIZE + 4:
+            raise ValueError("{} is not a flight log segment this version can read".format(path))
+
+        # Fields are only ever added at the end, so an older log holds a prefix of FIELDS
+        fields = telemetry.FIELDS[:n_fields]
+        fields += tuple("field_{}".format(i) for i in range(len(fields), n_fields))
+
+        records = [decode_record(record, fields) for record in iter_records(f, record_size)]
+
+    return [record for record in records if record is not None]
+
+def read_log(directory: str):
+    '''
+    All valid records of every segment in directory, oldest first
+    '''
+    records = []
+    for index in segment_indexes(directory):
+        records.extend(read_segment(segment_path(directory, index)))
+
+    records.sort(key=lambda record: record["seq"])
+    return records
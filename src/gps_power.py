@@ -0,0 +1,159 @@
+import array
+import time
+
+import uart_device
+
+class GPSPowerManager:
+    '''
+    Keeps the LIV3 in standby between the fixes the transmit schedule needs
+
+    The caller says when it is done with the GPS and when it next needs a fix (release()), and
+    calls update() every tick. The module is woken lead_s() before the fix is due, early enough
+    for a hot-start fix and real PPS edges before the transmission it is needed for. Meanwhile
+    the PPS clock needs holdover enabled (PPSClock.enable_holdover()) to keep the schedule.
+
+    The lead time follows the recent time-to-fix measurements: the slowest of the last few
+    wake-ups plus a margin, so it shrinks once hot starts prove quick and grows after a slow one.
+    '''
+    TTFF_HISTORY = 8
+    LEAD_MARGIN_MS = 5000 #on top of the slowest recent time to fix
+    STANDBY_SLACK_S = 30 #the module wakes itself this long after we meant to, in case the WAKE-UP edge is missed
+    MIN_STANDBY_S = 30 #shorter gaps aren't worth the reacquisition
+
+    def __init__(self, gps: uart_device.LIV3, pps_clock, enabled: bool = True,
+                 initial_lead_s: int = 30, min_lead_s: int = 10, max_lead_s: int = 110):
+        '''
+        Args:
+            gps: the LIV3 to duty cycle
+            pps_clock: PPSClock driven by the same receiver, schedules the wake-up
+            enabled: False keeps the GPS awake, release() and update() do nothing
+            initial_lead_s: lead time until there are time-to-fix measurements
+            min_lead_s, max_lead_s: range the adaptive lead time is kept in
+        '''
+        self.gps = gps
+        self.pps_clock = pps_clock
+        self.enabled = enabled
+        self.initial_lead_s = initial_lead_s
+        self.min_lead_s = min_lead_s
+        self.max_lead_s = max_lead_s
+
+        self.wake_edge = -1 #pps_clock.edge_count to wake on, -1 = not sleeping
+        self.retry_edge = 0 #no standby attempts before this edge_count after one was refused
+
+        #time to fix after each wake-up, ring buffer
+        self.ttff_ms = array.array('I', [0] * self.TTFF_HISTORY)
+        self.ttff_count = 0
+        self.ttff_failures = 0 #wake-ups that ran out of lead time before fixing
+        self.awaiting_fix = False
+        self.wake_fix_count = 0
+
+        self.standby_ms = 0
+        self.t_standby = 0
+
+    def lead_s(self):
+        '''
+        How long before a fix is due the module should be woken
+        '''
+        samples = min(self.ttff_count, self.TTFF_HISTORY)
+        if samples == 0:
+            return self.initial_lead_s
+
+        slowest = 0
+        for i in range(samples):
+            slowest = max(slowest, self.ttff_ms[i])
+
+        lead = (slowest + self.LEAD_MARGIN_MS + 999) // 1000
+        return min(max(lead, self.min_lead_s), self.max_lead_s)
+
+    def record_ttff(self, ms: int):
+        self.ttff_ms[self.ttff_count % self.TTFF_HISTORY] = ms
+        self.ttff_count += 1
+
+    def release(self, fix_second: int):
+        '''
+        The current fix has been used, sleep until the next one is needed
+
+        Args:
+            fix_second: UTC second of day the next fix and PPS edges have to be there by
+
+        Returns:
+            True if the module went into standby
+        '''
+        if not self.enabled or not self.gps.awake or self.awaiting_fix:
+            return False
+
+        if self.pps_clock.edge_count < self.retry_edge:
+            return False
+
+        if not self.pps_clock.is_latched() or self.pps_clock.in_holdover:
+            return False #nothing to carry the schedule through the standby
+
+        wake_second = (fix_second - self.lead_s()) % self.pps_clock.SECONDS_PER_DAY
+        wake_edge = self.pps_clock.edge_for(wake_second)
+        standby_s = wake_edge - self.pps_clock.edge_count
+        if standby_s < self.MIN_STANDBY_S:
+            return False
+
+        if not self.gps.standby(standby_s + self.STANDBY_SLACK_S):
+            print("GPS did not acknowledge standby")
+            self.retry_edge = self.pps_clock.edge_count + 60
+            return False
+
+        self.wake_edge = wake_edge
+        self.t_standby = time.ticks_ms()
+        print("GPS standby for {} s, lead {} s".format(standby_s, self.lead_s()))
+        return True
+
+    def wake(self):
+        self.gps.wake_up()
+        self.wake_edge = -1
+        self.standby_ms += time.ticks_diff(time.ticks_ms(), self.t_standby)
+
+        self.awaiting_fix = True
+        self.wake_fix_count = self.gps.fix_count["GGA"]
+
+    def update(self, needed: bool = False):
+        '''
+        Call every tick: wakes the module when its fix is due, when holdover is about to run
+        out or when needed (e.g. the state machine lost time), and times the fix after waking
+        '''
+        if not self.gps.awake:
+            if needed or not self.pps_clock.is_latched() or self.pps_clock.edge_count >= self.wake_edge:
+                self.wake()
+            return
+
+        if not self.awaiting_fix:
+            return
+
+        elapsed = time.ticks_diff(time.ticks_ms(), self.gps.wake_ticks)
+
+        #hot start done once there is a position and real PPS edges again
+        if (self.gps.fix_count["GGA"] != self.wake_fix_count and self.gps.gga[uart_device.GGA_QUALITY] > 0
+                and not self.pps_clock.in_holdover):
+            self.awaiting_fix = False
+            self.record_ttff(elapsed)
+            print("GPS fixed {} ms after wake-up".format(elapsed))
+        elif elapsed > self.max_lead_s * 1000:
+            #count it as a max-lead fix so the next wake-up comes as early as allowed
+            self.awaiting_fix = False
+            self.ttff_failures += 1
+            self.record_ttff(self.max_lead_s * 1000)
+            print("GPS did not fix within {} s of wake-up".format(self.max_lead_s))
+
+    def stats(self):
+        '''
+        Returns:
+            dict with time-to-fix min/mean/max over the recent wake-ups, failures, the current
+            lead time and total standby time
+        '''
+        samples = min(self.ttff_count, self.TTFF_HISTORY)
+        recent = self.ttff_ms[:samples] if samples else [0]
+
+        return {"wakeups": self.ttff_count,
+                "ttff_min_ms": min(recent),
+                "ttff_mean_ms": sum(recent) // len(recent),
+                "ttff_max_ms": max(recent),
+                "ttff_failures": self.ttff_failures,
+                "lead_s": self.lead_s(),
+                "standby_s": self.standby_ms // 1000,
+                "holdover_edges": self.pps_clock.holdover_edges}
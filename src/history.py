@@ -0,0 +1,336 @@
+import array
+import binascii
+import os
+import struct
+
+# Fields kept in the history and the step each is stored at, matching what the telemetry
+# modes send: subsquare position (1/48 deg lat, 1/24 deg lon), 10 m altitude, 2 mbar,
+# 0.5 C, 0.1 V, 0.2 light units, 1 kn. A value is stored as round(value * scale).
+FIELDS = ("lat_deg", "lon_deg", "alt_m", "satellites", "temp_c", "p_mbar",
+          "v_in", "v_solar", "l_front", "l_back", "groundspeed_kn", "gps_valid")
+SCALES = (48, 24, 0.1, 1, 2, 0.5,
+          10, 10, 5, 5, 1, 1)
+
+# Block header: kind, payload length, CRC32 of the payload
+BLOCK_HEADER = "<BHI"
+BLOCK_HEADER_SIZE = 7
+BLOCK_SAMPLES = 0
+BLOCK_SUMMARY = 1
+
+BLOCK_BYTES = 512 #sample block buffer, written out when full or at the end of each hour
+MAX_SAMPLE_BYTES = 5 * (len(FIELDS) + 1) #worst case varints for one sample
+
+DAYS_IN_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+def minutes_since_2000(date: int, t_utc: float):
+    '''
+    Minutes since 2000-01-01 00:00 UTC from an RMC date (DDMMYY) and time (HHMMSS.ss)
+    '''
+    day, month, year = date // 10000, (date // 100) % 100, date % 100
+
+    days = year * 365 + (year + 3) // 4 + day - 1
+    for m in range(month - 1):
+        days += DAYS_IN_MONTH[m]
+    if month > 2 and year % 4 == 0:
+        days += 1
+
+    t = int(t_utc)
+    return (days * 24 + t // 10000) * 60 + (t // 100) % 100
+
+def next_date(date: int):
+    '''
+    RMC date (DDMMYY) of the day after date, 0 (no date) stays 0
+    '''
+    day, month, year = date // 10000, (date // 100) % 100, date % 100
+    if not 1 <= month <= 12:
+        return date
+
+    days = DAYS_IN_MONTH[month - 1] + (month == 2 and year % 4 == 0)
+    if day < days:
+        return date + 10000
+    if month < 12:
+        return 10000 + (month + 1) * 100 + year
+    return 10100 + (year + 1) % 100
+
+def zigzag(value: int):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+def unzigzag(value: int):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+def dequantize(value: int, field: int):
+    '''
+    Stored value back in the field's units, rounded to hide the float error of the division
+    '''
+    return round(value / SCALES[field], 4)
+
+def put_varint(buffer, pos: int, value: int):
+    '''
+    Write an unsigned LEB128 varint at buffer[pos], returns the position after it
+    '''
+    while value >= 0x80:
+        buffer[pos] = (value & 0x7F) | 0x80
+        value >>= 7
+        pos += 1
+    buffer[pos] = value
+    return pos + 1
+
+def get_varint(buffer, pos: int):
+    '''
+    Read an unsigned varint at buffer[pos], returns (value, position after it)
+    '''
+    value = 0
+    shift = 0
+    while True:
+        byte = buffer[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+class History:
+    '''
+    Long-term telemetry history, delta compressed to fit weeks of samples in flash
+
+    Each sample is quantized to the precision the telemetry modes send (see SCALES) and
+    stored as zigzag varints of the difference from the previous sample, so a balloon
+    drifting at altitude costs one or two bytes per field. Samples are gathered in RAM and
+    written as one block per hour (or when the block buffer fills), each block starting from
+    absolute values so it decodes on its own. Every hour also gets a summary block with the
+    min, max and mean of each field, and the last day of summaries is kept in RAM for the console.
+
+    Blocks carry a CRC32. On start-up the file is checked and cut back to its last good block,
+    so a block torn by a power loss is dropped before anything is appended after it, and at
+    most the hour in RAM (and the block being written) is lost. When the file reaches max_bytes
+    it is moved to path + ".old", replacing the previous one, and a new file is started.
+    '''
+    KEEP_SUMMARIES = 24
+
+    def __init__(self, path: str = "history.bin", max_bytes: int = 256 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+
+        n = len(FIELDS)
+        self.block = bytearray(BLOCK_BYTES)
+        self.pos = 0 #bytes used in self.block
+        self.previous = array.array('i', [0] * n) #quantized values of the previous sample in the block
+        self.previous_minute = 0
+
+        #running summary of the current hour, in quantized units
+        self.hour = -1
+        self.count = 0
+        self.mins = array.array('i', [0] * n)
+        self.maxs = array.array('i', [0] * n)
+        self.sums = array.array('i', [0] * n)
+
+        self.summaries = [] #(hour, count, mins, maxs, means) of the last KEEP_SUMMARIES hours
+
+        self.size = self.recover()
+
+    def recover(self):
+        '''
+        Cut the file back to the end of its last good block, e.g. after a write torn by a power loss
+
+        Returns:
+            size of the file, 0 if there is none
+        '''
+        try:
+            size = os.stat(self.path)[6]
+        except OSError:
+            return 0
+
+        good = 0
+        with open(self.path, "rb") as f:
+            while good + BLOCK_HEADER_SIZE <= size:
+                header = f.read(BLOCK_HEADER_SIZE)
+                kind, length, crc = struct.unpack(BLOCK_HEADER, header)
+                payload = f.read(length)
+                if len(payload) < length or binascii.crc32(payload) & 0xFFFFFFFF != crc:
+                    break
+                good += BLOCK_HEADER_SIZE + length
+
+        if good == size:
+            return size
+
+        # No truncate() on MicroPython, so copy the good part over to a new file
+        print("History {} damaged after byte {}, dropping the {} bytes after it".format(self.path, good, size - good))
+        buffer = bytearray(BLOCK_BYTES)
+        with open(self.path, "rb") as f, open(self.path + ".tmp", "wb") as out:
+            remaining = good
+            while remaining > 0:
+                n = min(f.readinto(buffer), remaining)
+                if n <= 0:
+                    break
+                out.write(memoryview(buffer)[:n])
+                remaining -= n
+        os.remove(self.path)
+        os.rename(self.path + ".tmp", self.path)
+        return good
+
+    def append(self, date: int, t_utc: float, record):
+        '''
+        Add one sample from a telemetry.Telemetry record taken at RMC date and time date, t_utc
+        '''
+        if date == 0:
+            return #no RMC date yet, the sample could not be placed in time
+
+        minute = minutes_since_2000(date, t_utc)
+        hour = minute // 60
+
+        if hour != self.hour:
+            self.end_hour()
+            self.hour = hour
+        elif self.pos + MAX_SAMPLE_BYTES > BLOCK_BYTES:
+            self.flush()
+
+        keyframe = self.pos == 0
+        pos = put_varint(self.block, self.pos, zigzag(minute if keyframe else minute - self.previous_minute))
+        self.previous_minute = minute
+
+        for i in range(len(FIELDS)):
+            value = int(round(record[FIELDS[i]] * SCALES[i]))
+            pos = put_varint(self.block, pos, zigzag(value if keyframe else value - self.previous[i]))
+            self.previous[i] = value
+
+            if self.count == 0 or value < self.mins[i]:
+                self.mins[i] = value
+            if self.count == 0 or value > self.maxs[i]:
+                self.maxs[i] = value
+            self.sums[i] = value if self.count == 0 else self.sums[i] + value
+
+        self.pos = pos
+        self.count += 1
+
+    def end_hour(self):
+        '''
+        Write out the samples and the summary of the hour so far
+        '''
+        self.flush()
+        if self.count == 0:
+            return
+
+        means = array.array('i', [(self.sums[i] + self.count // 2) // self.count for i in range(len(FIELDS))])
+        summary = (self.hour, self.count, array.array('i', self.mins), array.array('i', self.maxs), means)
+
+        payload = bytearray(MAX_SAMPLE_BYTES * 3 + 10)
+        pos = put_varint(payload, 0, self.hour)
+        pos = put_varint(payload, pos, self.count)
+        for values in summary[2:]:
+            for value in values:
+                pos = put_varint(payload, pos, zigzag(value))
+        self.write_block(BLOCK_SUMMARY, memoryview(payload)[:pos])
+
+        self.summaries.append(summary)
+        if len(self.summaries) > self.KEEP_SUMMARIES:
+            self.summaries.pop(0)
+        self.count = 0
+
+    def flush(self):
+        '''
+        Write the samples gathered so far as a block, the next sample starts a new one
+        '''
+        if self.pos == 0:
+            return
+
+        self.write_block(BLOCK_SAMPLES, memoryview(self.block)[:self.pos])
+        self.pos = 0
+
+    def write_block(self, kind: int, payload):
+        size = BLOCK_HEADER_SIZE + len(payload)
+        if self.size > 0 and self.size + size > self.max_bytes:
+            try:
+                os.remove(self.path + ".old")
+            except OSError:
+                pass
+            os.rename(self.path, self.path + ".old")
+            self.size = 0
+
+        header = struct.pack(BLOCK_HEADER, kind, len(payload), binascii.crc32(payload) & 0xFFFFFFFF)
+        with open(self.path, "ab") as f:
+            f.write(header)
+            f.write(payload)
+        self.size += size
+
+    def lines(self):
+        '''
+        Hourly summaries kept in RAM as text lines, oldest first
+        '''
+        yield "{:<14} {:>6} {:>10} {:>10} {:>10}".format("field", "hour", "min", "max", "mean")
+        for hour, count, mins, maxs, means in self.summaries:
+            for i, name in enumerate(FIELDS):
+                yield "{:<14} {:>6} {:>10} {:>10} {:>10}".format(
+                    name, hour % 24, dequantize(mins[i], i), dequantize(maxs[i], i), dequantize(means[i], i))
+
+    def dump(self):
+        '''
+        Print the hourly summaries to the console
+        '''
+        if not self.summaries:
+            print("No complete hour of history yet")
+            return
+
+        for line in self.lines():
+            print(line)
+
+def decode_samples(payload):
+    '''
+    Samples of one sample block as dicts with "minute" (since 2000) and the FIELDS values
+    '''
+    samples = []
+    previous = [0] * len(FIELDS)
+    minute = 0
+    pos = 0
+
+    while pos < len(payload):
+        keyframe = not samples
+        value, pos = get_varint(payload, pos)
+        minute = unzigzag(value) if keyframe else minute + unzigzag(value)
+
+        sample = {"minute": minute}
+        for i, name in enumerate(FIELDS):
+            value, pos = get_varint(payload, pos)
+            previous[i] = unzigzag(value) if keyframe else previous[i] + unzigzag(value)
+            sample[name] = dequantize(previous[i], i)
+        samples.append(sample)
+
+    return samples
+
+def decode_summary(payload):
+    '''
+    One summary block as a dict with "hour" (since 2000), "count" and FIELDS min/max/mean
+    '''
+    hour, pos = get_varint(payload, 0)
+    count, pos = get_varint(payload, pos)
+
+    summary = {"hour": hour, "count": count}
+    for stat in ("min", "max", "mean"):
+        for i, name in enumerate(FIELDS):
+            value, pos = get_varint(payload, pos)
+            summary["{}_{}".format(name, stat)] = dequantize(unzigzag(value), i)
+    return summary
+
+def read_history(data):
+    '''
+    Decode the contents of a history file
+
+    Returns:
+        (samples, summaries), lists of dicts in file order, up to the first torn or corrupt block
+    '''
+    samples = []
+    summaries = []
+    pos = 0
+
+    while pos + BLOCK_HEADER_SIZE <= len(data):
+        kind, length, crc = struct.unpack_from(BLOCK_HEADER, data, pos)
+        payload = data[pos + BLOCK_HEADER_SIZE:pos + BLOCK_HEADER_SIZE + length]
+        if len(payload) < length or binascii.crc32(payload) & 0xFFFFFFFF != crc:
+            break
+
+        if kind == BLOCK_SAMPLES:
+            samples.extend(decode_samples(payload))
+        elif kind == BLOCK_SUMMARY:
+            summaries.append(decode_summary(payload))
+        pos += BLOCK_HEADER_SIZE + length
+
+    return samples, summaries
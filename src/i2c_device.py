@@ -1,6 +1,166 @@
 import machine
 import math
 
+def pack_synth_parameters(buffer, P1: int, P2: int, P3: int):
+    '''
+    Pack Si5351 P1/P2/P3 synth parameters into the 8 byte PLL/multisynth register layout
+    '''
+    buffer[0] = (P3 >> 8) & 0xFF
+    buffer[1] = P3 & 0xFF
+    buffer[2] = (P1 & 0x00030000) >> 16
+    buffer[3] = (P1 >> 8) & 0xFF
+    buffer[4] = P1 & 0xFF
+    buffer[5] = ((P3 & 0x000F0000) >> 12) | ((P2 & 0x000F0000) >> 16)
+    buffer[6] = (P2 >> 8) & 0xFF
+    buffer[7] = P2 & 0xFF
+
+#Effective Si5351 reference frequency. The original hand-tuned 20m/40m constants were solved
+#against this value rather than the nominal 25 MHz, keep it so existing tx_correction values hold
+SI5351_XTAL_HZ = 24998774
+
+#Largest PLL fractional denominator (20 bits)
+MAX_DENOM = 0xFFFFF
+
+#lower edge of the 200 Hz WSPR transmit window on each band (dial frequency + 1400 Hz)
+WSPR_BANDS = {"2190m": 137400,
+              "630m":  475600,
+              "160m":  1838000,
+              "80m":   3570000,
+              "60m":   5288600,
+              "40m":   7040000,
+              "30m":   10140100,
+              "20m":   14097000,
+              "17m":   18106000,
+              "15m":   21096000,
+              "12m":   24926000,
+              "10m":   28126000,
+              "6m":    50294400,
+              "4m":    70092400,
+              "2m":    144490400}
+
+def best_fraction(num: int, den: int, max_den: int = MAX_DENOM):
+    '''
+    Closest fraction n/d to num/den (both >= 0) with d <= max_den, integer math only
+    (continued fraction convergents and the best semiconvergent, like Fraction.limit_denominator)
+    
+    Returns:
+        (n, d)
+    '''
+    p0, q0, p1, q1 = 0, 1, 1, 0
+    n, d = num, den
+    
+    while d != 0:
+        a = n // d
+        q2 = q0 + a * q1
+        if q2 > max_den:
+            break
+        p0, q0, p1, q1 = p1, q1, p0 + a * p1, q2
+        n, d = d, n - a * d
+    
+    if d == 0:
+        return (p1, q1) #num/den itself fits
+    
+    k = (max_den - q0) // q1
+    p2, q2 = p0 + k * p1, q0 + k * q1
+    
+    #|p1/q1 - num/den| <= |p2/q2 - num/den|, cross multiplied
+    if abs(p1 * den - num * q1) * q2 <= abs(p2 * den - num * q2) * q1:
+        return (p1, q1)
+    return (p2, q2)
+
+def solve_frequency_plan(f_out_hz: int, xtal_hz: int = SI5351_XTAL_HZ):
+    '''
+    Find the PLL and output multisynth settings for a carrier
+    
+    The output multisynth runs in even integer mode (lowest jitter) with the largest divider that keeps
+    the VCO within 600..900 MHz. The R divider is only used for carriers too low to reach with the
+    multisynth alone. Frequencies are then set with the PLL alone, see plan_pll().
+    
+    Args:
+        f_out_hz: carrier frequency in Hz
+        xtal_hz [optional]: reference frequency
+    
+    Returns:
+        dict with f_hz, xtal_hz, output_divider, r_div (as a power of 2), vco_hz, and pll_a/pll_b/pll_c
+        for the carrier itself
+    '''
+    f_out_hz = int(f_out_hz)
+    
+    for r_div in range(8):
+        f_ms = f_out_hz << r_div
+        
+        divider = min(900000000 // f_ms, 2048) & ~0x01 #largest even divider under the VCO limit
+        if divider in (4, 6) or divider >= 8:
+            vco_hz = f_ms * divider
+            if vco_hz >= 600000000:
+                break
+    else:
+        raise ValueError("No Si5351 plan for {} Hz".format(f_out_hz))
+    
+    plan = {"f_hz": f_out_hz,
+            "xtal_hz": xtal_hz,
+            "output_divider": divider,
+            "r_div": r_div,
+            "vco_hz": vco_hz}
+    plan['pll_a'], plan['pll_b'], plan['pll_c'] = plan_pll(plan, 0)
+    return plan
+
+def plan_pll(plan: dict, offset_hz: float):
+    '''
+    PLL (a, b, c) that puts a plan's output offset_hz above its carrier
+    
+    The denominator is chosen per frequency rather than fixed: the PLL multiplier
+    f * divider / xtal is approximated by the closest a + b/c with c up to 20 bits, which lands
+    within a few uHz on every band. A fixed denominator would step the output in units of
+    xtal / (c * divider), from ~0.66 Hz on 12m to ~4 Hz on 2m, too coarse for the 1.465 Hz
+    WSPR tone spacing. The sum is done in integer mHz, single precision floats can't hold
+    a VHF carrier to the Hz.
+    '''
+    f_mhz = plan['f_hz'] * 1000 + int(round(offset_hz * 1000))
+    num = f_mhz * (plan['output_divider'] << plan['r_div'])
+    den = plan['xtal_hz'] * 1000
+    
+    pll_a = num // den
+    pll_b, pll_c = best_fraction(num - pll_a * den, den)
+    if pll_b >= pll_c: #fraction rounded up to 1
+        pll_a += 1
+        pll_b = 0
+        pll_c = 1
+    
+    assert 15 <= pll_a <= 90
+    return (pll_a, pll_b, pll_c)
+
+_band_plans = {}
+_wspr_plans = {}
+
+def wspr_band_plan(band: str):
+    '''
+    Frequency plan for the bottom of a band's WSPR window, solved once and cached
+    '''
+    if band not in _band_plans:
+        if band not in WSPR_BANDS:
+            raise ValueError("Unsupported WSPR band: {}".format(band))
+        _band_plans[band] = solve_frequency_plan(WSPR_BANDS[band])
+        
+    return _band_plans[band]
+
+def wspr_tone_plan(band: str, offset: float, correction: int = 0, tone_spacing: float = 1.465):
+    '''
+    PLL settings for the 4 WSPR tones at offset Hz into a band, each tone_spacing above the last,
+    cached per (band, offset, correction, tone_spacing)
+    
+    Returns:
+        dict with the band plan entries plus "tones", a list of 4 (pll_a, pll_b, pll_c)
+    '''
+    key = (band, offset, correction, tone_spacing)
+    
+    if key not in _wspr_plans:
+        plan = dict(wspr_band_plan(band))
+        plan['tones'] = [plan_pll(plan, offset + correction + tone * tone_spacing) for tone in range(4)]
+        _wspr_plans[key] = plan
+        
+    return _wspr_plans[key]
+
 class I2C_Device:
     def __init__(self, i2c: machine.I2C, address: int, addrsize: int = 8):
         self.i2c = i2c
@@ -19,9 +179,41 @@ class I2C_Device:
         i2c_bytes = self.i2c.readfrom_mem(self.address, register, len_data, addrsize=self.addrsize)
         return int.from_bytes(i2c_bytes, "big")
     
+    def i2c_write_block(self, register: int, data):
+        '''
+        Burst write consecutive registers starting at register in a single transaction
+        
+        Args:
+            register: first register address
+            data: bytes/bytearray/memoryview, one byte per register
+        '''
+        self.i2c.writeto_mem(self.address, register, data, addrsize=self.addrsize)
+        
+    def i2c_read_block(self, register: int, len_data: int, buffer=None):
+        '''
+        Burst read consecutive registers starting at register in a single transaction
+        
+        Args:
+            register: first register address
+            len_data: number of registers to read
+            buffer [optional]: preallocated bytearray to read into (must be len_data long)
+        
+        Returns:
+            bytes (or the passed in buffer) holding one byte per register
+        '''
+        assert len_data >= 1
+        
+        if buffer is None:
+            return self.i2c.readfrom_mem(self.address, register, len_data, addrsize=self.addrsize)
+        
+        self.i2c.readfrom_mem_into(self.address, register, buffer, addrsize=self.addrsize)
+        return buffer
+    
     def register_dump(self, start=0, stop=256):
+        registers = self.i2c_read_block(start, stop - start)
+        
         for i in range(start, stop):
-            data = self.i2c_read(i)
+            data = registers[i - start]
             
             print("{:03d} - 0x{:02x}: ".format(i, i), end='')
             
@@ -31,23 +223,137 @@ class I2C_Device:
                 print("0x{:02x}".format(data))
                 
 class SI5351(I2C_Device):
+    SHADOW_SIZE = 188 #registers 0 - 187 cover everything the driver touches
+    VOLATILE_REGISTERS = (0, 1, 177) #status, sticky interrupts, self-clearing PLL reset
+    
     def __init__(self, i2c: machine.I2C, address: int = 0x60):
         super().__init__(i2c, address)
         
+        self.synth_buffer = bytearray(8) #PLL/multisynth parameter block
+        
+        #RAM copy of the register map, only trusted once it has been read from the chip
+        self.shadow = bytearray(self.SHADOW_SIZE)
+        self.shadow_valid = False
+        
+        #set while something else drives the bus directly (core1_tx.Core1Transmitter), the shadow
+        #map is stale and every driver access is refused until it is cleared
+        self.bus_owner = None
+        
+    def check_bus(self):
+        if self.bus_owner is not None:
+            raise RuntimeError("Si5351 is in use by {}".format(self.bus_owner))
+    
+    def i2c_write(self, register: int, data):
+        self.check_bus()
+        super().i2c_write(register, data)
+    
+    def i2c_read(self, register: int, len_data = 1):
+        self.check_bus()
+        return super().i2c_read(register, len_data)
+    
+    def i2c_write_block(self, register: int, data):
+        self.check_bus()
+        super().i2c_write_block(register, data)
+    
+    def i2c_read_block(self, register: int, len_data: int, buffer=None):
+        self.check_bus()
+        return super().i2c_read_block(register, len_data, buffer)
+        
+    def resync(self):
+        '''
+        Reload the shadow register map from the chip in one burst read
+        '''
+        self.i2c_read_block(0, self.SHADOW_SIZE, self.shadow)
+        self.shadow_valid = True
+        
+    def verify(self, repair: bool = False):
+        '''
+        Compare the chip against the shadow register map, e.g. after a brownout
+        
+        Args:
+            repair [optional]: rewrite mismatched registers from the shadow copy (and reset the PLLs if needed)
+        
+        Returns:
+            list of mismatched register addresses
+        '''
+        assert self.shadow_valid
+        
+        device = self.i2c_read_block(0, self.SHADOW_SIZE)
+        mismatched = []
+        
+        for i in range(self.SHADOW_SIZE):
+            if device[i] != self.shadow[i] and i not in self.VOLATILE_REGISTERS:
+                mismatched.append(i)
+                
+        if repair and len(mismatched) > 0:
+            for i in mismatched:
+                self.i2c_write(i, self.shadow[i])
+            
+            if any(26 <= register <= 41 for register in mismatched): #PLL A/B parameters touched
+                self.reset_plls()
+                
+        return mismatched
+        
+    def write_register(self, register: int, data: int):
+        '''
+        Write a single register through the shadow map, skipping the bus if it already holds data
+        '''
+        self.check_bus() #the shadow map is stale too while the bus is owned elsewhere
+        data &= 0xFF
+        
+        if register < self.SHADOW_SIZE:
+            if self.shadow_valid and self.shadow[register] == data:
+                return
+            self.shadow[register] = data
+        
+        self.i2c_write(register, data)
+        
+    def write_registers(self, register: int, data):
+        '''
+        Write a block of consecutive registers through the shadow map
+        Only the span between the first and last byte that differs from the shadow goes out, in one burst
+        '''
+        self.check_bus()
+        first = 0
+        last = len(data) - 1
+        shadow = self.shadow
+        
+        if self.shadow_valid:
+            while first <= last and data[first] == shadow[register + first]:
+                first += 1
+                
+            if first > last: #nothing changed
+                return
+            
+            while data[last] == shadow[register + last]:
+                last -= 1
+        
+        for i in range(first, last + 1):
+            shadow[register + i] = data[i]
+        
+        self.i2c_write_block(register + first, memoryview(data)[first:last + 1])
+        
+    def update_register(self, register: int, mask: int, data: int):
+        '''
+        Read-modify-write the bits in mask using the shadow map instead of a bus read
+        '''
+        if not self.shadow_valid:
+            self.resync()
+            
+        self.write_register(register, (self.shadow[register] & ~mask) | (data & mask))
+        
     def enable_output(self, clk_channel: int, output: bool):
         '''
         Turn the desired output on or off
         '''
         channel = clk_channel + 16 #register offset
-        control_data = self.i2c_read(channel) #channel shutdown control
-        enable_data = self.i2c_read(0x03) #output enable control
         
         if output:
-            self.i2c_write(channel, (control_data & ~0x80))
-            self.i2c_write(0x03, (enable_data & ~(0x01 << clk_channel)))
+            self.update_register(channel, 0x80, 0x00) #channel shutdown control
+            self.update_register(0x03, 0x01 << clk_channel, 0x00) #output enable control
         else:
-            self.i2c_write(channel, (control_data | 0x80))
-            self.i2c_write(0x03, (enable_data | (0x01 << clk_channel)))
+            self.update_register(channel, 0x80, 0x80)
+            self.update_register(0x03, 0x01 << clk_channel, 0xFF)
     
     def configure_pll(self, pll: int, mult: int, num: int, denom: int):
         '''
@@ -63,36 +369,57 @@ class SI5351(I2C_Device):
         b [num]     = the fractional numerator (0..1,048,575)
         c [denom]   = the fractional denominator (1..1,048,575)
         '''
+        if pll == 0: #PLL A
+            base = 26
+        else: #PLL B
+            base = 34
+        
+        self.pll_register_image(mult, num, denom, self.synth_buffer)
+        self.write_registers(base, self.synth_buffer)
+    
+    def pll_register_image(self, mult: int, num: int, denom: int, image=None):
+        '''
+        Compute the 8 byte PLL register block for fVCO = fXTAL * (mult + num/denom)
+        Uses integer math only, so it is exact and cheap enough to precompute tone tables with
+        
+        Args:
+            mult, num, denom: see configure_pll()
+            image [optional]: preallocated bytearray(8) to write into
+        '''
         #constrain to valid values
         assert 15 <= mult <= 90
         assert 0 < denom <= 0xFFFFF
-        assert num <= 0xFFFFF
+        assert 0 <= num <= 0xFFFFF
         
-        if num == 0: #integer
-            P1 = int(128 * mult - 512)
-            P2 = num
-            P3 = denom
-        else: #fractional
-            P1 = int(128 * mult + math.floor(128 * (num/denom)) - 512)
-            P2 = int(128 * num - denom * math.floor(128 * (num/denom)))
-            P3 = denom
+        frac_floor = (128 * num) // denom #0 in integer mode
+        
+        P1 = 128 * mult + frac_floor - 512
+        P2 = 128 * num - denom * frac_floor
+        P3 = denom
+        
+        if image is None:
+            image = bytearray(8)
+            
+        pack_synth_parameters(image, P1, P2, P3)
+        return image
+    
+    def write_pll_image(self, pll: int, image):
+        '''
+        Write a precomputed PLL register image, only the bytes that differ from
+        what the PLL currently holds go out on the bus
         
+        Args:
+            pll: PLL to write (0 = A, 1 = B)
+            image: 8 byte register image from pll_register_image()
+        '''
         if pll == 0: #PLL A
             base = 26
         else: #PLL B
             base = 34
         
-        #write registers
-        self.i2c_write(base, (P3 >> 8) & 0xFF)
-        self.i2c_write(base + 1, P3 & 0xFF)
-        self.i2c_write(base + 2, (P1 & 0x00030000) >> 16)
-        self.i2c_write(base + 3, (P1 >> 8) & 0xFF)
-        self.i2c_write(base + 4, P1 & 0xFF)
-        self.i2c_write(base + 5, ((P3 & 0x000F0000) >> 12) | ((P2 & 0x000F0000) >> 16))
-        self.i2c_write(base + 6, (P2 >> 8) & 0xFF)
-        self.i2c_write(base + 7, P2 & 0xFF)
+        self.write_registers(base, image)
     
-    def configure_output_multisynth(self, channel: int, div: int, num: int, denom: int):
+    def configure_output_multisynth(self, channel: int, div: int, num: int, denom: int, r_div: int = 0):
         '''
         Configure channel output multisynth
         Adapted from: https://github.com/adafruit/Adafruit_Si5351_Library/blob/master/Adafruit_SI5351.cpp
@@ -103,14 +430,21 @@ class SI5351(I2C_Device):
                     or 8..900 in fractional mode (MSx_INT=0).
         b [num]   = The fractional numerator (0..1,048,575)
         c [denom] = The fractional denominator (1..1,048,575)
+        
+        r_div     = Output R divider, as a power of 2 (0..7)
         '''
         
         assert 0 <= channel <= 2
         assert 4 <= div <= 2048
         assert 0 <= num <= 0xFFFFF
         assert 0 <= denom <= 0xFFFFF
+        assert 0 <= r_div <= 7
     
-        if num == 0: #integer
+        if div == 4: #divide by 4 uses its own mode bits with P1 = P2 = 0
+            P1 = 0
+            P2 = 0
+            P3 = 1
+        elif num == 0: #integer
             P1 = int(128 * div - 512)
             P2 = 0
             P3 = denom
@@ -126,15 +460,19 @@ class SI5351(I2C_Device):
         else:
             base = 58
         
-        #write registers
-        self.i2c_write(base, (P3 >> 8) & 0xFF)
-        self.i2c_write(base + 1, P3 & 0xFF)
-        self.i2c_write(base + 2, (P1 & 0x00030000) >> 16)
-        self.i2c_write(base + 3, (P1 >> 8) & 0xFF)
-        self.i2c_write(base + 4, P1 & 0xFF)
-        self.i2c_write(base + 5, ((P3 & 0x000F0000) >> 12) | ((P2 & 0x000F0000) >> 16))
-        self.i2c_write(base + 6, (P2 >> 8) & 0xFF)
-        self.i2c_write(base + 7, P2 & 0xFF)
+        pack_synth_parameters(self.synth_buffer, P1, P2, P3)
+        self.synth_buffer[2] |= r_div << 4
+        if div == 4:
+            self.synth_buffer[2] |= 0x0C #MSx_DIVBY4
+        
+        self.write_registers(base, self.synth_buffer)
+    
+    def write_synth_parameters(self, base: int, P1: int, P2: int, P3: int):
+        '''
+        Pack P1/P2/P3 into the 8 byte PLL/multisynth register layout and write it as one burst
+        '''
+        pack_synth_parameters(self.synth_buffer, P1, P2, P3)
+        self.write_registers(base, self.synth_buffer)
     
     def configure_output_driver(self, channel: int, int_mode: int = 1, pll_source: int = 0,
                                 invert: int = 0, input_source: int = 0x03, drive: int = 0x03):
@@ -144,14 +482,13 @@ class SI5351(I2C_Device):
         assert 0 <= channel <= 2
         channel_addr = channel + 16
         
-        data = self.i2c_read(channel_addr) & 0x80 #keep enable bit
-        data |= (int_mode << 6) | (pll_source << 5) | (invert << 4) | (input_source << 2) | drive
+        data = (int_mode << 6) | (pll_source << 5) | (invert << 4) | (input_source << 2) | drive
         
-        self.i2c_write(channel + 16, data)
+        self.update_register(channel_addr, 0x7F, data) #keep enable bit
     
     def reset_plls(self):
         '''
-        Reset pll sources
+        Reset pll sources (self-clearing, so this bypasses the shadow map)
         '''
         self.i2c_write(177, 0xA0)
         
@@ -169,7 +506,7 @@ class SI5351(I2C_Device):
         elif cl == 8:
             setting = 0x80
             
-        self.i2c_write(183, setting)
+        self.write_register(183, setting)
         
     def load_register_map(self, filename: str):
         '''
@@ -184,7 +521,7 @@ class SI5351(I2C_Device):
                 data = int(line[4:6], 16)
                 
                 if address < 200: #writing above this bricks i2c
-                    self.i2c_write(address, data)
+                    self.write_register(address, data)
                     
     def calculate_frequency(self, pll_a, pll_b, pll_c, multi_a, multi_b, multi_c, f_vco = 25e6):
         '''
@@ -212,18 +549,29 @@ class SI5351(I2C_Device):
         #200 Hz WSPR allocation on all bands
         assert 0 <= offset #<= 200
         
-        if band == "20m": #base freq = 14.097.000 MHz
-            pll_a = 28
-            pll_b_base = 200052
-            pll_c = 1023890
-            output_divider = 50
-        elif band == "40m": #base freq = 7.040.000 MHz
-            pll_a = 28
-            pll_b_base = 82619
-            pll_c = 511945
-            output_divider = 100
-            
         #set output divider
-        self.configure_output_multisynth(channel, output_divider, 0, 1)
-        #magic numbers for 1.465 Hz tone spacing
-        self.configure_pll(pll, pll_a, pll_b_base + int((offset + correction) * 2.04778157), pll_c)
\ No newline at end of file
+        self.configure_wspr_output(channel, band)
+        self.write_pll_image(pll, self.wspr_tone_image(band, offset, correction, self.synth_buffer))
+    
+    def configure_wspr_output(self, channel: int, band: str):
+        '''
+        Set the output multisynth divider for a WSPR band, this does not change between tones
+        '''
+        plan = wspr_band_plan(band)
+        self.configure_output_multisynth(channel, plan['output_divider'], 0, 1, r_div=plan['r_div'])
+    
+    def wspr_tone_image(self, band: str, offset: float, correction: int = 0, image=None):
+        '''
+        PLL register image for a tone in the given band, see transmit_wspr_tone() for args
+        '''
+        pll_a, pll_b, pll_c = plan_pll(wspr_band_plan(band), offset + correction)
+        
+        return self.pll_register_image(pll_a, pll_b, pll_c, image)
+    
+    def wspr_tone_images(self, band: str, offset: float, correction: int = 0, tone_spacing: float = 1.465):
+        '''
+        PLL register images for all 4 WSPR tones, from the cached plan for (band, offset, correction)
+        '''
+        plan = wspr_tone_plan(band, offset, correction, tone_spacing)
+        
+        return [self.pll_register_image(pll_a, pll_b, pll_c) for pll_a, pll_b, pll_c in plan['tones']]
@@ -0,0 +1,173 @@
+import array
+import gc
+import time
+
+class Instrument:
+    '''
+    Cheap timing, heap and GC counters for finding out where the firmware spends its time
+
+    Each named slot keeps a call count, total and worst time, and a log2 histogram of
+    durations in microseconds (bucket k counts times in [2^k, 2^(k+1)) us). Slots are
+    allocated the first time a name is used; after that recording only touches preallocated
+    arrays, so it is safe from timer callbacks. Disabled, every call returns straight away.
+    '''
+    MAX_SLOTS = 24
+    BUCKETS = 24 #up to ~16 s
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+
+        self.names = []
+        self.slots = {}
+        self.counts = array.array('I', [0] * self.MAX_SLOTS)
+        self.total_us = array.array('I', [0] * self.MAX_SLOTS) #wraps after ~71 min of accumulated time
+        self.max_us = array.array('I', [0] * self.MAX_SLOTS)
+        self.histogram = array.array('I', [0] * (self.MAX_SLOTS * self.BUCKETS))
+
+        #heap and explicit GC
+        self.heap_low = gc.mem_free() if enabled else 0
+        self.gc_count = 0
+
+    def slot(self, name: str):
+        '''
+        Index of the slot for name, registering it on first use (allocates, so do it outside ISRs)
+        '''
+        if name not in self.slots:
+            if len(self.names) >= self.MAX_SLOTS:
+                raise ValueError("Out of instrument slots for {}".format(name))
+            self.slots[name] = len(self.names)
+            self.names.append(name)
+        return self.slots[name]
+
+    def start(self):
+        '''
+        Timestamp to hand to stop() later
+        '''
+        if not self.enabled:
+            return 0
+        return time.ticks_us()
+
+    def stop(self, slot: int, t_start: int):
+        '''
+        Record the time since start() against slot
+        '''
+        if self.enabled:
+            self.record(slot, time.ticks_diff(time.ticks_us(), t_start))
+
+    def record(self, slot: int, us: int):
+        '''
+        Add one duration to slot, allocation free
+        '''
+        if not self.enabled:
+            return
+
+        if us < 0:
+            us = -us
+
+        self.counts[slot] += 1
+        self.total_us[slot] = (self.total_us[slot] + us) & 0xFFFFFFFF
+        if us > self.max_us[slot]:
+            self.max_us[slot] = us
+
+        bucket = 0
+        value = us >> 1
+        while value and bucket < self.BUCKETS - 1:
+            value >>= 1
+            bucket += 1
+        self.histogram[slot * self.BUCKETS + bucket] += 1
+
+    def wrap(self, owner, name: str):
+        '''
+        Replace owner.name (a function or bound method) with a timed version recording to a slot
+        of the same name. Does nothing when disabled, so the hot path keeps no overhead.
+        '''
+        if not self.enabled:
+            return
+
+        function = getattr(owner, name)
+        slot = self.slot(name)
+        instrument = self
+
+        def timed(*args, **kwargs):
+            t_start = time.ticks_us()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                instrument.record(slot, time.ticks_diff(time.ticks_us(), t_start))
+
+        setattr(owner, name, timed)
+
+    def sample_heap(self):
+        '''
+        Update the free heap low-water mark, cheap enough to call every tick
+        '''
+        if self.enabled:
+            free = gc.mem_free()
+            if free < self.heap_low:
+                self.heap_low = free
+
+    def collect(self):
+        '''
+        gc.collect(), timed into the "gc" slot. MicroPython has no hook for the collections it
+        starts on its own, so only these are counted.
+        '''
+        if not self.enabled:
+            gc.collect()
+            return
+
+        self.sample_heap() #the low-water mark is just before a collection
+        t_start = time.ticks_us()
+        gc.collect()
+        self.record(self.slot("gc"), time.ticks_diff(time.ticks_us(), t_start))
+        self.gc_count += 1
+
+    def percentile_us(self, slot: int, fraction: float):
+        '''
+        Upper bound of the histogram bucket holding the given fraction of the samples
+        '''
+        target = self.counts[slot] * fraction
+        seen = 0
+        for bucket in range(self.BUCKETS):
+            seen += self.histogram[slot * self.BUCKETS + bucket]
+            if seen >= target:
+                return min((2 << bucket) - 1, self.max_us[slot])
+        return self.max_us[slot]
+
+    def lines(self):
+        '''
+        Summary as text lines, one per slot plus one for the heap
+        '''
+        yield "{:<20} {:>8} {:>10} {:>10} {:>10} {:>10}".format("slot", "count", "mean_us", "p50_us", "p90_us", "max_us")
+        for slot, name in enumerate(self.names):
+            count = self.counts[slot]
+            if count == 0:
+                continue
+            yield "{:<20} {:>8} {:>10} {:>10} {:>10} {:>10}".format(
+                name, count, self.total_us[slot] // count, self.percentile_us(slot, 0.5),
+                self.percentile_us(slot, 0.9), self.max_us[slot])
+
+        yield "heap free {} low {} allocated {}, {} explicit gc".format(
+            gc.mem_free(), self.heap_low, gc.mem_alloc(), self.gc_count)
+
+    def dump(self):
+        '''
+        Print the summary to the console
+        '''
+        if not self.enabled:
+            print("Instrumentation is off, set \"instrument\": true in config.json")
+            return
+
+        for line in self.lines():
+            print(line)
+
+    def write_log(self, f, prefix: str = ""):
+        '''
+        Append the summary to an open log file, each line starting with prefix
+        '''
+        if not self.enabled:
+            return
+
+        for line in self.lines():
+            f.write(prefix)
+            f.write(line)
+            f.write("\n")
@@ -12,6 +12,12 @@ def main():
     
     mode = "selftest"
     
+    # What runs when nobody presses a key, set by "runtime" in config.json
+    if b.runtime == "async":
+        default_mode = "async_runtime"
+    else:
+        default_mode = "state_machine"
+    
     if hw_status['Si5351'] == "FAIL" or hw_status['LIV3R'] == "FAIL" or hw_status['PPS'] == "FAIL":
         print("Self-test failed on critical component! Holding for 5s before resetting...")
         mode = "reset_sleep"
@@ -22,6 +28,9 @@ def main():
         print("Press 't' + ENTER to enter raw telemetry mode")
         print("Press 'c' + ENTER to play the 20m calibration tone")
         print("Press 'g' + ENTER to stream raw GPS data")
+        print("Press 'a' + ENTER to start the task-based (asyncio) runtime")
+        print("Press 'i' + ENTER to dump timing/heap instrumentation (also works once the state machine runs)")
+        print("Press 'h' + ENTER to print the hourly telemetry history (also works once the state machine runs)")
         print("Press ENTER to start state machine immediately")
         
         t_start = time.time()
@@ -41,12 +50,19 @@ def main():
                 elif char_in == 'g':
                     mode = "gps_stream"
                     break
+                elif char_in == 'a':
+                    mode = "async_runtime"
+                    break
+                elif char_in == 'i':
+                    b.instrument.dump()
+                elif char_in == 'h' and b.history is not None:
+                    b.history.dump()
                 elif char_in == '\n':
-                    mode = "state_machine"
+                    mode = default_mode
                     break
                 
             if (time.time() - t_start) >= 10:
-                mode = "state_machine"
+                mode = default_mode
                 break
 
     if mode == "reset_sleep":
@@ -96,9 +112,24 @@ def main():
             print(b.gps.get_GPGGA_data())
             print()
     elif mode == "state_machine":
+        spoll = select.poll()
+        spoll.register(sys.stdin, select.POLLIN)
+        
         while True:
             b.tick()
-            time.sleep(0.01)
+            
+            # 'i' + ENTER dumps the instrumentation, 'h' + ENTER the history, without stopping the loop
+            if spoll.poll(0):
+                char_in = sys.stdin.read(1)
+                if char_in == 'i':
+                    b.instrument.dump()
+                elif char_in == 'h' and b.history is not None:
+                    b.history.dump()
+            
+            b.idle()
+    elif mode == "async_runtime":
+        import async_runtime #only pay for asyncio when it is used
+        async_runtime.run(b)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
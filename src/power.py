@@ -0,0 +1,133 @@
+import machine
+import time
+
+class PowerScheduler:
+    '''
+    Sleeps and clocks the RP2040 down between deadlines, and keeps track of where the time went
+
+    Callers say how long they can wait and whether anything needs the UART/USB/timers meanwhile;
+    the scheduler picks machine.lightsleep() or an ordinary sleep and the CPU clock. With USB
+    attached it never lightsleeps (that drops the USB connection) and never goes below high_mhz.
+    '''
+    #rough board figures for the current estimate, calibrate against a bench supply (see README power specs)
+    BASE_MA = 40.0 #GPS, Si5351, regulators and the RP2040 at idle
+    MA_PER_MHZ = 0.2 #RP2040 core, awake
+    LIGHTSLEEP_MA = 38.0 #peripherals keep drawing, the core mostly doesn't
+
+    def __init__(self, high_mhz: int = 48, low_mhz: int = 24, wake_margin_ms: int = 30,
+                 min_lightsleep_ms: int = 50, vbus_pin: int = None, enabled: bool = True):
+        '''
+        Args:
+            high_mhz: clock for real work, >= 48 MHz keeps USB working
+            low_mhz: clock while only waiting
+            wake_margin_ms: how early to wake before a deadline
+            min_lightsleep_ms: shorter waits are plain sleeps, lightsleep entry/exit isn't free
+            vbus_pin: GPIO that reads high with USB power present (GPIO24 on a Pico), None if unknown
+            enabled: False keeps the clock fixed and only ever sleeps normally, but still keeps stats
+        '''
+        self.high_mhz = high_mhz
+        self.low_mhz = low_mhz
+        self.wake_margin_ms = wake_margin_ms
+        self.min_lightsleep_ms = min_lightsleep_ms
+        self.enabled = enabled
+
+        self.vbus = None
+        if vbus_pin is not None:
+            self.vbus = machine.Pin(vbus_pin, machine.Pin.IN)
+
+        #called with no arguments after every clock change, e.g. to reinit UART baud dividers
+        self.clock_change_callbacks = []
+
+        self.mhz = high_mhz
+        self.t_start = time.ticks_ms()
+        self.t_clock = self.t_start
+        self.clock_ms = {}
+        self.lightsleep_ms = 0
+        self.lightsleeps = 0
+
+    def usb_attached(self):
+        if self.vbus is None:
+            return False
+        return self.vbus.value() == 1
+
+    def account_clock(self):
+        '''
+        Book the time since the last clock change against the current clock
+        '''
+        now = time.ticks_ms()
+        self.clock_ms[self.mhz] = self.clock_ms.get(self.mhz, 0) + time.ticks_diff(now, self.t_clock)
+        self.t_clock = now
+
+    def set_clock(self, mhz: int):
+        if mhz == self.mhz:
+            return
+
+        self.account_clock()
+        machine.freq(mhz * 1000000)
+        self.mhz = mhz
+
+        for callback in self.clock_change_callbacks:
+            callback()
+
+    def run_fast(self):
+        '''
+        Clock up for work that needs it (I2C/UART traffic, frame building, tone timing)
+        '''
+        self.set_clock(self.high_mhz)
+
+    def run_slow(self):
+        '''
+        Clock down while only waiting, unless USB needs the high clock
+        '''
+        if self.enabled and not self.usb_attached():
+            self.set_clock(self.low_mhz)
+        else:
+            self.set_clock(self.high_mhz)
+
+    def sleep_for(self, ms: int, deep: bool = False):
+        '''
+        Wait up to ms, waking wake_margin_ms early
+
+        Args:
+            deep: the caller needs nothing serviced until then (no UART RX, no soft timers), so
+                  lightsleep is allowed
+        '''
+        if deep and self.enabled and not self.usb_attached() and ms - self.wake_margin_ms >= self.min_lightsleep_ms:
+            ms -= self.wake_margin_ms
+
+            self.account_clock()
+            machine.lightsleep(ms)
+
+            #book the sleep separately from the clock it was entered at
+            now = time.ticks_ms()
+            self.lightsleep_ms += time.ticks_diff(now, self.t_clock)
+            self.t_clock = now
+            self.lightsleeps += 1
+        elif ms > 0:
+            time.sleep_ms(ms)
+
+    def stats(self):
+        '''
+        Returns:
+            dict with uptime, lightsleep time and count, awake duty cycle, time per clock and an
+            estimated average current in mA from the figures at the top of this class
+        '''
+        self.account_clock()
+
+        uptime_ms = time.ticks_diff(time.ticks_ms(), self.t_start)
+        if uptime_ms <= 0:
+            uptime_ms = 1
+
+        charge = self.lightsleep_ms * self.LIGHTSLEEP_MA
+        awake_ms = 0
+        for mhz, ms in self.clock_ms.items():
+            awake_ms += ms
+            charge += ms * (self.BASE_MA + self.MA_PER_MHZ * mhz)
+
+        return {"uptime_s": uptime_ms // 1000,
+                "lightsleep_s": self.lightsleep_ms // 1000,
+                "lightsleeps": self.lightsleeps,
+                "duty_cycle": awake_ms / uptime_ms,
+                "clock_s": {mhz: ms // 1000 for mhz, ms in self.clock_ms.items()},
+                "est_current_ma": charge / uptime_ms,
+                "usb": self.usb_attached()}
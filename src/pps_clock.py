@@ -0,0 +1,261 @@
+import machine
+import time
+
+class PPSClock:
+    '''
+    UTC time of day kept by counting GPS PPS edges
+
+    The time is latched once from an NMEA sentence, after that every PPS edge advances it by
+    one second with no parsing, and time.ticks_us() since the last edge gives the sub-second part.
+    pps_edge() must be called from the PPS pin's hard interrupt, and rearm_holdover() from the
+    work it schedules.
+
+    With holdover enabled a timer stands in for missing PPS edges (GPS in standby), free running
+    on the RP2040 crystal from the last real edge until real edges return or holdover runs out.
+    '''
+    SECONDS_PER_DAY = 86400
+    PPS_TIMEOUT_MS = 1500 #longer than this without an edge and the clock is no longer trusted
+    HOLDOVER_GRACE_MS = 100 #how late a real edge may be before the timer takes over
+
+    def __init__(self):
+        self.edge_count = 0
+        self.edge_ticks_us = time.ticks_us()
+        self.edge_ticks_ms = time.ticks_ms()
+
+        self.latched_edge = -1 #edge_count when latched_seconds was true, -1 = not latched
+        self.latched_seconds = 0
+
+        #edge the previous sentence given to latch() was tied to, and its time
+        self.candidate_edge = -2
+        self.candidate_seconds = 0
+
+        self.slips = 0 #times an NMEA time disagreed with the clock and forced a re-latch
+
+        #holdover, see enable_holdover()
+        self.holdover_ms = 0
+        self.holdover_timer = None
+        self.edge_handler = None
+        self.real_edge_ticks_ms = self.edge_ticks_ms
+        self.in_holdover = False #latest edge came from the timer
+        self.holdover_edges = 0
+
+    def enable_holdover(self, holdover_ms: int, edge_handler):
+        '''
+        Keep the clock running for up to holdover_ms after PPS edges stop
+
+        Args:
+            edge_handler: called with no arguments for every timer edge, i.e. whatever the PPS
+                          interrupt does once pps_edge() has counted a new second
+        '''
+        self.holdover_ms = holdover_ms
+        self.edge_handler = edge_handler
+        self.holdover_callback = self.holdover_edge #bind once, a bound method lookup allocates
+        self.holdover_timer = machine.Timer()
+
+    def pps_edge(self):
+        '''
+        Hard IRQ work for one PPS edge, allocation free: timestamp and count it, nothing else,
+        so the timestamp is the edge and not whenever a soft callback got to run
+
+        Returns:
+            True if the edge starts a new second, False if the holdover timer already counted it
+        '''
+        now_us = time.ticks_us()
+        now_ms = time.ticks_ms()
+
+        #a real edge trailing the timer edge of the same second only corrects the timing
+        new_second = not (self.in_holdover and time.ticks_diff(now_ms, self.edge_ticks_ms) < 500)
+
+        self.edge_ticks_us = now_us
+        self.edge_ticks_ms = now_ms
+        self.real_edge_ticks_ms = now_ms
+        self.in_holdover = False
+        if new_second:
+            self.edge_count += 1
+
+        return new_second
+
+    def rearm_holdover(self):
+        '''
+        Restart the holdover timer from the latest real edge, from the work pps_edge() schedules
+        '''
+        if self.holdover_timer is None:
+            return
+
+        delay = time.ticks_diff(time.ticks_add(self.real_edge_ticks_ms, 1000 + self.HOLDOVER_GRACE_MS), time.ticks_ms())
+        self.holdover_timer.init(period=max(delay, 1), mode=machine.Timer.ONE_SHOT,
+                                 callback=self.holdover_callback)
+
+    def holdover_edge(self, timer=None):
+        '''
+        Timer callback standing in for a PPS edge that did not arrive
+        '''
+        if time.ticks_diff(time.ticks_ms(), self.real_edge_ticks_ms) >= self.holdover_ms:
+            return #held over long enough, let is_latched() expire
+
+        state = machine.disable_irq() #the PPS hard IRQ writes the same fields
+        if time.ticks_diff(time.ticks_ms(), self.real_edge_ticks_ms) < 500:
+            machine.enable_irq(state)
+            return #a real edge beat the timer, its scheduled work rearms the timer
+
+        #the missing edge was due exactly one second after the previous one
+        self.edge_ticks_us = time.ticks_add(self.edge_ticks_us, 1000000)
+        self.edge_ticks_ms = time.ticks_add(self.edge_ticks_ms, 1000)
+        self.edge_count += 1
+        self.in_holdover = True
+        machine.enable_irq(state)
+        self.holdover_edges += 1
+
+        delay = time.ticks_diff(time.ticks_add(self.edge_ticks_ms, 1000), time.ticks_ms())
+        self.holdover_timer.init(period=max(delay, 1), mode=machine.Timer.ONE_SHOT,
+                                 callback=self.holdover_callback)
+
+        self.edge_handler()
+
+    def sentence_seconds(self, t_utc: int, sentence_ticks_ms: int):
+        '''
+        Seconds of day of an NMEA time (hhmmss * 100 + centiseconds) if the sentence belongs to
+        the latest PPS edge, -1 if it arrived too late or before that edge
+
+        sentence_ticks_ms must be when the sentence came in over the UART (LIV3.fix_ticks), not
+        when it was parsed. That is the latest it can have come in, so a sentence stamped before
+        the latest edge is rejected, but one that sat in an idle UART buffer can still look as
+        if it belonged to the edge after its own; latch() guards against that.
+        '''
+        if t_utc < 0:
+            return -1
+
+        age = time.ticks_diff(sentence_ticks_ms, self.edge_ticks_ms)
+        if not 0 <= age < 1000:
+            return -1
+
+        hhmmss = t_utc // 100
+        return (hhmmss // 10000) * 3600 + ((hhmmss // 100) % 100) * 60 + hhmmss % 100
+
+    def latch(self, t_utc: int, sentence_ticks_ms: int):
+        '''
+        Set the clock from the time of an NMEA sentence that came in at sentence_ticks_ms (time.ticks_ms())
+
+        A sentence parsed late, after the edge following its own, looks like it belongs to that
+        next edge, so the clock is only set once sentences tied to two consecutive edges agree
+        with each other: call this for every new sentence until it returns True.
+
+        Returns:
+            True if the sentence and the one before it could be tied to consecutive PPS edges
+            and the clock is now set
+        '''
+        state = machine.disable_irq()
+        seconds = self.sentence_seconds(t_utc, sentence_ticks_ms)
+        edge_count = self.edge_count
+        machine.enable_irq(state)
+
+        if seconds < 0:
+            return False
+
+        agrees = (edge_count == self.candidate_edge + 1
+                  and seconds == (self.candidate_seconds + 1) % self.SECONDS_PER_DAY)
+        self.candidate_edge = edge_count
+        self.candidate_seconds = seconds
+        if not agrees:
+            return False
+
+        state = machine.disable_irq()
+        self.latched_seconds = seconds
+        self.latched_edge = edge_count
+        machine.enable_irq(state)
+
+        return True
+
+    def verify(self, t_utc: int, sentence_ticks_ms: int):
+        '''
+        Compare a later NMEA time with the clock, and drop the latch if they disagree
+
+        Returns:
+            False only if the sentence proves the clock wrong
+        '''
+        state = machine.disable_irq() #no edge between tying the sentence to one and reading the clock
+        seconds = self.sentence_seconds(t_utc, sentence_ticks_ms)
+        clock_seconds = self.seconds()
+        machine.enable_irq(state)
+
+        if seconds < 0 or not self.is_latched():
+            return True
+
+        if seconds != clock_seconds:
+            self.latched_edge = -1
+            self.slips += 1
+            return False
+
+        return True
+
+    def is_latched(self):
+        '''
+        True if the clock was set and PPS edges are still arriving, or are being held over
+        '''
+        if self.latched_edge < 0:
+            return False
+
+        if time.ticks_diff(time.ticks_ms(), self.edge_ticks_ms) >= self.PPS_TIMEOUT_MS:
+            return False
+
+        return time.ticks_diff(time.ticks_ms(), self.real_edge_ticks_ms) < max(self.PPS_TIMEOUT_MS, self.holdover_ms)
+
+    def seconds(self):
+        '''
+        UTC seconds of day at the latest PPS edge
+        '''
+        return (self.latched_seconds + self.edge_count - self.latched_edge) % self.SECONDS_PER_DAY
+
+    def subsecond_us(self):
+        '''
+        Microseconds since the latest PPS edge
+        '''
+        state = machine.disable_irq()
+        edge_ticks_us = self.edge_ticks_us
+        machine.enable_irq(state)
+
+        return time.ticks_diff(time.ticks_us(), edge_ticks_us)
+
+    def t_utc(self):
+        '''
+        Current time in the same hhmmss.ss float form the NMEA dicts use
+        '''
+        seconds = self.seconds()
+        hhmmss = (seconds // 3600) * 10000 + ((seconds // 60) % 60) * 100 + seconds % 60
+
+        return hhmmss + min(self.subsecond_us(), 999999) / 1000000
+
+    def next_second_on(self, period_s: int, offset_s: int = 0):
+        '''
+        First second of day after the latest edge where (second - offset_s) is a multiple of period_s,
+        e.g. next_second_on(120) is the start of the next even minute
+        '''
+        seconds = self.seconds()
+        return (seconds - (seconds - offset_s) % period_s + period_s) % self.SECONDS_PER_DAY
+
+    def next_edge_on(self, period_s: int, offset_s: int = 0):
+        '''
+        next_second_on() together with the edge_count its PPS edge will have, both from one
+        snapshot, so an edge landing in between cannot make the returned edge one already passed
+
+        Returns:
+            (second of day, edge_count), the edge is always after the latest one
+        '''
+        state = machine.disable_irq()
+        edge_count = self.edge_count
+        seconds = (self.latched_seconds + edge_count - self.latched_edge) % self.SECONDS_PER_DAY
+        machine.enable_irq(state)
+
+        second = (seconds - (seconds - offset_s) % period_s + period_s) % self.SECONDS_PER_DAY
+        return second, edge_count + (second - seconds) % self.SECONDS_PER_DAY
+
+    def edge_for(self, seconds_of_day: int):
+        '''
+        Value edge_count will have on the PPS edge that starts seconds_of_day (within the next 24 h)
+        '''
+        state = machine.disable_irq()
+        edge_count = self.edge_count
+        seconds = (self.latched_seconds + edge_count - self.latched_edge) % self.SECONDS_PER_DAY
+        machine.enable_irq(state)
+
+        return edge_count + (seconds_of_day - seconds) % self.SECONDS_PER_DAY
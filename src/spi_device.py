@@ -2,6 +2,50 @@ import machine
 import time
 import struct
 import math
+import array
+
+#standard atmosphere altitude table for altitude_from_pa(): pressure in Pa at every ALTITUDE_STEP_M,
+#from ALTITUDE_MIN_M up, built once from 44330 * (1 - (p / p_ref) ** (1 / 5.255))
+ALTITUDE_P_REF_PA = 101300
+ALTITUDE_MIN_M = -500
+ALTITUDE_STEP_M = 125
+ALTITUDE_MAX_M = 40000
+ALTITUDE_TABLE_PA = array.array('i', [int(ALTITUDE_P_REF_PA * (1 - h / 44330) ** 5.255 + 0.5)
+                                      for h in range(ALTITUDE_MIN_M, ALTITUDE_MAX_M + 1, ALTITUDE_STEP_M)])
+
+def shift_toward_zero(value: int, bits: int):
+    '''
+    value / 2^bits truncated toward zero like the datasheet's C divisions (a plain >> floors
+    negative values, and below 20 C a 1 LSB TEMP difference moves P by ~20 Pa via the squared terms)
+    '''
+    if value < 0:
+        return -((-value) >> bits)
+    return value >> bits
+
+def altitude_from_pa(p_pa: int):
+    '''
+    Pressure altitude in meters from pressure in Pa, by linear interpolation in ALTITUDE_TABLE_PA
+    (within 1 m of the formula below 15 km and 5 m up to 40 km, where 1 Pa is already worth ~20 m)
+    '''
+    table = ALTITUDE_TABLE_PA
+    
+    if p_pa >= table[0]:
+        return ALTITUDE_MIN_M
+    if p_pa <= table[-1]:
+        return ALTITUDE_MAX_M
+    
+    #pressure falls with altitude, find table[i] > p_pa >= table[i + 1]
+    low = 0
+    high = len(table) - 1
+    while high - low > 1:
+        mid = (low + high) >> 1
+        if table[mid] > p_pa:
+            low = mid
+        else:
+            high = mid
+            
+    span = table[low] - table[high]
+    return ALTITUDE_MIN_M + low * ALTITUDE_STEP_M + ((table[low] - p_pa) * ALTITUDE_STEP_M + (span >> 1)) // span
 
 class SPI_Device:
     def __init__(self, spi: machine.SPI, cs: machine.Pin):
@@ -15,6 +59,9 @@ class SPI_Device:
         self.spi.write(byte)
         
 class MS5607(SPI_Device):
+    #max ADC conversion time per OSR setting (256, 512, 1024, 2048, 4096) from the datasheet
+    CONVERSION_US = (600, 1170, 2280, 4540, 9040)
+    
     def __init__(self, spi: machine.SPI, cs: machine.Pin):
         super().__init__(spi, cs)
         
@@ -22,9 +69,27 @@ class MS5607(SPI_Device):
         self.reset()
         
         #load calibration coefficients from PROM
-        self.ROM = []
+        rom = []
         for i in range(0,8):
-            self.ROM.append(int.from_bytes(self.read_prom(i), "big"))
+            rom.append(int.from_bytes(self.read_prom(i), "big"))
+        self.load_coefficients(rom)
+            
+        #conversion in progress: 0 = none, 1 = D1, 2 = D2
+        self.converting = 0
+        self.conversion_ticks = 0
+        self.conversion_osr = 4
+        
+        #pressure + temperature measurement in progress, see start_measurement()
+        self.measuring = False
+        self.measurement_osr = 4
+        self.measurement_d = 1 #which half of the measurement is converting
+        self.D1 = 0
+        
+        #latest result, kept until the next measurement completes
+        self.measured = False
+        self.temp_e2 = 0 #0.01 C
+        self.p_pa = 0
+        self.measurement = None #dict form, built on demand by finish_measurement()
         
     def reset(self):
         '''
@@ -35,26 +100,45 @@ class MS5607(SPI_Device):
         time.sleep(10e-3) #wait 10ms for reset to complete
         self.cs.value(1)
         
-    def convert_and_read(self, d: int, osr: int=4):
+    def start_conversion(self, d: int, osr: int=4):
         '''
-        Begin result conversion on the altimeter and return the raw result for post-processing
+        Start a D1 (pressure) or D2 (temperature) conversion and return without waiting for it
         
         Args:
             d: Convert D1 (pressure) or D2 (temperature)
-            osr: Sensor oversampling rate (default=4)
+            osr: Sensor oversampling rate (0 - 4, default=4)
         '''
-        #D1 = pressure, D2 = temperature
         assert 1 <= d <= 2
         assert 0 <= osr <= 4
         convert_command = 0x40 + ((d - 1) * 16) + (2 * osr)
-
-        #start conversion
+        
+        #the conversion keeps running with CS released
         self.cs.value(0)
         self.spi_write_byte(convert_command)
-        time.sleep(20e-3) #TODO: replace these with hardware sleeps
         self.cs.value(1)
         
-        time.sleep(5e-3)
+        self.converting = d
+        self.conversion_osr = osr
+        self.conversion_ticks = time.ticks_us()
+        
+    def conversion_remaining_us(self):
+        '''
+        Microseconds until the conversion in progress is done, 0 if it already is
+        '''
+        elapsed = time.ticks_diff(time.ticks_us(), self.conversion_ticks)
+        return max(0, self.CONVERSION_US[self.conversion_osr] - elapsed)
+        
+    def poll_conversion(self):
+        '''
+        Collect the result of the conversion started by start_conversion() if its time is up
+        
+        Returns:
+            raw 24 bit result, or None if the conversion is still running
+        '''
+        assert self.converting != 0
+        
+        if self.conversion_remaining_us() > 0:
+            return None
         
         #start ADC read
         self.cs.value(0)
@@ -62,7 +146,81 @@ class MS5607(SPI_Device):
         raw_data = self.spi.read(3)
         self.cs.value(1)
         
+        self.converting = 0
         return int.from_bytes(raw_data, "big")
+        
+    def convert_and_read(self, d: int, osr: int=4):
+        '''
+        Begin result conversion on the altimeter and return the raw result for post-processing
+        Blocks only for the conversion time of the chosen OSR
+        
+        Args:
+            d: Convert D1 (pressure) or D2 (temperature)
+            osr: Sensor oversampling rate (default=4)
+        '''
+        self.start_conversion(d, osr)
+        time.sleep_us(self.conversion_remaining_us())
+        
+        return self.poll_conversion()
+    
+    def start_measurement(self, osr: int=4):
+        '''
+        Start a pressure + temperature measurement (D1 then D2), advanced by poll_measurement()
+        The previous result stays available until this one completes
+        '''
+        self.measuring = True
+        self.measurement_osr = osr
+        self.measurement_d = 1
+        self.start_conversion(1, osr)
+        
+    def poll_measurement(self):
+        '''
+        Advance the measurement started by start_measurement() without blocking
+        
+        Returns:
+            True once the result is available in self.temp_e2 and self.p_pa
+        '''
+        if not self.measuring:
+            return self.measured
+        
+        raw = self.poll_conversion()
+        if raw is None:
+            return False
+        
+        if self.measurement_d == 1:
+            self.D1 = raw
+            self.measurement_d = 2
+            self.start_conversion(2, self.measurement_osr)
+            return False
+        
+        self.measuring = False
+        self.temp_e2, self.p_pa = self.compensate_raw(self.D1, raw)
+        self.measured = True
+        self.measurement = None
+        return True
+    
+    def await_measurement(self):
+        '''
+        Wait out whatever is left of the measurement started by start_measurement(), allocation free
+        '''
+        if not self.measuring and not self.measured:
+            self.start_measurement(self.measurement_osr)
+            
+        while not self.poll_measurement():
+            time.sleep_us(self.conversion_remaining_us())
+    
+    def finish_measurement(self):
+        '''
+        Wait out whatever is left of the measurement started by start_measurement()
+        
+        Returns:
+            dict with p_mbar, t_c and alt_m
+        '''
+        self.await_measurement()
+        
+        if self.measurement is None:
+            self.measurement = self.results(self.temp_e2, self.p_pa)
+        return self.measurement
     
     def read_prom(self, addr: int):
         '''
@@ -82,50 +240,86 @@ class MS5607(SPI_Device):
         
         return word
     
-    def get_temperature(self):
+    def load_coefficients(self, rom):
         '''
-        Read and calculate the calibrated temperature
+        Keep the PROM words and precompute the per-device compensation constants from them
         '''
-        D2 = self.convert_and_read(2)
-        C5 = self.ROM[5]
-        C6 = self.ROM[6]
-        
-        dT = D2 - C5 * 256
+        self.ROM = rom
         
-        T = 2000 + dT * (C6 / (2 ** 23))
-        
-        return T / 100
+        self.SENS_T1 = rom[1] << 16 #C1 * 2^16
+        self.OFF_T1 = rom[2] << 17 #C2 * 2^17
+        self.TCS = rom[3] #C3, sensitivity temperature coefficient, applied as * dT >> 7
+        self.TCO = rom[4] #C4, offset temperature coefficient, applied as * dT >> 6
+        self.T_REF = rom[5] << 8 #C5 * 2^8
+        self.TEMPSENS = rom[6] #C6, applied as * dT >> 23
     
-    def get_pressure_and_temperature(self):
+    def get_temperature(self, osr: int=4):
         '''
-        Read and calculate calibrated temperature and pressure, as well as altitude
+        Read and calculate the calibrated temperature
         '''
-        D1 = self.convert_and_read(1)
-        D2 = self.convert_and_read(2)
+        D2 = self.convert_and_read(2, osr)
+        dT = D2 - self.T_REF
         
-        C1 = self.ROM[1]
-        C2 = self.ROM[2]
-        C3 = self.ROM[3]
-        C4 = self.ROM[4]
-        C5 = self.ROM[5]
-        C6 = self.ROM[6]
+        return (2000 + shift_toward_zero(dT * self.TEMPSENS, 23)) / 100
+    
+    def compensate_raw(self, D1: int, D2: int):
+        '''
+        Integer datasheet compensation of raw D1 and D2, including the second order terms below 20 C
         
-        dT = D2 - C5 * 256
-        OFF = C2 * (2 ** 17) + (C4 * dT) / (2 ** 6)
-        SENS = C1 * (2 ** 16) + (C3 * dT) / (2 ** 7)
+        Returns:
+            (temperature in 0.01 C, pressure in Pa)
+        '''
+        dT = D2 - self.T_REF
+        TEMP = 2000 + shift_toward_zero(dT * self.TEMPSENS, 23)
+        OFF = self.OFF_T1 + shift_toward_zero(self.TCO * dT, 6)
+        SENS = self.SENS_T1 + shift_toward_zero(self.TCS * dT, 7)
         
-        P = (D1 * SENS / (2 ** 21) - OFF) / (2 ** 15)
-        T = 2000 + dT * (C6 / (2 ** 23))
-        A = self.get_altitude(P / 100)
+        #second order temperature compensation, where the balloon spends the flight
+        if TEMP < 2000:
+            cold = (TEMP - 2000) * (TEMP - 2000)
+            T2 = (dT * dT) >> 31
+            OFF2 = (61 * cold) >> 4
+            SENS2 = 2 * cold
+            
+            if TEMP < -1500:
+                very_cold = (TEMP + 1500) * (TEMP + 1500)
+                OFF2 += 15 * very_cold
+                SENS2 += 8 * very_cold
+                
+            TEMP -= T2
+            OFF -= OFF2
+            SENS -= SENS2
+            
+        P = shift_toward_zero((D1 * SENS >> 21) - OFF, 15)
         
+        return TEMP, P
+    
+    def compensate(self, D1: int, D2: int):
+        '''
+        Calculate calibrated temperature and pressure, as well as altitude, from raw D1 and D2
+        '''
+        TEMP, P = self.compensate_raw(D1, D2)
+        return self.results(TEMP, P)
+    
+    def results(self, TEMP: int, P: int):
+        '''
+        Result dict from compensated TEMP (0.01 C) and P (Pa)
+        '''
         results_dict = {"p_mbar": P / 100,
-                        "t_c": T / 100,
-                        "alt_m": A}
+                        "t_c": TEMP / 100,
+                        "alt_m": altitude_from_pa(P)}
         return results_dict
     
+    def get_pressure_and_temperature(self, osr: int=4):
+        '''
+        Read and calculate calibrated temperature and pressure, as well as altitude
+        Blocking, use start_measurement()/poll_measurement() to overlap the conversions with other work
+        '''
+        self.start_measurement(osr)
+        return self.finish_measurement()
+    
     def get_altitude(self, p_mbar: float):
         '''
         Convert barometric pressure in millibars to altitude in meters
         '''
-        p_ref = 1013
-        return 44330 * (1 - (p_mbar/p_ref) ** (1/5.255))
\ No newline at end of file
+        return altitude_from_pa(int(p_mbar * 100))
@@ -0,0 +1,123 @@
+import array
+import machine
+import time
+
+class SymbolTimer:
+    '''
+    Fires a callback on every WSPR symbol boundary, locked to the PPS edge the message started on
+
+    A WSPR symbol is 8192 / 12000 s = 682666 2/3 us. The boundaries are tracked exactly with
+    an integer accumulator (682666 us per symbol plus 2/3 us carried in thirds), and each
+    boundary is armed as a one-shot from the start edge rather than as a free running period,
+    so timer latency never accumulates. Every real PPS edge during the message moves the start
+    time to where GPS says it was, which takes out the RP2040 crystal's drift as well.
+    '''
+    SYMBOL_US = 682666 #whole microseconds per symbol
+    SYMBOL_THIRDS = 2 #plus 2/3 us
+
+    #how far a PPS stamp may land after where the schedule expects it and still be followed:
+    #crystal drift since the last edge followed, plus the hard IRQ's own entry jitter
+    DRIFT_US_PER_S = 50
+    EDGE_JITTER_US = 20
+
+    def __init__(self, callback, symbols: int = 162):
+        '''
+        Args:
+            callback: called with the symbol index at each boundary, 0..symbols (the last one
+                      ends the message), from the start() caller for 0 and a hard IRQ after that
+            symbols: symbols per message
+        '''
+        self.callback = callback
+        self.symbols = symbols
+
+        #target ticks_us of every boundary as last armed, for jitter measurement
+        self.targets = array.array('i', [0] * (symbols + 1))
+
+        self.running = False
+        self.index = 0
+        self.start_us = 0 #ticks_us of boundary 0, corrected by pps_edge()
+        self.start_edge = 0 #PPS edge count boundary 0 was on
+        self.acc_us = 0 #offset of boundary index from start_us, whole us
+        self.acc_thirds = 0 #and the thirds of a us on top
+        self.synced_edge = 0 #PPS edge start_us was last set from
+        self.late_edges = 0 #PPS stamps ignored as late, over all messages
+
+        self.timer = machine.Timer()
+        self.irq = self.boundary #bind once, a bound method lookup allocates
+
+    def start(self, edge_ticks_us: int, edge_count: int):
+        '''
+        Start a message whose first symbol begins on the PPS edge at edge_ticks_us, which
+        was edge number edge_count. Symbol 0 is signalled straight away.
+        '''
+        self.start_us = edge_ticks_us
+        self.start_edge = edge_count
+        self.synced_edge = edge_count
+        self.index = 0
+        self.acc_us = 0
+        self.acc_thirds = 0
+        self.running = True
+
+        self.targets[0] = edge_ticks_us
+        self.callback(0)
+        self.arm_next()
+
+    def stop(self):
+        self.running = False
+        self.timer.deinit()
+
+    def arm_next(self):
+        '''
+        Advance the accumulator one symbol and arm the one-shot for that boundary, allocation free
+        '''
+        self.acc_us += self.SYMBOL_US
+        self.acc_thirds += self.SYMBOL_THIRDS
+        if self.acc_thirds >= 3:
+            self.acc_thirds -= 3
+            self.acc_us += 1
+
+        target = time.ticks_add(self.start_us, self.acc_us)
+        self.targets[self.index + 1] = target
+
+        delay = time.ticks_diff(target, time.ticks_us())
+        if delay < 1:
+            delay = 1
+        self.timer.init(mode=machine.Timer.ONE_SHOT, period=delay, tick_hz=1000000,
+                        callback=self.irq, hard=True)
+
+    def boundary(self, timer):
+        '''
+        Hard IRQ at each symbol boundary
+        '''
+        if not self.running:
+            return
+
+        self.index += 1
+        if self.index >= self.symbols:
+            self.running = False
+        else:
+            self.arm_next()
+
+        self.callback(self.index)
+
+    def pps_edge(self, edge_count: int, edge_ticks_us: int):
+        '''
+        Resynchronize to a real PPS edge during the message: edge number edge_count is exactly
+        a whole number of seconds after the start edge. The boundary already armed keeps its
+        time, the correction applies from the next one.
+
+        A stamp can only be late (interrupts held off, e.g. by a flash write), never early, so
+        one later than the crystal can have drifted since the last edge followed is ignored
+        instead of moving every boundary after it; an early one is followed straight away.
+        '''
+        if not self.running or edge_count <= self.synced_edge:
+            return
+
+        seconds = edge_count - self.start_edge
+        expected = time.ticks_add(self.start_us, 1000000 * seconds)
+        if time.ticks_diff(edge_ticks_us, expected) > self.DRIFT_US_PER_S * (edge_count - self.synced_edge) + self.EDGE_JITTER_US:
+            self.late_edges += 1
+            return
+
+        self.start_us = time.ticks_add(edge_ticks_us, -1000000 * seconds)
+        self.synced_edge = edge_count
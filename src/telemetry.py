@@ -0,0 +1,91 @@
+import array
+
+import uart_device
+
+# Fixed layout of the telemetry record, new fields go at the end so older logs still line up
+FIELDS = ("lat_deg", "lon_deg", "alt_m", "satellites",
+          "temp_c", "p_mbar",
+          "v_in", "v_solar", "l_front", "l_back",
+          "gps_valid", "t_utc", "groundspeed_kn", "gps_matched",
+          "v_in_min", "v_in_max", "v_solar_min", "v_solar_max")
+
+INT_FIELDS = ("satellites", "gps_valid", "gps_matched")
+
+class Telemetry:
+    '''
+    One cycle's telemetry in a preallocated float array with a fixed set of fields
+
+    Reads and writes like the dict it replaces (telemetry['alt_m']), but unknown keys raise
+    KeyError instead of growing the record, and updating it never allocates a container.
+    The update_*() methods copy straight out of the drivers' own state.
+    '''
+    INDEX = {name: i for i, name in enumerate(FIELDS)}
+    IS_INT = tuple(name in INT_FIELDS for name in FIELDS)
+
+    def __init__(self):
+        self.values = array.array('f', [0] * len(FIELDS))
+
+    def __getitem__(self, key: str):
+        i = self.INDEX[key]
+        if self.IS_INT[i]:
+            return int(self.values[i])
+        return self.values[i]
+
+    def __setitem__(self, key: str, value):
+        self.values[self.INDEX[key]] = value
+
+    def __contains__(self, key: str):
+        return key in self.INDEX
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def keys(self):
+        return FIELDS
+
+    def items(self):
+        for name in FIELDS:
+            yield name, self[name]
+
+    def __repr__(self):
+        return "{" + ", ".join("'{}': {}".format(name, value) for name, value in self.items()) + "}"
+
+    def update_gps(self, gps: uart_device.LIV3, matched: int):
+        '''
+        Copy the cached GGA/RMC pair (see LIV3.await_epoch()) into the record
+        '''
+        gga = gps.gga
+        values = self.values
+        index = self.INDEX
+
+        values[index["lat_deg"]] = gga[uart_device.GGA_LAT_E6] / 1000000
+        values[index["lon_deg"]] = gga[uart_device.GGA_LON_E6] / 1000000
+        values[index["gps_valid"]] = abs(gga[uart_device.GGA_LAT_E6]) >= 1000000 or abs(gga[uart_device.GGA_LON_E6]) >= 1000000
+        values[index["t_utc"]] = gga[uart_device.GGA_T_UTC] / 100
+        values[index["alt_m"]] = gga[uart_device.GGA_ALT_DM] / 10
+        values[index["satellites"]] = gga[uart_device.GGA_SATELLITES]
+        values[index["groundspeed_kn"]] = gps.rmc[uart_device.RMC_SPEED_E2] / 100
+        values[index["gps_matched"]] = matched
+
+    def update_altimeter(self, altimeter):
+        '''
+        Copy the MS5607's latest compensated result into the record
+        '''
+        self.values[self.INDEX["temp_c"]] = altimeter.temp_e2 / 100
+        self.values[self.INDEX["p_mbar"]] = altimeter.p_pa / 100
+
+    def csv_header(self):
+        return ",".join(FIELDS)
+
+    def write_csv(self, f):
+        '''
+        Write the record as one CSV line in FIELDS order, without building the line first
+        '''
+        for i in range(len(FIELDS)):
+            if i > 0:
+                f.write(",")
+            if self.IS_INT[i]:
+                f.write(str(int(self.values[i])))
+            else:
+                f.write(str(self.values[i]))
+        f.write("\n")
@@ -1,5 +1,6 @@
 import machine
 import time
+import array
 #from typing import Callable
 
 class UART_Device:
@@ -15,7 +16,144 @@ class UART_Device:
             
         return uart_str
         
+#fixed-point layouts of the parsed sentences held by LIV3, all values are ints
+#GGA: time as hhmmss * 100 + centiseconds, lat/lon in microdegrees, altitudes in decimeters
+GGA_T_UTC = 0
+GGA_LAT_E6 = 1
+GGA_LON_E6 = 2
+GGA_QUALITY = 3
+GGA_SATELLITES = 4
+GGA_HDOP_E2 = 5
+GGA_ALT_DM = 6
+GGA_UND_DM = 7
+GGA_VALID = 8
+GGA_LENGTH = 9
+
+#RMC: speed/track/magnetic variation scaled by 100, date as ddmmyy
+RMC_T_UTC = 0
+RMC_STATUS = 1 #character code of the status field ('A' active, 'V' void), 0 if invalid
+RMC_LAT_E6 = 2
+RMC_LON_E6 = 3
+RMC_SPEED_E2 = 4
+RMC_TRACK_E2 = 5
+RMC_DATE = 6
+RMC_MAGVAR_E2 = 7
+RMC_VALID = 8
+RMC_LENGTH = 9
+
+GSA_FIX_MODE = 0 #1 = no fix, 2 = 2D, 3 = 3D
+GSA_SATELLITES_USED = 1
+GSA_PDOP_E2 = 2
+GSA_HDOP_E2 = 3
+GSA_VDOP_E2 = 4
+GSA_VALID = 5
+GSA_LENGTH = 6
+
+#fields that must be present for a sentence to count as valid (same rules as the old string parsers)
+GGA_REQUIRED = (1, 2, 4, 7, 9, 11)
+RMC_POSITION_REQUIRED = (3, 5)
+RMC_REQUIRED = (1, 2, 7, 8, 9)
+GSA_REQUIRED = (2, 15, 16, 17)
+
+#Teseo LIV3 configuration (see the Teseo NMEA command manual, UM2229)
+#CDB 201 NMEA message list: bit per sentence
+LIV3_NMEA_MASK_BITS = {"GGA": 0x2,
+                       "GSA": 0x4,
+                       "RMC": 0x40}
+
+#CDB 102 NMEA port baud rate codes
+LIV3_BAUD_CODES = {9600: 0x5,
+                   14400: 0x6,
+                   19200: 0x7,
+                   38400: 0x8,
+                   57600: 0x9,
+                   115200: 0xA}
+
+def nmea_command(body: str):
+    '''
+    Frame a command body as a complete NMEA sentence with checksum
+    '''
+    checksum = 0
+    for c in body:
+        checksum ^= ord(c)
+        
+    return "${}*{:02X}\r\n".format(body, checksum).encode()
+
+def hex_digit(c: int):
+    '''
+    Value of an ASCII hex digit, -1 if it is not one
+    '''
+    if 0x30 <= c <= 0x39:
+        return c - 0x30
+    if 0x41 <= c <= 0x46:
+        return c - 0x41 + 10
+    if 0x61 <= c <= 0x66:
+        return c - 0x61 + 10
+    return -1
+
+def nmea_int(line, start: int, end: int):
+    '''
+    Integer part of the numeric field line[start:end]
+    '''
+    value = 0
+    for i in range(start, end):
+        c = line[i]
+        if c == 0x2E: #'.'
+            break
+        value = value * 10 + c - 0x30
+    return value
+
+def nmea_fixed(line, start: int, end: int, decimals: int):
+    '''
+    Numeric field line[start:end] as an int scaled by 10 ** decimals (extra digits are truncated)
+    '''
+    value = 0
+    negative = False
+    frac_digits = -1 #-1 until the decimal point
+    
+    for i in range(start, end):
+        c = line[i]
+        if c == 0x2D: #'-'
+            negative = True
+        elif c == 0x2E: #'.'
+            frac_digits = 0
+        else:
+            if frac_digits >= 0:
+                if frac_digits == decimals:
+                    break
+                frac_digits += 1
+            value = value * 10 + c - 0x30
+    
+    if frac_digits < 0:
+        frac_digits = 0
+    while frac_digits < decimals:
+        value *= 10
+        frac_digits += 1
+        
+    if negative:
+        return -value
+    return value
+
+def nmea_latlon_e6(line, start: int, end: int, hemisphere: int):
+    '''
+    (d)ddmm.mmmm field to signed microdegrees, hemisphere is the N/S/E/W character
+    '''
+    minutes_e4 = nmea_fixed(line, start, end, 4) #dddmmmmmm, stays well inside small int range
+    degrees = minutes_e4 // 1000000
+    minutes_e4 -= degrees * 1000000
+    
+    value = degrees * 1000000 + (minutes_e4 * 5) // 3 #minutes * 1e6 / 60 with minutes scaled by 1e4
+    
+    if hemisphere == 0x53 or hemisphere == 0x57: #'S' or 'W'
+        return -value
+    return value
+
 class LIV3(UART_Device):
+    SENTENCES = ("GGA", "RMC", "GSA")
+    MAX_FIELDS = 24
+    RESET_MS = 500 #time the module needs after $PSTMSRR before it talks again
+    EPOCH_MAX_AGE_MS = 1100 #GGA/RMC older than one 1 Hz epoch (plus slack) can't be paired
+    
     def __init__(self, uart: machine.UART,
                  wake: machine.Pin, reset: machine.Pin,
                  pps: machine.Pin):
@@ -26,156 +164,608 @@ class LIV3(UART_Device):
         
         self.reset.value(1) #reset is active low, so set pin to high to force out of reset
         self.wake.value(1) #force wake up
+        self.awake = True
+        self.wake_ticks = time.ticks_ms()
+        
+        #incremental line assembly, fed from the UART's own RX ring buffer
+        self.rx_chunk = bytearray(64)
+        self.line_buffer = bytearray(128) #NMEA caps sentences at 82 chars
+        self.line_len = 0
+        self.line_ticks = 0 #time.ticks_ms() the '$' of the line being assembled came in at
+        
+        #start offset of each comma separated field in the line buffer, plus one past the last
+        self.field_starts = array.array('B', [0] * (self.MAX_FIELDS + 1))
+        self.field_count = 0
+        self.checksum_errors = 0
+        
+        #latest parsed sentences, updated in place (see the GGA_/RMC_/GSA_ layouts)
+        self.gga = array.array('i', [0] * GGA_LENGTH)
+        self.rmc = array.array('i', [0] * RMC_LENGTH)
+        self.gsa = array.array('i', [0] * GSA_LENGTH)
+        
+        #UTC time field of the latest GGA and RMC even when the rest of the sentence is empty,
+        #so the two can be paired up before there is a fix (-1 = no time yet)
+        self.gga_epoch = -1
+        self.rmc_epoch = -1
+        
+        #when each sentence type last arrived (its '$', not when it was parsed) and how many have been seen
+        self.fix_ticks = {}
+        self.fix_count = {}
+        for sentence in self.SENTENCES:
+            self.fix_ticks[sentence] = 0
+            self.fix_count[sentence] = 0
+        
+        #every line with a good checksum, whatever its type (used to find the module's baud rate)
+        self.line_count = 0
+        
+        #latest $PSTM... reply to a configuration command
+        self.reply = b""
+        self.reply_count = 0
+        
+        self.baudrate = 9600 #module default
         
     def pps_interrupt(self, *args):
         print("PPS!")
         self.led.toggle()
         
-    def get_GPGGA_data(self):
+    def poll(self):
         '''
-        Block and await GPGGA string over UART from GPS module
+        Drain whatever bytes the UART has buffered without blocking and parse any complete sentences
         
         Returns:
-            dict containing all GPGGA info
+            number of sentences parsed
         '''
+        parsed = 0
+        chunk = self.rx_chunk
+        line = self.line_buffer
         
-        #flush potentially stale data
-        if self.uart.any() > 0:
-            self.uart.flush()
+        #a byte that was queued came in before the ones queued behind it, one character time each,
+        #so a sentence left in the buffer across a blocking step still gets its arrival time
+        n = self.uart.any()
+        t_drain = time.ticks_ms()
+        queued = n
+        char_us = 10000000 // self.baudrate
         
-        while True:
-            #await data over UART
-            while self.uart.any() == 0:
-                pass
+        while n > 0:
+            n = self.uart.readinto(chunk, min(n, len(chunk)))
+            if not n:
+                break
+            
+            for i in range(n):
+                c = chunk[i]
+                
+                if c == 0x24: #'$' always starts a new sentence
+                    self.line_len = 0
+                    if queued > 0:
+                        self.line_ticks = time.ticks_add(t_drain, -((queued - 1) * char_us // 1000))
+                    else:
+                        self.line_ticks = time.ticks_ms()
+                queued -= 1
+                
+                if self.line_len < len(line):
+                    line[self.line_len] = c
+                    self.line_len += 1
+                else: #overlong line, drop it
+                    self.line_len = 0
+                    
+                if c == 0x0A: #'\n'
+                    if self.parse_line(line, self.line_len):
+                        parsed += 1
+                    self.line_len = 0
+            
+            n = self.uart.any()
+            
+        return parsed
+    
+    def split_fields(self, line, length: int):
+        '''
+        Validate the *hh checksum of the line and record where each field starts, without copying anything
         
-            try:
-                uart_str = self.uart.readline().decode("utf-8")
-            except UnicodeError:
-                uart_str = "000000"
+        Returns:
+            True if the checksum matched
+        '''
+        starts = self.field_starts
+        checksum = 0
+        count = 0
+        starts[0] = 1
+        
+        for i in range(1, length):
+            c = line[i]
+            
+            if c == 0x2A: #'*'
+                if i + 2 >= length:
+                    return False
                 
-            if uart_str[0:6] == '$GPGGA':
-                break
+                starts[count + 1] = i + 1 #so field k always ends at starts[k + 1] - 1
+                self.field_count = count + 1
+                return checksum == ((hex_digit(line[i + 1]) << 4) | hex_digit(line[i + 2]))
+            
+            checksum ^= c
+            
+            if c == 0x2C: #','
+                count += 1
+                if count >= self.MAX_FIELDS:
+                    return False
+                starts[count] = i + 1
+                
+        return False #no checksum
+    
+    def field_epoch(self, line):
+        '''
+        UTC time field (field 1) of the split line as hhmmss * 100 + centiseconds, -1 if empty
+        '''
+        if not self.fields_present((1,)):
+            return -1
+        return nmea_fixed(line, self.field_starts[1], self.field_starts[2] - 1, 2)
+    
+    def fields_present(self, required):
+        '''
+        True if every field index in required exists and is not empty
+        '''
+        starts = self.field_starts
         
-        # split all data into list
-        GPGGA_list = uart_str.split(',')
+        for k in required:
+            if k >= self.field_count or starts[k + 1] - 1 == starts[k]:
+                return False
+        return True
+    
+    def parse_line(self, line, length: int):
+        '''
+        Parse one complete NMEA line in place and cache the result
+        
+        Returns:
+            True if the line was a sentence type we keep
+        '''
+        if length < 9 or line[0] != 0x24:
+            return False
         
-        GPGGA_dict = {}
+        if not self.split_fields(line, length):
+            self.checksum_errors += 1
+            return False
         
-        try:
-            lat_arcmin = float(GPGGA_list[2])
-            lon_arcmin = float(GPGGA_list[4])
-            
-            lat_remainder = (lat_arcmin % 100) / 60
-            lon_remainder = (lon_arcmin % 100) / 60
-            
-            lat_deg = float(int(lat_arcmin / 100)) + lat_remainder
-            lon_deg = float(int(lon_arcmin / 100)) + lon_remainder
-            
-            if GPGGA_list[3] == 'S':
-                lat_deg *= -1
-            if GPGGA_list[5] == 'W':
-                lon_deg *= -1
-            
-            GPGGA_dict['t_utc'] = float(GPGGA_list[1])
-            GPGGA_dict['lat_deg'] = lat_deg
-            GPGGA_dict['lon_deg'] = lon_deg
-            GPGGA_dict['alt_m'] = float(GPGGA_list[9])
-            GPGGA_dict['und_m'] = float(GPGGA_list[11])
-            GPGGA_dict['satellites'] = int(GPGGA_list[7])
-            GPGGA_dict['data_valid'] = 1
-        except (ValueError,  IndexError):
-            GPGGA_dict['t_utc'] = 0
-            GPGGA_dict['lat_deg'] = 0
-            GPGGA_dict['lon_deg'] = 0
-            GPGGA_dict['alt_m'] = 0
-            GPGGA_dict['und_m'] = 0
-            GPGGA_dict['satellites'] = 0
-            GPGGA_dict['data_valid'] = 0
-        
-        return GPGGA_dict
+        self.line_count += 1
         
-    def get_GPRMC_data(self):
+        #proprietary replies to configuration commands, only seen while configuring so a copy is fine
+        if line[1] == 0x50 and line[2] == 0x53 and line[3] == 0x54 and line[4] == 0x4D: #PSTM
+            self.reply = bytes(line[:length]).strip()
+            self.reply_count += 1
+            return False
+        
+        #sentence type after any talker ID ($GP, $GN, ...)
+        if line[3] == 0x47 and line[4] == 0x47 and line[5] == 0x41: #GGA
+            self.parse_GPGGA(line)
+            self.gga_epoch = self.field_epoch(line)
+            sentence = "GGA"
+        elif line[3] == 0x52 and line[4] == 0x4D and line[5] == 0x43: #RMC
+            self.parse_GPRMC(line)
+            self.rmc_epoch = self.field_epoch(line)
+            sentence = "RMC"
+        elif line[3] == 0x47 and line[4] == 0x53 and line[5] == 0x41: #GSA
+            self.parse_GPGSA(line)
+            sentence = "GSA"
+        else:
+            return False
+        
+        self.fix_ticks[sentence] = self.line_ticks
+        self.fix_count[sentence] += 1
+        return True
+    
+    def send_command(self, body: str):
         '''
-        Block and await GPRMC string over UART from GPS module
+        Send one NMEA command, body is everything between '$' and '*'
+        '''
+        self.uart.write(nmea_command(body))
+    
+    def await_reply(self, prefixes, timeout_ms: int = 1000):
+        '''
+        Poll until a $PSTM reply starting with one of prefixes arrives
         
         Returns:
-            dict containing all GPRMC info
+            the reply line, or None on timeout
         '''
-        #flush potentially stale data
-        if self.uart.any() > 0:
-            self.uart.flush()
+        t_start = time.ticks_ms()
         
-        while True:
-            #await data over UART
-            while self.uart.any() == 0:
-                pass
+        while time.ticks_diff(time.ticks_ms(), t_start) < timeout_ms:
+            count = self.reply_count
+            self.poll()
+            if self.reply_count != count:
+                for prefix in prefixes:
+                    if self.reply.startswith(prefix):
+                        return self.reply
+                    
+        return None
+    
+    def set_parameter(self, param_id: int, value: str, mode: int = 0):
+        '''
+        Write one parameter of the current configuration block ($PSTMSETPAR)
+        mode 0 overwrites the value, 1 ORs and 2 ANDs it with the current one
         
-            try:
-                uart_str = self.uart.readline().decode("utf-8")
-            except UnicodeError:
-                uart_str = "000000"
-                
-            if uart_str[0:6] == '$GPRMC':
-                break
-            
-        GPRMC_list = uart_str.split(',')
-        GPRMC_dict = {}
+        Returns:
+            True if the module acknowledged it
+        '''
+        self.send_command("PSTMSETPAR,{},{},{}".format(1000 + param_id, value, mode))
+        reply = self.await_reply((b"$PSTMSETPAROK", b"$PSTMSETPARERROR"))
+        
+        return reply is not None and reply.startswith(b"$PSTMSETPAROK")
+    
+    def get_parameter(self, param_id: int):
+        '''
+        Read one parameter of the current configuration block ($PSTMGETPAR)
+        
+        Returns:
+            the value field as a str, or None if the module did not answer
+        '''
+        self.send_command("PSTMGETPAR,{}".format(1000 + param_id))
+        reply = self.await_reply((b"$PSTMSETPAR,", b"$PSTMGETPARERROR"))
         
-        data_valid = 1
+        if reply is None or not reply.startswith(b"$PSTMSETPAR,"):
+            return None
+        
+        return reply.split(b"*")[0].split(b",")[2].decode()
+    
+    def message_list_is(self, mask: int):
+        '''
+        True if the module reports mask as its NMEA message list
+        '''
+        value = self.get_parameter(201)
         
         try:
-            lat_arcmin = float(GPRMC_list[3])
-            lon_arcmin = float(GPRMC_list[5])
+            return value is not None and int(value, 16) == mask
+        except ValueError:
+            return False
+    
+    def set_baudrate(self, baudrate: int):
+        '''
+        Reopen our end of the UART at baudrate and drop any half-assembled line
+        '''
+        self.uart.init(baudrate=baudrate)
+        self.baudrate = baudrate
+        self.line_len = 0
+        
+    def listen(self, timeout_ms: int):
+        '''
+        True if at least two lines with good checksums arrive at the current baud rate within timeout_ms
+        '''
+        t_start = time.ticks_ms()
+        count = self.line_count
+        
+        while time.ticks_diff(time.ticks_ms(), t_start) < timeout_ms:
+            self.poll()
+            if self.line_count - count >= 2: #the first one can be a lucky partial line
+                return True
             
-            lat_remainder = (lat_arcmin % 100) / 60
-            lon_remainder = (lon_arcmin % 100) / 60
+        return False
+    
+    def detect_baudrate(self, candidates, timeout_ms: int = 1500):
+        '''
+        Find which of candidates the module is talking at and leave the UART there
+        
+        Returns:
+            the baud rate, or None if nothing checksummed cleanly at any of them
+        '''
+        for baudrate in candidates:
+            self.set_baudrate(baudrate)
+            if self.listen(timeout_ms):
+                return baudrate
             
-            lat_deg = float(int(lat_arcmin / 100)) + lat_remainder
-            lon_deg = float(int(lon_arcmin / 100)) + lon_remainder
+        return None
+    
+    def restore_defaults(self):
+        '''
+        Put the module back to its factory configuration (9600 baud, default sentences) and follow it
+        '''
+        self.send_command("PSTMRESTOREPAR")
+        self.await_reply((b"$PSTMRESTOREPAROK", b"$PSTMRESTOREPARERROR"))
+        self.send_command("PSTMSRR")
+        time.sleep_ms(self.RESET_MS)
+        self.set_baudrate(9600)
+    
+    def configure(self, sentences=("GGA", "RMC"), baudrate: int = 9600, fix_rate_hz: float = 1.0):
+        '''
+        Trim the NMEA output to sentences, set the fix rate and baud rate, save them and verify
+        
+        The module keeps saved settings across power cycles, so it is first looked for at the
+        requested baud rate and then at the default. Anything it does not acknowledge, or a result
+        that does not verify, falls back to the factory defaults at 9600 baud.
+        
+        Returns:
+            True if the module is running the requested configuration
+        '''
+        if baudrate not in LIV3_BAUD_CODES:
+            raise ValueError("Unsupported GPS baud rate {}".format(baudrate))
+        
+        mask = 0
+        for sentence in sentences:
+            mask |= LIV3_NMEA_MASK_BITS[sentence]
+        mask_str = "0x{:08X}".format(mask)
+        
+        if self.detect_baudrate((baudrate, 9600)) is None:
+            print("GPS not heard at {} or 9600 baud, leaving it unconfigured".format(baudrate))
+            self.set_baudrate(9600)
+            return False
+        
+        #already configured on a previous boot?
+        if self.baudrate == baudrate and self.message_list_is(mask):
+            print("GPS already configured")
+            return True
+        
+        acked = (self.set_parameter(201, mask_str) and
+                 self.set_parameter(303, "{:.1f}".format(fix_rate_hz)) and
+                 self.set_parameter(102, "0x{:X}".format(LIV3_BAUD_CODES[baudrate])))
+        
+        if acked:
+            self.send_command("PSTMSAVEPAR")
+            reply = self.await_reply((b"$PSTMSAVEPAROK", b"$PSTMSAVEPARERROR"))
+            acked = reply is not None and reply.startswith(b"$PSTMSAVEPAROK")
             
-            if GPRMC_list[4] == 'S':
-                lat_deg *= -1
-            if GPRMC_list[6] == 'W':
-                lon_deg *= -1
-        except (ValueError, IndexError):
-            lat_deg = 0
-            lon_deg = 0
-            data_valid = 0
+        if not acked:
+            print("GPS did not acknowledge configuration, restoring defaults")
+            self.restore_defaults()
+            return False
         
-        try:
-            mag_var = float(GPRMC_list[10])
+        #baud rate and message list only take effect after a reset
+        self.send_command("PSTMSRR")
+        time.sleep_ms(self.RESET_MS)
+        self.set_baudrate(baudrate)
+        
+        if self.listen(2000) and self.message_list_is(mask):
+            print("GPS configured: {} at {} baud, {} Hz".format(",".join(sentences), baudrate, fix_rate_hz))
+            return True
+        
+        print("GPS configuration did not verify, restoring defaults")
+        if self.detect_baudrate((baudrate, 9600)) is not None:
+            self.restore_defaults()
+        else:
+            self.set_baudrate(9600)
+        return False
+    
+    def standby(self, seconds: int):
+        '''
+        Put the module into standby ($PSTMFORCESTANDBY) for up to seconds, or until wake_up().
+        Standby keeps the RTC and almanac/ephemeris in backup RAM, so the next fix is a hot start.
+        
+        Returns:
+            True if the module acknowledged it
+        '''
+        self.wake.value(0) #wake_up() needs a rising edge
+        self.send_command("PSTMFORCESTANDBY,{:05d}".format(seconds))
+        reply = self.await_reply((b"$PSTMFORCESTANDBYOK",))
+        
+        if reply is None:
+            self.wake.value(1)
+            return False
+        
+        self.awake = False
+        return True
+    
+    def wake_up(self):
+        '''
+        Bring the module out of standby with a rising edge on its WAKE-UP pin
+        '''
+        self.wake.value(1)
+        self.awake = True
+        self.wake_ticks = time.ticks_ms()
+        self.line_len = 0 #whatever was half received before standby is junk
+        
+    def parse_GPGGA(self, line):
+        '''
+        Parse the split GGA sentence in line into self.gga
+        '''
+        gga = self.gga
+        s = self.field_starts
+        
+        if not self.fields_present(GGA_REQUIRED):
+            for i in range(GGA_LENGTH):
+                gga[i] = 0
+            return
+        
+        gga[GGA_T_UTC] = nmea_fixed(line, s[1], s[2] - 1, 2)
+        gga[GGA_LAT_E6] = nmea_latlon_e6(line, s[2], s[3] - 1, line[s[3]])
+        gga[GGA_LON_E6] = nmea_latlon_e6(line, s[4], s[5] - 1, line[s[5]])
+        gga[GGA_QUALITY] = nmea_int(line, s[6], s[7] - 1)
+        gga[GGA_SATELLITES] = nmea_int(line, s[7], s[8] - 1)
+        gga[GGA_HDOP_E2] = nmea_fixed(line, s[8], s[9] - 1, 2)
+        gga[GGA_ALT_DM] = nmea_fixed(line, s[9], s[10] - 1, 1)
+        gga[GGA_UND_DM] = nmea_fixed(line, s[11], s[12] - 1, 1)
+        gga[GGA_VALID] = 1
+        
+    def parse_GPRMC(self, line):
+        '''
+        Parse the split RMC sentence in line into self.rmc
+        '''
+        rmc = self.rmc
+        s = self.field_starts
+        valid = 1
+        
+        if self.fields_present(RMC_POSITION_REQUIRED):
+            rmc[RMC_LAT_E6] = nmea_latlon_e6(line, s[3], s[4] - 1, line[s[4]])
+            rmc[RMC_LON_E6] = nmea_latlon_e6(line, s[5], s[6] - 1, line[s[6]])
+        else:
+            rmc[RMC_LAT_E6] = 0
+            rmc[RMC_LON_E6] = 0
+            valid = 0
             
-            if GPRMC_list[11] == 'E':
-                mag_var *= -1
-        except (ValueError, IndexError):
-            mag_var = 0
+        if self.fields_present((10,)):
+            rmc[RMC_MAGVAR_E2] = nmea_fixed(line, s[10], s[11] - 1, 2)
+            if self.field_count > 11 and line[s[11]] == 0x45: #'E'
+                rmc[RMC_MAGVAR_E2] = -rmc[RMC_MAGVAR_E2]
+        else:
+            rmc[RMC_MAGVAR_E2] = 0
+        
+        if self.fields_present(RMC_REQUIRED):
+            rmc[RMC_T_UTC] = nmea_fixed(line, s[1], s[2] - 1, 2)
+            rmc[RMC_STATUS] = line[s[2]]
+            rmc[RMC_SPEED_E2] = nmea_fixed(line, s[7], s[8] - 1, 2)
+            rmc[RMC_TRACK_E2] = nmea_fixed(line, s[8], s[9] - 1, 2)
+            rmc[RMC_DATE] = nmea_int(line, s[9], s[10] - 1)
+        else:
+            rmc[RMC_T_UTC] = 0
+            rmc[RMC_STATUS] = 0
+            rmc[RMC_SPEED_E2] = 0
+            rmc[RMC_TRACK_E2] = 0
+            rmc[RMC_DATE] = 0
+            valid = 0
             
-        try:
-            t_utc_gprmc = float(GPRMC_list[1])
-            pos_status_gprmc = GPRMC_list[2]
-            speed_gprmc = float(GPRMC_list[7])
-            track_gprmc = float(GPRMC_list[8])
-            date_gprmc = int(GPRMC_list[9])
-        except (ValueError, IndexError):
-            t_utc_gprmc = 0
-            pos_status_gprmc = 'N/A'
-            speed_gprmc = 0
-            track_gprmc = 0
-            date_gprmc = 0
-            
-            data_valid = 0
-        
-        GPRMC_dict['t_utc'] = t_utc_gprmc
-        GPRMC_dict['pos_status'] = pos_status_gprmc
-        GPRMC_dict['lat_deg'] = lat_deg
-        GPRMC_dict['lon_deg'] = lon_deg
-        GPRMC_dict['groundspeed_kn'] = speed_gprmc
-        GPRMC_dict['track_deg'] = track_gprmc
-        GPRMC_dict['date_utc'] = date_gprmc
-        GPRMC_dict['mag_var_deg'] = mag_var
-        GPRMC_dict['data_valid'] = data_valid
-
-        return GPRMC_dict
+        rmc[RMC_VALID] = valid
+        
+    def parse_GPGSA(self, line):
+        '''
+        Parse the split GSA sentence in line into self.gsa
+        '''
+        gsa = self.gsa
+        s = self.field_starts
+        
+        if not self.fields_present(GSA_REQUIRED):
+            for i in range(GSA_LENGTH):
+                gsa[i] = 0
+            gsa[GSA_FIX_MODE] = 1
+            return
+        
+        used = 0
+        for k in range(3, 15):
+            if s[k + 1] - 1 != s[k]:
+                used += 1
+        
+        gsa[GSA_FIX_MODE] = nmea_int(line, s[2], s[3] - 1)
+        gsa[GSA_SATELLITES_USED] = used
+        gsa[GSA_PDOP_E2] = nmea_fixed(line, s[15], s[16] - 1, 2)
+        gsa[GSA_HDOP_E2] = nmea_fixed(line, s[16], s[17] - 1, 2)
+        gsa[GSA_VDOP_E2] = nmea_fixed(line, s[17], s[18] - 1, 2)
+        gsa[GSA_VALID] = 1
+    
+    def latest(self, sentence: str):
+        '''
+        Most recent result for a sentence type ("GGA", "RMC" or "GSA") as a dict, or None if none has arrived
+        Read self.gga/self.rmc/self.gsa directly to avoid building the dict
+        '''
+        if self.fix_count[sentence] == 0:
+            return None
+        
+        if sentence == "GGA":
+            gga = self.gga
+            return {"t_utc": gga[GGA_T_UTC] / 100,
+                    "lat_deg": gga[GGA_LAT_E6] / 1000000,
+                    "lon_deg": gga[GGA_LON_E6] / 1000000,
+                    "alt_m": gga[GGA_ALT_DM] / 10,
+                    "und_m": gga[GGA_UND_DM] / 10,
+                    "satellites": gga[GGA_SATELLITES],
+                    "data_valid": gga[GGA_VALID]}
+        elif sentence == "RMC":
+            rmc = self.rmc
+            return {"t_utc": rmc[RMC_T_UTC] / 100,
+                    "pos_status": chr(rmc[RMC_STATUS]) if rmc[RMC_STATUS] else 'N/A',
+                    "lat_deg": rmc[RMC_LAT_E6] / 1000000,
+                    "lon_deg": rmc[RMC_LON_E6] / 1000000,
+                    "groundspeed_kn": rmc[RMC_SPEED_E2] / 100,
+                    "track_deg": rmc[RMC_TRACK_E2] / 100,
+                    "date_utc": rmc[RMC_DATE],
+                    "mag_var_deg": rmc[RMC_MAGVAR_E2] / 100,
+                    "data_valid": rmc[RMC_VALID]}
+        else:
+            gsa = self.gsa
+            return {"fix_mode": gsa[GSA_FIX_MODE],
+                    "satellites_used": gsa[GSA_SATELLITES_USED],
+                    "pdop": gsa[GSA_PDOP_E2] / 100,
+                    "hdop": gsa[GSA_HDOP_E2] / 100,
+                    "vdop": gsa[GSA_VDOP_E2] / 100,
+                    "data_valid": gsa[GSA_VALID]}
+    
+    def fix_age_ms(self, sentence: str):
+        '''
+        Milliseconds since the latest sentence of this type arrived, -1 if none has
+        '''
+        if self.fix_count[sentence] == 0:
+            return -1
+        
+        return time.ticks_diff(time.ticks_ms(), self.fix_ticks[sentence])
+    
+    def await_sentence(self, sentence: str):
+        '''
+        Block until a sentence of this type arrives that was not already buffered
+        '''
+        self.poll() #anything already buffered is stale
+        count = self.fix_count[sentence]
+        
+        while self.fix_count[sentence] == count:
+            self.poll()
+            
+        return self.latest(sentence)
+        
+    def epoch_matched(self):
+        '''
+        True if the cached GGA and RMC both carry the same UTC time and both arrived within the last epoch
+        '''
+        if self.gga_epoch < 0 or self.gga_epoch != self.rmc_epoch:
+            return False
+        
+        return (0 <= self.fix_age_ms("GGA") <= self.EPOCH_MAX_AGE_MS and
+                0 <= self.fix_age_ms("RMC") <= self.EPOCH_MAX_AGE_MS)
+    
+    def await_epoch(self, timeout_ms: int = 2000, idle=None):
+        '''
+        Poll until self.gga and self.rmc hold the same UTC epoch, without building any result
+        
+        Returns immediately if the cached pair already matches, otherwise polls until the
+        missing half of the epoch arrives. idle, if given, is called between polls so other
+        sensors can be serviced while waiting.
+        
+        Returns:
+            1 if the pair matches, 0 on timeout (position and velocity may be a second apart)
+        '''
+        t_start = time.ticks_ms()
+        self.poll()
+        
+        while not self.epoch_matched():
+            if time.ticks_diff(time.ticks_ms(), t_start) >= timeout_ms:
+                break
+            if idle is not None:
+                idle()
+            self.poll()
+            
+        return int(self.epoch_matched())
+    
+    def fix_snapshot(self, timeout_ms: int = 2000, idle=None):
+        '''
+        One coherent fix merged from the GGA and RMC sentences of the same UTC epoch
+        (see await_epoch()). On timeout the latest of each is merged anyway and 'matched' is 0.
+        
+        Returns:
+            dict with GGA position/altitude/satellites, RMC date/speed/track and 'matched'
+        '''
+        matched = self.await_epoch(timeout_ms, idle)
+        gga = self.gga
+        rmc = self.rmc
+        
+        return {"t_utc": gga[GGA_T_UTC] / 100,
+                "date_utc": rmc[RMC_DATE],
+                "lat_deg": gga[GGA_LAT_E6] / 1000000,
+                "lon_deg": gga[GGA_LON_E6] / 1000000,
+                "alt_m": gga[GGA_ALT_DM] / 10,
+                "und_m": gga[GGA_UND_DM] / 10,
+                "satellites": gga[GGA_SATELLITES],
+                "pos_status": chr(rmc[RMC_STATUS]) if rmc[RMC_STATUS] else 'N/A',
+                "groundspeed_kn": rmc[RMC_SPEED_E2] / 100,
+                "track_deg": rmc[RMC_TRACK_E2] / 100,
+                "data_valid": gga[GGA_VALID] & rmc[RMC_VALID],
+                "matched": matched}
+        
+    def get_GPGGA_data(self):
+        '''
+        Block and await GPGGA string over UART from GPS module
+        
+        Returns:
+            dict containing all GPGGA info
+        '''
+        return self.await_sentence("GGA")
+        
+    def get_GPRMC_data(self):
+        '''
+        Block and await GPRMC string over UART from GPS module
+        
+        Returns:
+            dict containing all GPRMC info
+        '''
+        return self.await_sentence("RMC")
         
 class TEL0132(UART_Device):
     def __init__(self, uart: machine.UART):
@@ -1,11 +1,3 @@
-import machine
-import sys
-import time
-import random
-
-import i2c_device
-import uart_device
-
 def parity(val: int, bit_len: int = 32):
     '''
     Calculate the parity of a given integer
@@ -43,7 +35,13 @@ def wspr_int(char):
     else:
         return c - 65 + 10
 
-def generate_wspr_message(callsign: str, grid: str, power: int):
+def pack_wspr_message(callsign: str, grid: str, power: int):
+    '''
+    Squash a callsign, 4 char grid square and power level into the 50 bit WSPR source message
+    
+    Returns:
+        the message left-justified in a 56 bit int (7 bytes, MSB first)
+    '''
     #28 bits callsign
     #15 bits locator
     #7 bits power level
@@ -80,7 +78,14 @@ def generate_wspr_message(callsign: str, grid: str, power: int):
     pwr_int = grid_int * 128 + power + 64
     
     #combine into 50 bit int
-    comb_int = ((call_int << 22) | (pwr_int & 0x3FFFFF)) << 6
+    return ((call_int << 22) | (pwr_int & 0x3FFFFF)) << 6
+
+def generate_wspr_message(callsign: str, grid: str, power: int):
+    '''
+    Reference bit-by-bit WSPR encoder, returns a list of 162 symbols (0 - 3)
+    See generate_wspr_symbols() for the table-driven version used in flight
+    '''
+    comb_int = pack_wspr_message(callsign, grid, power)
     
     #pack comb_int into c_array
     c_array = [0] * 11
@@ -137,6 +142,171 @@ def generate_wspr_message(callsign: str, grid: str, power: int):
         
     return output
 
+#WSPR sync vector (162 bits)
+WSPR_SYNC = bytes((1,1,0,0,0,0,0,0,1,0,0,0,1,1,1,0,0,0,1,0,0,1,0,1,1,1,1,0,0,0,0,0,0,0,1,0,0,1,0,1,0,0,
+                   0,0,0,0,1,0,1,1,0,0,1,1,0,1,0,0,0,1,1,0,1,0,0,0,0,1,1,0,1,0,1,0,1,0,1,0,0,1,0,0,1,0,
+                   1,1,0,0,0,1,1,0,1,0,1,0,0,0,1,0,0,0,0,0,1,0,0,1,0,0,1,1,1,0,1,1,0,0,1,1,0,1,0,0,0,1,
+                   1,1,0,0,0,0,0,1,0,1,0,0,1,1,0,0,0,0,0,0,0,1,1,0,1,0,1,1,0,0,0,1,1,0,0,0))
+
+#FEC polynomials split into 16 bit halves so the encoder never leaves small int range on MicroPython
+_POLY_0_HI = 0xF2D0
+_POLY_0_LO = 0x5351
+_POLY_1_HI = 0xE461
+_POLY_1_LO = 0x3C47
+
+def _build_parity_table():
+    table = bytearray(256)
+    for i in range(256):
+        table[i] = parity(i, 8)
+    return table
+
+def _build_interleave_table():
+    '''
+    Position in the output frame of each of the 162 FEC bits
+    '''
+    table = bytearray(162)
+    i = 0
+    for j in range(256):
+        r = bit_reverse(j)
+        
+        if r < 162:
+            table[i] = r
+            i += 1
+            
+        if i >= 162:
+            break
+    return table
+
+WSPR_PARITY8 = _build_parity_table()
+WSPR_INTERLEAVE = _build_interleave_table()
+
+_source_bytes = bytearray(11) #7 message bytes + 31 bit zero tail for the encoder to flush into
+
+def generate_wspr_symbols(callsign: str, grid: str, power: int, symbols=None):
+    '''
+    Table-driven WSPR encoder, produces the same symbols as generate_wspr_message()
+    
+    Args:
+        callsign, grid, power: message contents, see generate_wspr_message()
+        symbols [optional]: preallocated bytearray of length 162 to write the frame into
+    
+    Returns:
+        bytearray of 162 symbols (0 - 3)
+    '''
+    if symbols is None:
+        symbols = bytearray(162)
+    
+    comb_int = pack_wspr_message(callsign, grid, power)
+    
+    src = _source_bytes
+    for i in range(7):
+        src[i] = (comb_int >> 8 * (6 - i)) & 0xFF
+    
+    par = WSPR_PARITY8
+    interleave = WSPR_INTERLEAVE
+    sync = WSPR_SYNC
+    
+    #32 bit shift register held as two 16 bit halves
+    reg_hi = 0
+    reg_lo = 0
+    n = 0
+    
+    for i in range(81):
+        int_bit = (src[i >> 3] >> (7 - (i & 7))) & 0x01
+        
+        reg_hi = ((reg_hi << 1) | (reg_lo >> 15)) & 0xFFFF
+        reg_lo = ((reg_lo << 1) | int_bit) & 0xFFFF
+        
+        #fold each masked register down to a byte and look up its parity
+        x = (reg_hi & _POLY_0_HI) ^ (reg_lo & _POLY_0_LO)
+        r = interleave[n]
+        symbols[r] = sync[r] + 2 * par[(x ^ (x >> 8)) & 0xFF]
+        
+        x = (reg_hi & _POLY_1_HI) ^ (reg_lo & _POLY_1_LO)
+        r = interleave[n + 1]
+        symbols[r] = sync[r] + 2 * par[(x ^ (x >> 8)) & 0xFF]
+        
+        n += 2
+        
+    return symbols
+
+class FrameCache:
+    '''
+    Fixed capacity LRU cache of encoded WSPR frames, keyed by (callsign, grid, power)
+    
+    All frame buffers are allocated up front so a hit is a single 162 byte copy
+    with no FEC/interleave work and no new heap objects
+    '''
+    def __init__(self, capacity: int = 8):
+        assert capacity >= 1
+        
+        self.capacity = capacity
+        self.callsigns = [None] * capacity
+        self.grids = [None] * capacity
+        self.powers = [0] * capacity
+        self.frames = [bytearray(162) for i in range(capacity)]
+        self.last_used = [0] * capacity #use stamp of each slot, 0 = empty
+        
+        self.use_count = 0
+        self.hits = 0
+        self.misses = 0
+        
+    def get(self, callsign: str, grid: str, power: int, symbols=None):
+        '''
+        Return the encoded frame for a message, encoding it only if it is not cached
+        
+        Args:
+            callsign, grid, power: message contents, see generate_wspr_message()
+            symbols [optional]: bytearray of length 162 to copy the frame into
+        
+        Returns:
+            the symbol buffer, or the cached frame itself if no buffer was given (do not modify it)
+        '''
+        self.use_count += 1
+        
+        lru_slot = 0
+        for i in range(self.capacity):
+            if self.callsigns[i] == callsign and self.grids[i] == grid and self.powers[i] == power:
+                self.hits += 1
+                self.last_used[i] = self.use_count
+                frame = self.frames[i]
+                break
+            
+            if self.last_used[i] < self.last_used[lru_slot]:
+                lru_slot = i
+        else:
+            self.misses += 1
+            self.callsigns[lru_slot] = None #invalidate first in case encoding fails
+            frame = generate_wspr_symbols(callsign, grid, power, self.frames[lru_slot])
+            self.callsigns[lru_slot] = callsign
+            self.grids[lru_slot] = grid
+            self.powers[lru_slot] = power
+            self.last_used[lru_slot] = self.use_count
+        
+        if symbols is None:
+            return frame
+        
+        symbols[:] = frame
+        return symbols
+    
+    def clear(self):
+        '''
+        Drop all cached frames and reset the hit/miss counters
+        '''
+        for i in range(self.capacity):
+            self.callsigns[i] = None
+            self.grids[i] = None
+            self.last_used[i] = 0
+        
+        self.use_count = 0
+        self.hits = 0
+        self.misses = 0
+        
+    def stats(self):
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "capacity": self.capacity}
+
 def LL2GS(lat, lon):
     '''
     Given a latitude and longitude, return a six-digit maidenhead grid square
@@ -0,0 +1,203 @@
+'''
+Compare the old split()-based NMEA parsers with the in-place LIV3 parser on a recorded log
+
+Reports time and heap allocation per sentence, and how many corrupted lines each parser let through.
+Runs on the host (CPython) or on the balloon itself:
+    python tools/bench_nmea.py [log]
+    mpremote run tools/bench_nmea.py     (with src/ and tools/nmea_sample.log uploaded)
+
+tools/nmea_sample.log is two minutes of GGA/GSA/GSV/RMC/VTG from a LIV3 at 1 Hz
+with a handful of lines damaged the way a marginal 9600 baud link damages them.
+
+On the host allocations are measured with tracemalloc. CPython boxes every int above 256,
+so the in-place parser shows a few bytes there that MicroPython's small ints never allocate;
+on the balloon gc.mem_alloc() gives the real figure.
+'''
+import sys
+
+ON_DEVICE = sys.implementation.name == "micropython"
+
+if ON_DEVICE:
+    import gc
+    from time import ticks_us, ticks_diff
+
+    LOG_FILE = "nmea_sample.log"
+else:
+    import os.path
+    import tracemalloc
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.join(here, "..", "src"))
+    LOG_FILE = os.path.join(here, "nmea_sample.log")
+
+    import fake_machine
+    fake_machine.install()
+
+    from time import ticks_us, ticks_diff
+
+import machine
+import uart_device
+
+def legacy_parse_GPGGA(uart_str):
+    '''
+    The GGA parser as it was before LIV3 parsed in place
+    '''
+    GPGGA_list = uart_str.split(',')
+    GPGGA_dict = {}
+
+    try:
+        lat_arcmin = float(GPGGA_list[2])
+        lon_arcmin = float(GPGGA_list[4])
+
+        lat_deg = float(int(lat_arcmin / 100)) + (lat_arcmin % 100) / 60
+        lon_deg = float(int(lon_arcmin / 100)) + (lon_arcmin % 100) / 60
+
+        if GPGGA_list[3] == 'S':
+            lat_deg *= -1
+        if GPGGA_list[5] == 'W':
+            lon_deg *= -1
+
+        GPGGA_dict['t_utc'] = float(GPGGA_list[1])
+        GPGGA_dict['lat_deg'] = lat_deg
+        GPGGA_dict['lon_deg'] = lon_deg
+        GPGGA_dict['alt_m'] = float(GPGGA_list[9])
+        GPGGA_dict['und_m'] = float(GPGGA_list[11])
+        GPGGA_dict['satellites'] = int(GPGGA_list[7])
+        GPGGA_dict['data_valid'] = 1
+    except (ValueError,  IndexError):
+        GPGGA_dict['data_valid'] = 0
+
+    return GPGGA_dict
+
+def legacy_parse_GPRMC(uart_str):
+    '''
+    The RMC parser as it was before LIV3 parsed in place (position and time groups)
+    '''
+    GPRMC_list = uart_str.split(',')
+    GPRMC_dict = {'data_valid': 1}
+
+    try:
+        lat_arcmin = float(GPRMC_list[3])
+        lon_arcmin = float(GPRMC_list[5])
+
+        lat_deg = float(int(lat_arcmin / 100)) + (lat_arcmin % 100) / 60
+        lon_deg = float(int(lon_arcmin / 100)) + (lon_arcmin % 100) / 60
+
+        if GPRMC_list[4] == 'S':
+            lat_deg *= -1
+        if GPRMC_list[6] == 'W':
+            lon_deg *= -1
+
+        GPRMC_dict['lat_deg'] = lat_deg
+        GPRMC_dict['lon_deg'] = lon_deg
+    except (ValueError, IndexError):
+        GPRMC_dict['data_valid'] = 0
+
+    try:
+        GPRMC_dict['t_utc'] = float(GPRMC_list[1])
+        GPRMC_dict['groundspeed_kn'] = float(GPRMC_list[7])
+        GPRMC_dict['track_deg'] = float(GPRMC_list[8])
+        GPRMC_dict['date_utc'] = int(GPRMC_list[9])
+    except (ValueError, IndexError):
+        GPRMC_dict['data_valid'] = 0
+
+    return GPRMC_dict
+
+def legacy_parse_line(line, length):
+    uart_str = bytes(line[:length]).decode()
+
+    if uart_str[3:6] == "GGA":
+        return legacy_parse_GPGGA(uart_str)['data_valid']
+    elif uart_str[3:6] == "RMC":
+        return legacy_parse_GPRMC(uart_str)['data_valid']
+    return 0
+
+def load_lines(path):
+    with open(path, "rb") as f:
+        return [bytearray(line) for line in f if line.startswith(b"$")]
+
+def allocation_start():
+    if ON_DEVICE:
+        return gc.mem_alloc()
+    tracemalloc.reset_peak()
+    return tracemalloc.get_traced_memory()[0]
+
+def allocation_end(start):
+    if ON_DEVICE:
+        return gc.mem_alloc() - start
+    return tracemalloc.get_traced_memory()[1] - start #peak, what the sentence needed while parsing
+
+def measure(name, parse, lines):
+    '''
+    Parse every line once into the same preallocated buffer and report per-sentence cost
+    '''
+    buffer = bytearray(128)
+    allocated = 0
+    elapsed = 0
+
+    if ON_DEVICE:
+        gc.collect()
+        gc.disable()
+    else:
+        tracemalloc.start()
+
+    for line in lines:
+        length = len(line)
+        buffer[:length] = line
+        
+        heap_start = allocation_start()
+        t_start = ticks_us()
+        parse(buffer, length)
+        elapsed += ticks_diff(ticks_us(), t_start)
+        allocated += allocation_end(heap_start)
+
+    if ON_DEVICE:
+        gc.enable()
+    else:
+        tracemalloc.stop()
+
+    print("{:<10} {:>8.1f} us/line {:>8.1f} bytes/line".format(name, elapsed / len(lines), allocated / len(lines)))
+
+def corrupted_lines(lines):
+    '''
+    Lines whose *hh checksum does not match their contents
+    '''
+    corrupted = []
+    for line in lines:
+        end = line.find(b"*")
+        checksum = 0
+        for c in line[1:end]:
+            checksum ^= c
+        if end < 0 or line[end + 1:end + 3].upper() != ("%02X" % checksum).encode():
+            corrupted.append(line)
+    return corrupted
+
+def main():
+    path = LOG_FILE
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+
+    lines = load_lines(path)
+    print("{} lines from {}".format(len(lines), path))
+
+    gps = uart_device.LIV3(machine.UART(1), machine.Pin(0), machine.Pin(1), machine.Pin(2))
+
+    measure("legacy", legacy_parse_line, lines)
+    measure("in-place", gps.parse_line, lines)
+
+    corrupted = corrupted_lines(lines)
+    buffer = bytearray(128)
+    legacy_passed = 0
+    for line in corrupted:
+        buffer[:len(line)] = line
+        if legacy_parse_line(buffer, len(line)):
+            legacy_passed += 1
+
+    print("{} corrupted lines: legacy reported {} as valid fixes, in-place rejected {}".format(
+        len(corrupted), legacy_passed, gps.checksum_errors))
+    print("GGA {}, RMC {}, GSA {} sentences kept".format(
+        gps.fix_count["GGA"], gps.fix_count["RMC"], gps.fix_count["GSA"]))
+    print("last GGA: {}".format(gps.latest("GGA")))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+'''
+Measure the I2C bus time spent per WSPR tone by the Si5351 driver
+
+On the host the bus is modeled at 100 kHz from the bytes each transaction moves.
+On the balloon (mpremote run tools/bench_si5351.py) the real bus is timed with ticks_us.
+'''
+import sys
+
+ON_DEVICE = sys.implementation.name == "micropython"
+
+if not ON_DEVICE:
+    import os.path
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+    
+    import fake_machine
+    fake_machine.install()
+
+import time
+import machine
+import i2c_device
+
+TONES = 162
+SPACING = 1.465 #Hz
+
+def make_clockgen():
+    if ON_DEVICE:
+        i2c = machine.I2C(id=0, scl=machine.Pin(21), sda=machine.Pin(20), freq=100000, timeout=10000)
+    else:
+        i2c = machine.I2C(id=0, freq=100000)
+        i2c.add_device(0x60)
+        
+    return i2c_device.SI5351(i2c)
+
+def single_register_tone(clockgen, channel, band, offset, correction):
+    '''
+    The pre-burst write pattern: same register contents, one transaction per register
+    '''
+    original = clockgen.i2c_write_block
+    
+    def write_each(register, data):
+        for i in range(len(data)):
+            clockgen.i2c_write(register + i, data[i])
+    
+    clockgen.i2c_write_block = write_each
+    try:
+        clockgen.transmit_wspr_tone(channel, band, offset, correction=correction)
+    finally:
+        clockgen.i2c_write_block = original
+
+def burst_tone(clockgen, channel, band, offset, correction):
+    clockgen.transmit_wspr_tone(channel, band, offset, correction=correction)
+
+_images = {}
+
+def precomputed_tone(clockgen, channel, band, offset, correction):
+    '''
+    Balloon.transmit_next_tone path: 4 PLL images built up front, only changed bytes written
+    '''
+    if offset not in _images:
+        _images[offset] = clockgen.wspr_tone_image(band, offset, correction)
+    
+    clockgen.write_pll_image(0, _images[offset])
+
+def run(clockgen, tone_writer, use_shadow):
+    if use_shadow:
+        clockgen.resync()
+    else:
+        clockgen.shadow_valid = False #every write goes out in full
+    
+    if not ON_DEVICE:
+        clockgen.i2c.reset_stats()
+    
+    t_start = time.ticks_us()
+    for i in range(TONES):
+        tone_writer(clockgen, 0, "20m", 140 + (i % 4) * SPACING, -455)
+    t_total = time.ticks_diff(time.ticks_us(), t_start)
+    
+    if ON_DEVICE:
+        return (None, t_total / TONES)
+    return (clockgen.i2c.transactions / TONES, clockgen.i2c.bus_time_us() / TONES)
+
+def main():
+    clockgen = make_clockgen()
+    
+    for name, tone_writer, use_shadow in (("single-register", single_register_tone, False),
+                                          ("burst", burst_tone, False),
+                                          ("burst + shadow", burst_tone, True),
+                                          ("precomputed", precomputed_tone, True)):
+        transactions, t_tone = run(clockgen, tone_writer, use_shadow)
+        
+        if transactions is None:
+            print("{:<16} {:>8.0f} us/tone (measured)".format(name, t_tone))
+        else:
+            print("{:<16} {:>4.0f} transactions/tone {:>8.0f} us/tone (modeled bus time)".format(name, transactions, t_tone))
+    
+    if not ON_DEVICE:
+        clockgen.i2c.reset_stats()
+        clockgen.register_dump(0, 8)
+        print("register_dump: {} transaction(s)".format(clockgen.i2c.transactions))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+'''
+Compare the reference and table-driven WSPR encoders, and the frame cache
+
+Runs on the host (CPython) or on the balloon itself:
+    python tools/bench_wspr.py
+    mpremote run tools/bench_wspr.py     (with src/ already uploaded to the board)
+'''
+import sys
+
+try:
+    import os.path
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+except ImportError:
+    pass #on the balloon the firmware modules already live in /
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:
+    from time import perf_counter_ns
+    
+    def ticks_us():
+        return perf_counter_ns() // 1000
+    
+    def ticks_diff(a, b):
+        return a - b
+
+import wspr
+
+#messages the state machine actually sends: plain WSPR, U4B telem and W6NXP telem
+MESSAGES = [("W6NXP", "DM04", 10),
+            ("W6NXP", "DM13", 37),
+            ("Q1ARJ", "JN36", 17),
+            ("Q6NAA", "JJ00", 0),
+            ("Q6NTK", "AB00", 53),
+            ("Q6NGX", "RE25", 17),
+            ("K1ABC", "FN42", 60)]
+
+def time_encoder(encoder, iterations):
+    t_start = ticks_us()
+    for i in range(iterations):
+        for callsign, grid, power in MESSAGES:
+            encoder(callsign, grid, power)
+    
+    return ticks_diff(ticks_us(), t_start) / (iterations * len(MESSAGES))
+
+def main():
+    for callsign, grid, power in MESSAGES:
+        reference = wspr.generate_wspr_message(callsign, grid, power)
+        table = wspr.generate_wspr_symbols(callsign, grid, power)
+        assert list(table) == reference, "symbol mismatch for {} {} {}".format(callsign, grid, power)
+    print("Symbols identical for {} messages".format(len(MESSAGES)))
+    
+    if sys.implementation.name == "micropython":
+        iterations = 3
+    else:
+        iterations = 200
+    
+    frame = bytearray(162)
+    t_reference = time_encoder(wspr.generate_wspr_message, iterations)
+    t_table = time_encoder(lambda c, g, p: wspr.generate_wspr_symbols(c, g, p, frame), iterations)
+    
+    print("{:<14} {:>10.1f} us/message".format("reference", t_reference))
+    print("{:<14} {:>10.1f} us/message".format("table-driven", t_table))
+    print("speedup: {:.1f}x".format(t_reference / t_table))
+    
+    cache = wspr.FrameCache(len(MESSAGES))
+    t_cached = time_encoder(lambda c, g, p: cache.get(c, g, p, frame), iterations)
+    print("{:<14} {:>10.1f} us/message ({} hits, {} misses)".format("cached", t_cached, cache.hits, cache.misses))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+'''
+Check the flight log segment ring against wrap-around and power loss
+
+Runs the real flight_log.FlightLog on the host in a temporary directory:
+    python tools/check_flight_log.py
+
+- records come back oldest first with their telemetry and frame text after the ring wraps
+- segments are only ever appended to, and the oldest is deleted when the ring wraps
+- records still in the RAM batch are all that a power loss costs
+- a record torn halfway through its write is skipped and logging resumes in a new segment
+- segments with another layout are moved aside instead of written over
+'''
+import sys
+import os
+import os.path
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import fake_machine
+fake_machine.install()
+
+import flight_log
+import telemetry
+
+def record(n: int):
+    values = telemetry.Telemetry()
+    values["alt_m"] = 1000 + n
+    values["satellites"] = n % 12
+    values["temp_c"] = -40.5
+    return values
+
+def append(log, n: int):
+    log.append(170926, 120000 + n, record(n), "W6NXP CM87 {}".format(n % 60))
+
+def seqs(directory: str):
+    return [r["seq"] for r in flight_log.read_log(directory)]
+
+def main():
+    directory = os.path.join(tempfile.mkdtemp(), "flight")
+
+    #keep at least 10 records in segments of 4: 3 full segments plus the one being filled
+    log = flight_log.FlightLog(directory, slots=10, batch_records=3, segment_records=4)
+    assert log.segments == 4
+
+    #watch every write: appends only, never an overwrite in place
+    real_open = open
+    modes = []
+    def tracking_open(path, mode="r", *args):
+        modes.append(mode)
+        return real_open(path, mode, *args)
+    flight_log.open = tracking_open
+    for n in range(25):
+        append(log, n)
+    del flight_log.open
+    assert set(modes) <= {"rb", "ab", "wb"}, modes
+    assert sorted(flight_log.segment_indexes(directory)) == [0, 1, 2, 3]
+
+    #25 appended, seq 25 still in RAM is what a power loss right now costs; segment 2 was
+    #deleted for it, which took seq 9..12 with it
+    records = flight_log.read_log(directory)
+    assert [r["seq"] for r in records] == list(range(13, 25)), [r["seq"] for r in records]
+    last = records[-1]
+    assert last["alt_m"] == 1023 and last["satellites"] == 11 and last["temp_c"] == -40.5, last
+    assert last["frame"] == "W6NXP CM87 23" and last["date_utc"] == 170926, last
+
+    #reboot: seq 24 filled segment 1, so logging goes on in segment 2
+    log = flight_log.FlightLog(directory, slots=10, batch_records=3, segment_records=4)
+    log.open()
+    assert (log.seq, log.segment, log.segment_used) == (25, 2, 0), (log.seq, log.segment, log.segment_used)
+
+    #power lost halfway through appending seq 26: seq 25 survives, the torn record is dropped
+    for n in range(25, 28):
+        append(log, n)
+    path = flight_log.segment_path(directory, 2)
+    with open(path, "rb") as f:
+        data = f.read(flight_log.HEADER_SIZE + flight_log.RECORD_SIZE + flight_log.RECORD_SIZE // 2)
+    with open(path, "wb") as f:
+        f.write(data)
+    assert seqs(directory) == list(range(13, 26)), seqs(directory)
+
+    #nothing is appended after the partial record, the next segment is started instead
+    log = flight_log.FlightLog(directory, slots=10, batch_records=3, segment_records=4)
+    log.open()
+    assert (log.seq, log.segment) == (26, 3), (log.seq, log.segment)
+    append(log, 26)
+    log.flush()
+    assert seqs(directory) == list(range(17, 27)), seqs(directory)
+
+    #resuming in a segment with room left appends to it
+    log = flight_log.FlightLog(directory, slots=10, batch_records=1, segment_records=4)
+    log.open()
+    assert (log.seq, log.segment, log.segment_used) == (27, 3, 1), (log.seq, log.segment, log.segment_used)
+    append(log, 27)
+    assert seqs(directory)[-2:] == [26, 27]
+
+    #another segment size is another layout, the old segments are kept
+    log = flight_log.FlightLog(directory, slots=10, segment_records=5)
+    log.open()
+    assert seqs(directory) == []
+    assert os.path.exists(flight_log.segment_path(directory, 3) + ".old")
+
+    print("{} byte records, all checks passed".format(flight_log.RECORD_SIZE))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+'''
+Round-trip check of the delta-compressed telemetry history
+
+Runs the real history.History on the host in a temporary directory:
+    python tools/check_history.py
+
+A simulated week of flight (one sample every 2 minutes, slow drift, daily temperature and
+voltage swings, night-time gaps) is written, read back with history.read_history() and checked:
+
+- every sample comes back within half a quantization step of what was recorded
+- the hourly summaries match min/max/mean worked out from the decoded samples
+- a block torn by a power loss ends the decode at the last good block, and after a reboot the
+  torn block is cut off so everything appended later still decodes
+- the file rotates to history.bin.old at max_bytes
+Prints the bytes per sample against the fixed 112 byte flight log record.
+'''
+import sys
+import os
+import os.path
+import math
+import random
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import fake_machine
+fake_machine.install()
+
+import history
+import telemetry
+import flight_log
+
+def flight(days: int):
+    '''
+    (date, t_utc, values) every 2 minutes of daylight, starting 17 Sep 2026
+    '''
+    rng = random.Random(2026)
+    lat, lon, alt = 37.4, -122.1, 12000.0
+    day, month, year = 17, 9, 26
+
+    for d in range(days):
+        for minute in range(6 * 60, 20 * 60, 2):
+            sun = math.sin(math.pi * (minute - 6 * 60) / (14 * 60))
+            lat += rng.uniform(-0.003, 0.003)
+            lon += rng.uniform(0.01, 0.03)
+            if lon > 180:
+                lon -= 360
+            alt += rng.uniform(-15, 15)
+            values = {
+                "lat_deg": lat, "lon_deg": lon, "alt_m": alt, "satellites": rng.randint(6, 12),
+                "temp_c": -45 + 30 * sun + rng.uniform(-1, 1), "p_mbar": 190 - alt / 200,
+                "v_in": 4.0 + 1.2 * sun, "v_solar": 3.0 + 3.0 * sun,
+                "l_front": 3 * sun * rng.random(), "l_back": 3 * sun * rng.random(),
+                "groundspeed_kn": rng.uniform(20, 60), "gps_valid": 1,
+            }
+            t_utc = (minute // 60) * 10000 + (minute % 60) * 100 + 12.5
+            yield day * 10000 + month * 100 + year, t_utc, values
+
+        day += 1
+        if day > 30:
+            day, month = 1, month + 1
+
+def main():
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "history.bin")
+
+    days = 7
+    store = history.History(path, max_bytes=10 * 1024 * 1024)
+    record = telemetry.Telemetry()
+    recorded = []
+    for date, t_utc, values in flight(days):
+        for name, value in values.items():
+            record[name] = value
+        store.append(date, t_utc, record)
+        recorded.append((history.minutes_since_2000(date, t_utc), [record[name] for name in history.FIELDS]))
+    store.end_hour()
+
+    with open(path, "rb") as f:
+        data = f.read()
+    samples, summaries = history.read_history(data)
+
+    #every sample back within half a step
+    assert len(samples) == len(recorded), (len(samples), len(recorded))
+    for sample, (minute, values) in zip(samples, recorded):
+        assert sample["minute"] == minute, (sample["minute"], minute)
+        for i, name in enumerate(history.FIELDS):
+            step = 1 / history.SCALES[i]
+            assert abs(sample[name] - values[i]) <= step / 2 + 1e-3, (name, sample[name], values[i])
+
+    #summaries agree with the decoded samples, hour by hour
+    assert len(summaries) == days * 14, len(summaries)
+    for summary in summaries:
+        hour = [s for s in samples if s["minute"] // 60 == summary["hour"]]
+        assert summary["count"] == len(hour)
+        for i, name in enumerate(history.FIELDS):
+            column = [s[name] for s in hour]
+            assert summary[name + "_min"] == min(column) and summary[name + "_max"] == max(column), name
+            assert abs(summary[name + "_mean"] - sum(column) / len(column)) <= 1 / history.SCALES[i], name
+    assert summaries[0]["hour"] == history.minutes_since_2000(170926, 60000) // 60
+
+    #17 Sep 2026 00:00 is 9756 days after 1 Jan 2000
+    assert history.minutes_since_2000(170926, 0) == 9756 * 24 * 60
+
+    #the day after, across month, year and leap day boundaries
+    for date in (170926, 300926, 311226, 280224, 290224, 280223):
+        assert history.minutes_since_2000(history.next_date(date), 0) == history.minutes_since_2000(date, 0) + 24 * 60, date
+
+    #power lost in the middle of the last block
+    torn_samples, torn_summaries = history.read_history(data[:-20])
+    assert len(torn_summaries) == len(summaries) - 1 and len(torn_samples) == len(samples), len(torn_samples)
+    torn_samples, torn_summaries = history.read_history(data[:len(data) // 2])
+    assert 0 < len(torn_samples) < len(samples)
+
+    #reboot after the torn write, then carry on: the new samples must not be stuck behind the tear
+    torn = os.path.join(directory, "torn.bin")
+    with open(torn, "wb") as f:
+        f.write(data[:len(data) // 2])
+    store = history.History(torn, max_bytes=10 * 1024 * 1024)
+    assert store.size < len(data) // 2
+    later = [(date, t_utc, values) for date, t_utc, values in flight(days + 1)][-60:]
+    for date, t_utc, values in later:
+        for name, value in values.items():
+            record[name] = value
+        store.append(date, t_utc, record)
+    store.end_hour()
+    with open(torn, "rb") as f:
+        rebooted_samples, rebooted_summaries = history.read_history(f.read())
+    assert len(rebooted_samples) == len(torn_samples) + 60, (len(rebooted_samples), len(torn_samples))
+    assert rebooted_samples[-1]["minute"] == history.minutes_since_2000(*later[-1][:2])
+    assert os.path.getsize(torn) == store.size
+
+    #rotation keeps the newest data in the current file and the one before in .old
+    small = os.path.join(directory, "small.bin")
+    store = history.History(small, max_bytes=4096)
+    for date, t_utc, values in flight(2):
+        for name, value in values.items():
+            record[name] = value
+        store.append(date, t_utc, record)
+    store.end_hour()
+    assert os.path.getsize(small) <= 4096 and os.path.exists(small + ".old")
+    with open(small, "rb") as f:
+        newest = history.read_history(f.read())[0]
+    assert newest[-1]["minute"] == recorded[2 * 14 * 30 - 1][0]
+
+    per_sample = len(data) / len(samples)
+    print("{} samples, {} hourly summaries in {} bytes: {:.1f} bytes per sample, {:.1f}x smaller than the flight log".format(
+        len(samples), len(summaries), len(data), per_sample, flight_log.RECORD_SIZE / per_sample))
+    print("all checks passed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+'''
+Check the MS5607 integer compensation against the datasheet reference values
+
+Drives the real MS5607 driver through a modeled sensor on the host:
+    python tools/check_ms5607.py
+
+- the datasheet's typical coefficients and D1/D2 give dT, OFF, SENS and P exactly
+- from +40 C down to -45 C the shift-based path matches the datasheet's truncating
+  integer formulas (first and second order) exactly
+- the altitude table stays within 1 m of the barometric formula below 15 km and 5 m up to 40 km
+'''
+import sys
+import os.path
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import fake_machine
+fake_machine.install()
+
+import time
+import spi_device
+
+#datasheet typical values (MS5607-02BA03, "pressure and temperature calculation")
+ROM = [0, 46372, 43981, 29059, 27842, 31553, 28165, 0]
+D1_TYPICAL = 6465444
+D2_TYPICAL = 8077636
+dT_TYPICAL = 68
+OFF_TYPICAL = 5764707214
+SENS_TYPICAL = 3039050829
+P_TYPICAL = 110002 #Pa, 1100.02 mbar
+
+class SensorModel:
+    '''
+    Answers the MS5607 SPI commands with fixed PROM words and whatever D1/D2 are set
+    '''
+    def __init__(self, rom):
+        self.rom = rom
+        self.d1 = D1_TYPICAL
+        self.d2 = D2_TYPICAL
+        self.command = 0
+        self.adc = 0
+
+    def write(self, data):
+        self.command = data[0]
+        if 0x40 <= self.command < 0x50:
+            self.adc = self.d1
+        elif 0x50 <= self.command < 0x60:
+            self.adc = self.d2
+
+    def read(self, nbytes):
+        if self.command >= 0xA0:
+            return self.rom[(self.command - 0xA0) // 2].to_bytes(2, "big")
+        return self.adc.to_bytes(3, "big")
+
+def c_div(a, b):
+    '''
+    Integer division truncating toward zero, as the datasheet's int64 C code does
+    '''
+    q = abs(a) // b
+    return q if a >= 0 else -q
+
+def reference(D1, D2):
+    '''
+    Datasheet first and second order compensation, written the way the datasheet spells it out
+    '''
+    C1, C2, C3, C4, C5, C6 = ROM[1:7]
+
+    dT = D2 - C5 * 2 ** 8
+    TEMP = 2000 + c_div(dT * C6, 2 ** 23)
+    OFF = C2 * 2 ** 17 + c_div(C4 * dT, 2 ** 6)
+    SENS = C1 * 2 ** 16 + c_div(C3 * dT, 2 ** 7)
+
+    if TEMP < 2000:
+        T2 = c_div(dT ** 2, 2 ** 31)
+        OFF2 = c_div(61 * (TEMP - 2000) ** 2, 2 ** 4)
+        SENS2 = 2 * (TEMP - 2000) ** 2
+        if TEMP < -1500:
+            OFF2 += 15 * (TEMP + 1500) ** 2
+            SENS2 += 8 * (TEMP + 1500) ** 2
+        TEMP -= T2
+        OFF -= OFF2
+        SENS -= SENS2
+
+    P = c_div(c_div(D1 * SENS, 2 ** 21) - OFF, 2 ** 15)
+    return TEMP, P
+
+def legacy_compensate(D1, D2):
+    '''
+    The float compensation the driver used before, first order only
+    '''
+    C1, C2, C3, C4, C5, C6 = ROM[1:7]
+
+    dT = D2 - C5 * 256
+    OFF = C2 * (2 ** 17) + (C4 * dT) / (2 ** 6)
+    SENS = C1 * (2 ** 16) + (C3 * dT) / (2 ** 7)
+
+    P = (D1 * SENS / (2 ** 21) - OFF) / (2 ** 15)
+    T = 2000 + dT * (C6 / (2 ** 23))
+    A = 44330 * (1 - (P / 100 / 1013) ** (1 / 5.255))
+
+    return {"p_mbar": P / 100,
+            "t_c": T / 100,
+            "alt_m": A}
+
+def altitude_formula(p_pa):
+    return 44330 * (1 - (p_pa / spi_device.ALTITUDE_P_REF_PA) ** (1 / 5.255))
+
+def main():
+    model = SensorModel(ROM)
+    spi = fake_machine.SPI()
+    spi.attach(model)
+    altimeter = spi_device.MS5607(spi, fake_machine.Pin(5))
+
+    #first order, datasheet vector
+    dT = D2_TYPICAL - altimeter.T_REF
+    assert dT == dT_TYPICAL, dT
+    assert altimeter.OFF_T1 + ((altimeter.TCO * dT) >> 6) == OFF_TYPICAL
+    assert altimeter.SENS_T1 + ((altimeter.TCS * dT) >> 7) == SENS_TYPICAL
+    TEMP, P = altimeter.compensate_raw(D1_TYPICAL, D2_TYPICAL)
+    assert P == P_TYPICAL, P
+    assert TEMP == 2000, TEMP #dT * C6 / 2^23 = 0.23, below one LSB
+
+    result = altimeter.get_pressure_and_temperature()
+    assert result["p_mbar"] == 1100.02, result
+    print("datasheet vector: dT={} OFF={} SENS={} P={} Pa TEMP={}".format(dT, OFF_TYPICAL, SENS_TYPICAL, P, TEMP))
+
+    #second order, sweep the temperature reading through the cold regime
+    worst_t = 0
+    worst_p = 0
+    checked = 0
+    for D2 in range(D2_TYPICAL - 2000000, D2_TYPICAL + 600000, 4001):
+        for D1 in (D1_TYPICAL - 2500000, D1_TYPICAL, D1_TYPICAL + 1500000):
+            TEMP, P = altimeter.compensate_raw(D1, D2)
+            TEMP_ref, P_ref = reference(D1, D2)
+            worst_t = max(worst_t, abs(TEMP - TEMP_ref))
+            worst_p = max(worst_p, abs(P - P_ref))
+            checked += 1
+
+    TEMP_cold, P_cold = altimeter.compensate_raw(D1_TYPICAL, D2_TYPICAL - 2000000)
+    assert TEMP_cold < -1500, TEMP_cold #the sweep really reaches the very cold branch
+    assert worst_t == 0 and worst_p == 0, (worst_t, worst_p)
+    print("{} readings from {:.1f} C to {:.1f} C: worst difference {} x 0.01 C, {} Pa".format(
+        checked, TEMP_cold / 100, altimeter.compensate_raw(D1_TYPICAL, D2_TYPICAL + 600000)[0] / 100,
+        worst_t, worst_p))
+
+    #altitude table
+    worst_low = 0
+    worst_high = 0
+    for p_pa in range(300, 107000, 7):
+        expected = altitude_formula(p_pa)
+        if not spi_device.ALTITUDE_MIN_M <= expected <= spi_device.ALTITUDE_MAX_M:
+            continue
+        error = abs(spi_device.altitude_from_pa(p_pa) - expected)
+        if expected < 15000:
+            worst_low = max(worst_low, error)
+        else:
+            worst_high = max(worst_high, error)
+    assert worst_low <= 1 and worst_high <= 5, (worst_low, worst_high)
+    print("altitude table: {} entries, worst error {:.2f} m below 15 km, {:.2f} m above".format(
+        len(spi_device.ALTITUDE_TABLE_PA), worst_low, worst_high))
+
+    #cost against the float path it replaced
+    iterations = 20000
+    t_start = time.ticks_us()
+    for i in range(iterations):
+        altimeter.compensate(D1_TYPICAL, D2_TYPICAL - 3000000)
+    t_int = time.ticks_diff(time.ticks_us(), t_start) / iterations
+
+    t_start = time.ticks_us()
+    for i in range(iterations):
+        legacy_compensate(D1_TYPICAL, D2_TYPICAL - 3000000)
+    t_float = time.ticks_diff(time.ticks_us(), t_start) / iterations
+    print("compensate + altitude: {:.2f} us integer (second order), {:.2f} us float (first order only)".format(
+        t_int, t_float))
+
+    print("all checks passed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+'''
+Check that SymbolTimer keeps WSPR symbol boundaries on GPS time
+
+Runs the real symbol_timer.SymbolTimer against a simulated clock on the host:
+    python tools/check_symbol_timer.py
+
+The RP2040 crystal is modeled as running fast or slow by a few tens of ppm against GPS time,
+PPS edges arrive on exact GPS seconds but are stamped a few us late by the hard IRQ, and every
+one-shot fires a little late. For each case the 163 boundaries of a message are compared with
+the exact n * 8192/12000 s schedule, next to what the old free running 683 ms periodic timer
+would have produced. The locked case is run again with some edges stamped milliseconds late
+(interrupts held off by a flash write), which must not move the boundaries after them.
+
+It also plays a message through Balloon's tone path with boundaries whose bus work was still
+pending when the next one came (dropped callbacks), including the last one: the message must
+still end with the output disabled and the transmission marked done.
+'''
+import sys
+import os.path
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import fake_machine
+fake_machine.install()
+
+import time
+import symbol_timer
+import balloon
+import instrument
+
+SYMBOL_S = 8192 / 12000
+SYMBOLS = 162
+IRQ_LATENCY_US = 15 #how late a one-shot callback runs after its alarm
+PPS_LATENCY_US = 3 #how late the PPS hard IRQ stamps an edge
+LATE_PPS_US = 5000 #stamp of an edge whose IRQ was held off
+
+class Clock:
+    '''
+    GPS time in us, and the RP2040's ticks_us() that run ppm off it
+    '''
+    def __init__(self, ppm: float):
+        self.ppm = ppm
+        self.gps_us = 0.0
+
+    def ticks_us(self):
+        return int(self.gps_us * (1 + self.ppm / 1000000)) & fake_machine.TICKS_MASK
+
+    def gps_at_ticks(self, ticks: int):
+        return ticks / (1 + self.ppm / 1000000)
+
+def run(ppm: float, pps_sync: bool = True, late_edges=()):
+    '''
+    Play one message, returns the worst boundary error against GPS time in us
+
+    Args:
+        late_edges: PPS edges (counted from the start edge, 1) stamped LATE_PPS_US late
+    '''
+    clock = Clock(ppm)
+    time.ticks_us = clock.ticks_us
+    time.ticks_ms = lambda: clock.ticks_us() // 1000
+
+    boundaries = []
+    timer = symbol_timer.SymbolTimer(lambda index: boundaries.append(clock.gps_us), SYMBOLS)
+
+    #the message starts on the PPS edge at GPS second 1
+    clock.gps_us = 1000000.0 + PPS_LATENCY_US
+    timer.start(clock.ticks_us(), 1)
+    boundaries[0] = 1000000.0 #symbol 0 starts on the edge itself
+    edge = 1
+
+    while timer.running:
+        #next one-shot, in GPS time, as armed from the current ticks
+        armed_ticks = clock.ticks_us() + timer.timer.period
+        fire_us = clock.gps_at_ticks(armed_ticks) + IRQ_LATENCY_US
+        next_pps_us = (edge + 1) * 1000000.0
+
+        if pps_sync and next_pps_us < fire_us:
+            edge += 1
+            clock.gps_us = next_pps_us + (LATE_PPS_US if edge in late_edges else PPS_LATENCY_US)
+            timer.pps_edge(edge, clock.ticks_us())
+
+            #the armed boundary keeps its alarm, rearm only if it was not yet reached
+            clock.gps_us = fire_us
+            timer.timer.fire()
+        else:
+            clock.gps_us = fire_us
+            timer.timer.fire()
+
+    worst = 0
+    for index, t_us in enumerate(boundaries):
+        exact = 1000000 + index * SYMBOL_S * 1000000
+        worst = max(worst, abs(t_us - exact))
+    assert len(boundaries) == SYMBOLS + 1, len(boundaries)
+    return worst
+
+def legacy(ppm: float):
+    '''
+    Worst boundary error of the old periodic 683 ms timer started on the same edge
+    '''
+    worst = 0
+    for index in range(SYMBOLS + 1):
+        t_us = index * 683000 / (1 + ppm / 1000000) + IRQ_LATENCY_US * (index > 0)
+        worst = max(worst, abs(t_us - index * SYMBOL_S * 1000000))
+    return worst
+
+class Clockgen:
+    '''
+    Records what the tone path does to the Si5351
+    '''
+    def __init__(self):
+        self.enabled = False
+        self.tones = []
+
+    def write_pll_image(self, pll: int, image):
+        self.tones.append(image)
+
+    def enable_output(self, output: int, enabled: bool):
+        self.enabled = enabled
+
+class Flag:
+    def __init__(self):
+        self.is_set = False
+
+    def set(self):
+        self.is_set = True
+
+def dropped_callbacks(dropped):
+    '''
+    Play a message through Balloon.tone_interrupt()/transmit_next_tone(), leaving the scheduled
+    work queued across the boundaries in dropped so the next one finds it still pending
+    '''
+    b = balloon.Balloon.__new__(balloon.Balloon)
+    b.clockgen = Clockgen()
+    b.output = 0
+    b.message = bytearray(index % 4 for index in range(SYMBOLS))
+    b.tone_images = [0, 1, 2, 3] #tone images stand in as the tone numbers
+    b.instrument = instrument.Instrument(enabled=False)
+    b.tone_isr_slot = 0
+    b.tx_done_flag = Flag()
+    b.symbol_ticks = [0] * (SYMBOLS + 1)
+    b.tone_work = b.transmit_next_tone
+    b.tone_index = 0
+    b.tone_pending = False
+    b.tone_overruns = 0
+    b.tone_symbol = 0
+    b.symbol_timer = symbol_timer.SymbolTimer(b.tone_interrupt, SYMBOLS)
+
+    b.symbol_timer.start(time.ticks_us(), 1)
+    fake_machine.run_scheduled()
+    while b.symbol_timer.running:
+        b.symbol_timer.timer.fire()
+        if b.symbol_timer.index not in dropped:
+            fake_machine.run_scheduled()
+    fake_machine.run_scheduled()
+
+    assert b.tone_overruns == len(dropped), b.tone_overruns
+    assert not b.clockgen.enabled, "carrier left on"
+    assert b.tone_index == 163 and b.tx_done_flag.is_set and not b.symbol_timer.running
+    #the work catches up to the newest boundary, only tones overtaken twice are skipped
+    assert SYMBOLS - len(dropped) <= len(b.clockgen.tones) <= SYMBOLS, len(b.clockgen.tones)
+    return b
+
+def main():
+    print("{:>8} {:>16} {:>16} {:>16}".format("ppm", "pps locked us", "unlocked us", "683 ms timer us"))
+    for ppm in (-50, -10, 0, 10, 50):
+        locked = run(ppm)
+        unlocked = run(ppm, pps_sync=False)
+        print("{:>8} {:>16.1f} {:>16.1f} {:>16.1f}".format(ppm, locked, unlocked, legacy(ppm)))
+
+        #a boundary may be off by the IRQ and PPS stamp latencies, the sub-us remainder and the
+        #drift since the sync it was armed from (up to one second plus one symbol)
+        bound = IRQ_LATENCY_US + PPS_LATENCY_US + 2 + abs(ppm) * (1 + SYMBOL_S)
+        assert locked <= bound, locked
+        assert legacy(ppm) > 40000 #the old timer ends ~54 ms early, give or take the crystal
+
+        #late stamps are ignored, so the boundaries after them only drift for a second longer
+        late = run(ppm, late_edges=(5, 6, 60))
+        assert late <= bound + abs(ppm) * 2, late
+
+    #a dropped boundary mid-message, and the last tone's bus work still pending at the end
+    for dropped in ((), (100,), (100, 161), (5, 6, 7)):
+        dropped_callbacks(dropped)
+    print("dropped tone callbacks: output disabled and message done every time")
+
+    print("all checks passed")
+
+if __name__ == "__main__":
+    main()
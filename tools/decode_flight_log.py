@@ -0,0 +1,47 @@
+'''
+Decode a flight log (the flight directory of segment files, see src/flight_log.py) copied off the balloon
+
+    mpremote cp -r :flight .
+    python tools/decode_flight_log.py flight                  (CSV on stdout)
+    python tools/decode_flight_log.py flight --pickle out.pkl  (pandas DataFrame)
+
+Records come out oldest first; records that fail their CRC are left out.
+'''
+import sys
+import os.path
+import argparse
+import csv
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import fake_machine
+fake_machine.install()
+
+import flight_log
+
+def to_dataframe(records):
+    '''
+    Records as a pandas DataFrame indexed by sequence number
+    '''
+    import pandas
+
+    return pandas.DataFrame.from_records(records, index="seq")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path", help="flight log directory")
+    parser.add_argument("--pickle", help="save a pandas DataFrame here instead of printing CSV")
+    args = parser.parse_args()
+
+    records = flight_log.read_log(args.path)
+    print("{} records".format(len(records)), file=sys.stderr)
+
+    if args.pickle:
+        to_dataframe(records).to_pickle(args.pickle)
+    elif records:
+        writer = csv.DictWriter(sys.stdout, fieldnames=list(records[0].keys()))
+        writer.writeheader()
+        writer.writerows(records)
+
+if __name__ == "__main__":
+    main()
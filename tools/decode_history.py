@@ -0,0 +1,49 @@
+'''
+Decompress a telemetry history file (history.bin, see src/history.py) copied off the balloon
+
+    mpremote cp :history.bin .
+    python tools/decode_history.py history.bin              (samples as CSV on stdout)
+    python tools/decode_history.py history.bin --summaries  (hourly min/max/mean as CSV)
+
+history.bin.old, if there is one, holds the samples from before the last rotation.
+'''
+import sys
+import os.path
+import argparse
+import csv
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import fake_machine
+fake_machine.install()
+
+import history
+
+EPOCH = datetime.datetime(2000, 1, 1)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path", help="history file")
+    parser.add_argument("--summaries", action="store_true", help="print the hourly summaries instead of the samples")
+    args = parser.parse_args()
+
+    with open(args.path, "rb") as f:
+        samples, summaries = history.read_history(f.read())
+    print("{} samples, {} hourly summaries".format(len(samples), len(summaries)), file=sys.stderr)
+
+    if args.summaries:
+        rows, key, minutes = summaries, "hour", 60
+    else:
+        rows, key, minutes = samples, "minute", 1
+
+    for row in rows:
+        row["utc"] = (EPOCH + datetime.timedelta(minutes=row[key] * minutes)).isoformat()
+
+    if rows:
+        writer = csv.DictWriter(sys.stdout, fieldnames=["utc"] + [name for name in rows[0] if name != "utc"])
+        writer.writeheader()
+        writer.writerows(rows)
+
+if __name__ == "__main__":
+    main()
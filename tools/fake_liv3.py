@@ -0,0 +1,185 @@
+'''
+Host-side fake Teseo LIV3 receiver for exercising LIV3.configure() without hardware
+
+The fake answers the $PSTM configuration commands the driver sends, keeps a current and a
+saved configuration block like the real module, only switches baud rate and message list on
+$PSTMSRR, and streams one NMEA epoch per fix period. When the two ends disagree on baud rate
+the driver gets line noise instead of sentences, and the module ignores what it is sent.
+
+    python tools/fake_liv3.py      (runs the boot scenarios below)
+'''
+import sys
+import time
+
+try:
+    import os.path
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+except ImportError:
+    pass
+
+import fake_machine
+fake_machine.install()
+
+import machine
+import uart_device
+
+#message list bits for the rest of the default output, only so the default epoch looks real
+OTHER_SENTENCE_BITS = {"VTG": 0x10,
+                       "GSV": 0x80000,
+                       "GLL": 0x100000}
+
+SENTENCE_BODIES = {"GGA": "GPGGA,{t},3725.6500,N,12210.1820,W,1,08,0.9,1250.4,M,-30.0,M,,",
+                   "GSA": "GPGSA,A,3,02,05,12,13,15,18,20,25,,,,,1.6,0.9,1.3",
+                   "RMC": "GPRMC,{t},A,3725.6500,N,12210.1820,W,17.90,71.20,171026,13.2,E,A",
+                   "VTG": "GPVTG,71.20,T,,M,17.90,N,33.15,K,A",
+                   "GSV": "GPGSV,3,1,11,02,42,084,38,05,61,301,41,12,23,045,33,13,10,210,29",
+                   "GLL": "GPGLL,3725.6500,N,12210.1820,W,{t},A,A"}
+
+DEFAULT_PARAMS = {201: 0x2 | 0x4 | 0x40 | 0x10 | 0x80000 | 0x100000,
+                  102: 0x5, #9600 baud
+                  303: 1.0}
+
+class FakeLIV3(fake_machine.UART):
+    def __init__(self, acks: bool = True, saved=None, **kwargs):
+        super().__init__(**kwargs)
+        self.acks = acks #False models a module that ignores $PSTM commands
+
+        self.saved = dict(DEFAULT_PARAMS)
+        if saved is not None:
+            self.saved.update(saved)
+        self.reset_module()
+
+        self.command_buffer = bytearray()
+        self.epochs = 0
+        self.nmea_bytes = 0
+
+    def reset_module(self):
+        '''
+        What $PSTMSRR and a power cycle do: reload the saved block and restart the output
+        '''
+        self.params = dict(self.saved)
+        self.module_baudrate = [baud for baud, code in uart_device.LIV3_BAUD_CODES.items()
+                                if code == self.params[102]][0]
+        self.seconds = 0
+        self.next_epoch = time.ticks_ms()
+
+    def baud_matches(self):
+        return self.module_baudrate == self.baudrate
+
+    def send(self, body: str):
+        line = uart_device.nmea_command(body)
+
+        if self.baud_matches():
+            self.rx.extend(line)
+        else:
+            self.rx.extend(bytes((b * 37 + 11) & 0xFF for b in line)) #framing garbage
+        return len(line)
+
+    def any(self):
+        if time.ticks_diff(time.ticks_ms(), self.next_epoch) >= 0:
+            self.next_epoch = time.ticks_add(self.next_epoch, int(1000 / float(self.params[303])))
+            self.seconds += 1
+            self.epochs += 1
+
+            t = "1758{:02d}.00".format(self.seconds % 60)
+            for sentence in ("GGA", "GSA", "GSV", "RMC", "VTG", "GLL"):
+                bit = uart_device.LIV3_NMEA_MASK_BITS.get(sentence, OTHER_SENTENCE_BITS.get(sentence))
+                if self.params[201] & bit:
+                    self.nmea_bytes += self.send(SENTENCE_BODIES[sentence].format(t=t))
+
+        return len(self.rx)
+
+    def write(self, data):
+        super().write(data)
+
+        if not self.baud_matches():
+            return len(data) #module sees noise
+
+        self.command_buffer.extend(data)
+        while b"\n" in self.command_buffer:
+            end = self.command_buffer.index(b"\n")
+            line = bytes(self.command_buffer[:end]).strip()
+            del self.command_buffer[:end + 1]
+
+            if self.acks:
+                self.command(line.split(b"*")[0][1:].decode())
+
+        return len(data)
+
+    def command(self, body: str):
+        fields = body.split(",")
+
+        if fields[0] == "PSTMSETPAR":
+            param_id = int(fields[1]) % 1000
+            value = fields[2]
+            mode = int(fields[3]) if len(fields) > 3 else 0
+
+            if param_id == 303:
+                self.params[param_id] = float(value)
+            else:
+                value = int(value, 16)
+                if mode == 1:
+                    value |= self.params[param_id]
+                elif mode == 2:
+                    value &= self.params[param_id]
+                self.params[param_id] = value
+            self.send("PSTMSETPAROK,{}".format(fields[1]))
+
+        elif fields[0] == "PSTMGETPAR":
+            param_id = int(fields[1]) % 1000
+            if param_id == 303:
+                self.send("PSTMSETPAR,{},{:.1f}".format(fields[1], self.params[param_id]))
+            else:
+                self.send("PSTMSETPAR,{},0x{:08X}".format(fields[1], self.params[param_id]))
+
+        elif fields[0] == "PSTMSAVEPAR":
+            self.saved = dict(self.params)
+            self.send("PSTMSAVEPAROK")
+
+        elif fields[0] == "PSTMRESTOREPAR":
+            self.saved = dict(DEFAULT_PARAMS)
+            self.send("PSTMRESTOREPAROK")
+
+        elif fields[0] == "PSTMSRR":
+            self.reset_module()
+
+def bytes_per_epoch(uart, gps):
+    '''
+    NMEA bytes the module sends per fix once the driver is done configuring it
+    '''
+    gps.listen(100)
+    nmea_bytes, epochs = uart.nmea_bytes, uart.epochs
+    gps.listen(2100)
+
+    if uart.epochs == epochs:
+        return 0
+    return (uart.nmea_bytes - nmea_bytes) / (uart.epochs - epochs)
+
+def scenario(name, uart, **config):
+    gps = uart_device.LIV3(uart, machine.Pin(15), machine.Pin(14), machine.Pin(18))
+
+    print("--- {}".format(name))
+    t_start = time.ticks_ms()
+    result = gps.configure(**config)
+
+    print("configured: {}, UART at {} baud, module at {} baud, took {} ms, {:.0f} NMEA bytes/epoch".format(
+        result, uart.baudrate, uart.module_baudrate, time.ticks_diff(time.ticks_ms(), t_start),
+        bytes_per_epoch(uart, gps)))
+    return result
+
+def main():
+    config = {"sentences": ("GGA", "RMC"), "baudrate": 115200, "fix_rate_hz": 1.0}
+
+    assert scenario("factory fresh module", FakeLIV3(), **config)
+
+    configured = {201: 0x42, 102: uart_device.LIV3_BAUD_CODES[115200]}
+    assert scenario("module configured on a previous boot", FakeLIV3(saved=configured), **config)
+
+    uart = FakeLIV3(acks=False)
+    assert not scenario("module ignoring $PSTM commands", uart, **config)
+    assert uart.baudrate == 9600
+
+    print("all scenarios behaved")
+
+if __name__ == "__main__":
+    main()
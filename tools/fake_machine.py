@@ -0,0 +1,241 @@
+'''
+Minimal host-side stand-in for the MicroPython machine module
+
+Only covers what the host tools need to drive the firmware drivers under CPython.
+Call install() before importing any firmware module that does "import machine".
+'''
+import sys
+import time
+import types
+
+TICKS_MASK = (1 << 30) - 1
+TICKS_HALF = 1 << 29
+
+def install():
+    '''
+    Register this module as "machine" unless a real one is available
+    '''
+    if "machine" not in sys.modules:
+        sys.modules["machine"] = sys.modules[__name__]
+    
+    #micropython.schedule() queues onto scheduled, run_scheduled() plays the queue
+    if "micropython" not in sys.modules:
+        micropython = types.ModuleType("micropython")
+        micropython.schedule = schedule
+        micropython.const = lambda value: value
+        sys.modules["micropython"] = micropython
+    
+    #firmware modules expect the MicroPython time extensions
+    if not hasattr(time, "ticks_us"):
+        #ticks wrap at 2^30 like on the RP2040, so they fit small ints and 'i' arrays
+        time.ticks_us = lambda: (time.perf_counter_ns() // 1000) & TICKS_MASK
+        time.ticks_ms = lambda: (time.perf_counter_ns() // 1000000) & TICKS_MASK
+        time.ticks_diff = lambda a, b: ((a - b + TICKS_HALF) & TICKS_MASK) - TICKS_HALF
+        time.ticks_add = lambda a, b: (a + b) & TICKS_MASK
+        time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+        time.sleep_us = lambda us: time.sleep(us / 1000000)
+
+scheduled = []
+
+def schedule(function, arg):
+    scheduled.append((function, arg))
+
+def run_scheduled():
+    '''
+    Run everything micropython.schedule() queued, like the VM does between bytecodes
+    '''
+    while scheduled:
+        function, arg = scheduled.pop(0)
+        function(arg)
+
+_freq = 125000000
+
+def freq(hz=None):
+    global _freq
+    if hz is not None:
+        _freq = hz
+    return _freq
+
+def lightsleep(ms=None):
+    time.sleep_ms(ms)
+
+class Pin:
+    IN = 0
+    OUT = 1
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+    
+    def __init__(self, pin_id, mode=IN, value=0):
+        self.pin_id = pin_id
+        self.mode = mode
+        self._value = value
+        self.handler = None
+        
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        self._value = v
+        
+    def irq(self, trigger=IRQ_RISING, handler=None, hard=False):
+        self.handler = handler
+        self.hard = hard
+
+class I2C:
+    '''
+    I2C bus with register-mapped devices attached
+    
+    Every transaction is counted, along with the number of bit times it holds the bus
+    (start + address/register/data bytes with ACK + stop), so bus time can be modeled
+    '''
+    def __init__(self, id=0, scl=None, sda=None, freq=100000, timeout=0):
+        self.freq = freq
+        self.devices = {}
+        self.reset_stats()
+        
+    def add_device(self, address: int, size: int = 256):
+        self.devices[address] = bytearray(size)
+        return self.devices[address]
+    
+    def reset_stats(self):
+        self.transactions = 0
+        self.bits = 0
+        
+    def bus_time_us(self):
+        return self.bits * 1000000 / self.freq
+    
+    def _count(self, address_bytes: int, data_bytes: int, read: bool):
+        self.transactions += 1
+        self.bits += 2 + 9 * (1 + address_bytes + data_bytes)
+        if read:
+            self.bits += 1 + 9 #repeated start + address
+    
+    def writeto_mem(self, address, register, buffer, addrsize=8):
+        regs = self.devices[address]
+        for i in range(len(buffer)):
+            regs[(register + i) % len(regs)] = buffer[i]
+        self._count(addrsize // 8, len(buffer), False)
+        
+    def readfrom_mem_into(self, address, register, buffer, addrsize=8):
+        regs = self.devices[address]
+        for i in range(len(buffer)):
+            buffer[i] = regs[(register + i) % len(regs)]
+        self._count(addrsize // 8, len(buffer), True)
+        
+    def readfrom_mem(self, address, register, nbytes, addrsize=8):
+        buffer = bytearray(nbytes)
+        self.readfrom_mem_into(address, register, buffer, addrsize=addrsize)
+        return bytes(buffer)
+
+SoftI2C = I2C
+
+class UART:
+    '''
+    UART whose RX side is fed from the host with feed()
+    Everything written by the firmware is kept in tx for inspection
+    '''
+    def __init__(self, id=0, baudrate=9600, tx=None, rx=None, timeout=0, rxbuf=256):
+        self.baudrate = baudrate
+        self.rx = bytearray()
+        self.tx = bytearray()
+        
+    def init(self, baudrate=9600, **kwargs):
+        self.baudrate = baudrate
+        
+    def feed(self, data):
+        self.rx.extend(data)
+        
+    def any(self):
+        return len(self.rx)
+    
+    def readinto(self, buffer, nbytes=None):
+        if nbytes is None:
+            nbytes = len(buffer)
+        n = min(nbytes, len(self.rx))
+        if n == 0:
+            return None
+        buffer[0:n] = self.rx[0:n]
+        del self.rx[0:n]
+        return n
+    
+    def readline(self):
+        end = self.rx.find(b'\n')
+        if end < 0:
+            end = len(self.rx) - 1
+        if end < 0:
+            return None
+        line = bytes(self.rx[0:end + 1])
+        del self.rx[0:end + 1]
+        return line
+    
+    def write(self, data):
+        self.tx.extend(data)
+        return len(data)
+    
+    def flush(self):
+        pass
+
+class SPI:
+    '''
+    SPI bus with one device model attached, the model provides write(data) and read(nbytes)
+    '''
+    MSB = 0
+    LSB = 1
+    
+    def __init__(self, id=0, baudrate=1000000, polarity=0, phase=0, bits=8, firstbit=MSB,
+                 sck=None, mosi=None, miso=None):
+        self.baudrate = baudrate
+        self.device = None
+        
+    def attach(self, device):
+        self.device = device
+        
+    def write(self, data):
+        self.device.write(data)
+        
+    def read(self, nbytes, write=0x00):
+        return self.device.read(nbytes)
+
+SoftSPI = SPI
+
+class ADC:
+    '''
+    ADC input whose reading is set from the host
+    '''
+    def __init__(self, pin):
+        self.pin = pin
+        self.raw = 0
+        
+    def read_u16(self):
+        return self.raw
+
+class Timer:
+    '''
+    Timer that never fires on its own, the host calls fire() to run the callback
+    '''
+    ONE_SHOT = 0
+    PERIODIC = 1
+    
+    def __init__(self, id=-1, mode=PERIODIC, period=-1, freq=-1, tick_hz=1000000, callback=None, hard=False):
+        self.callback = None
+        self.init(mode=mode, period=period, freq=freq, tick_hz=tick_hz, callback=callback, hard=hard)
+        
+    def init(self, mode=PERIODIC, period=-1, freq=-1, tick_hz=1000, callback=None, hard=False):
+        self.mode = mode
+        self.period = period
+        self.freq = freq
+        self.tick_hz = tick_hz
+        self.callback = callback
+        self.hard = hard
+        
+    def deinit(self):
+        self.callback = None
+        
+    def fire(self):
+        if self.callback is not None:
+            self.callback(self)
+
+def disable_irq():
+    return 0
+
+def enable_irq(state=0):
+    pass
@@ -0,0 +1,46 @@
+'''
+Tabulate the Si5351 frequency plan the firmware will use on every WSPR band
+
+    python tools/si5351_plans.py [offset_hz] [correction_hz]
+'''
+import sys
+import os.path
+from fractions import Fraction
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import fake_machine
+fake_machine.install()
+
+import i2c_device
+
+def plan_frequency(plan, pll_a, pll_b, pll_c, xtal_hz=i2c_device.SI5351_XTAL_HZ):
+    #exact, a float can't resolve uHz on a 144 MHz carrier
+    vco_hz = xtal_hz * (pll_a + Fraction(pll_b, pll_c))
+    return vco_hz / (plan['output_divider'] << plan['r_div'])
+
+def main():
+    offset = float(sys.argv[1]) if len(sys.argv) > 1 else 100.0
+    correction = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    spacing = 1.465 #WSPR tone spacing the firmware uses
+    
+    print("offset = {} Hz, correction = {} Hz".format(offset, correction))
+    print("{:<6} {:>11} {:>5} {:>3} {:>9} {:>3} {:>8} {:>8} {:>12} {:>14}".format(
+        "band", "base (Hz)", "div", "R", "VCO (MHz)", "a", "b", "c", "tone0 err Hz", "spacing err Hz"))
+    
+    for band in i2c_device.WSPR_BANDS:
+        plan = i2c_device.wspr_tone_plan(band, offset, correction, spacing)
+        
+        tones = [plan_frequency(plan, a, b, c) for a, b, c in plan['tones']]
+        target = plan['f_hz'] + Fraction(offset) + correction
+        spacing_err = max(abs((tones[i + 1] - tones[i]) - Fraction(spacing)) for i in range(3))
+        
+        print("{:<6} {:>11} {:>5} {:>3} {:>9.3f} {:>3} {:>8} {:>8} {:>12.6f} {:>14.6f}".format(
+            band, plan['f_hz'], plan['output_divider'], 1 << plan['r_div'], plan['vco_hz'] / 1e6,
+            *plan['tones'][0], float(tones[0] - target), float(spacing_err)))
+        
+        assert abs(tones[0] - target) < Fraction(1, 1000), band
+        assert spacing_err < Fraction(1, 1000), band
+
+if __name__ == "__main__":
+    main()